@@ -1,6 +1,9 @@
-from telegram.ext import ApplicationBuilder, MessageHandler, CommandHandler, filters
+import asyncio
+
+from telegram.ext import ApplicationBuilder, MessageHandler, CommandHandler, CallbackQueryHandler, filters
 
 import src.tools.config as config
+from src.tools.concurrency import PerChatUpdateProcessor
 from src.tools.db import init_db
 from src.tools.handlers import (
     on_message,
@@ -10,15 +13,51 @@ from src.tools.handlers import (
     cmd_enable_summaries,
     cmd_disable_summaries,
     cmd_status_summaries,
+    cmd_summary_schedule,
+    cmd_stats,
     cmd_find_all_pets,
+    on_petfinder_page,
+    start_pet_pipeline,
+    stop_pet_pipeline,
+    start_job_delivery,
+    stop_job_delivery,
 )
+from src.tools.partitions import schedule_partition_maintenance
 from src.tools.scheduler import schedule_daily
+from src.tools.sendqueue import OutboundRateLimiter
+from src.tools.webhook import run_webhook
+
+
+async def post_init(app):
+    await start_pet_pipeline(app)
+    await start_job_delivery(app)
+
+
+async def post_shutdown(app):
+    await stop_job_delivery(app)
+    await stop_pet_pipeline(app)
 
 
 def main():
+    if config.TELEGRAM_MODE == "webhook" and config.WEBHOOK_URL and not config.WEBHOOK_SECRET:
+        # Without the secret anyone who finds the URL could inject updates
+        raise SystemExit("TELEGRAM_MODE=webhook requires WEBHOOK_SECRET")
     init_db()
 
-    app = ApplicationBuilder().token(config.TELEGRAM_BOT_TOKEN).build()
+    app = (
+        ApplicationBuilder()
+        .token(config.TELEGRAM_BOT_TOKEN)
+        .concurrent_updates(PerChatUpdateProcessor(config.MAX_CONCURRENT_UPDATES))
+        .rate_limiter(OutboundRateLimiter(
+            global_per_second=config.SEND_GLOBAL_PER_SECOND,
+            chat_per_second=config.SEND_CHAT_PER_SECOND,
+            group_per_minute=config.SEND_GROUP_PER_MINUTE,
+            max_retries=config.SEND_MAX_RETRIES,
+        ))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     app.add_handler(
         MessageHandler(~filters.StatusUpdate.ALL &
@@ -30,15 +69,25 @@ def main():
 
     app.add_handler(CommandHandler("chatid", cmd_chatid))
 
-    app.add_handler(CommandHandler("summary_now", cmd_summary_now))
+    # LLM-bound commands run as background tasks so later updates of the chat are not held up
+    app.add_handler(CommandHandler("summary_now", cmd_summary_now, block=False))
     app.add_handler(CommandHandler("enable_summaries", cmd_enable_summaries))
     app.add_handler(CommandHandler("disable_summaries", cmd_disable_summaries))
     app.add_handler(CommandHandler("status_summaries", cmd_status_summaries))
-    app.add_handler(CommandHandler("petfinder", cmd_find_all_pets))
+    app.add_handler(CommandHandler("summary_schedule", cmd_summary_schedule))
+    app.add_handler(CommandHandler("stats", cmd_stats))
+    app.add_handler(CommandHandler("petfinder", cmd_find_all_pets, block=False))
+    app.add_handler(CallbackQueryHandler(on_petfinder_page, pattern=r"^pf:"))
 
     schedule_daily(app)
+    schedule_partition_maintenance(app)
     config.log.info("Bot started.")
-    app.run_polling(close_loop=False)
+    if config.TELEGRAM_MODE == "webhook" and config.WEBHOOK_URL:
+        asyncio.run(run_webhook(app))
+    else:
+        if config.TELEGRAM_MODE == "webhook":
+            config.log.warning("TELEGRAM_MODE=webhook without WEBHOOK_URL, falling back to polling")
+        app.run_polling(close_loop=False)
 
 
 if __name__ == "__main__":
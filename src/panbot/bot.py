@@ -1,9 +1,7 @@
-import re
+import asyncio
 from datetime import datetime
-from contextlib import closing
 from typing import Any
 
-import orjson as json
 import random
 
 import google.generativeai as genai
@@ -11,13 +9,27 @@ import tiktoken
 from openai import AsyncOpenAI
 
 import src.tools.config as config
+from src.tools import metrics
+from src.panbot.cache import ResponseCache
+from src.panbot.context import ContextWindows, context_digest, render_context
+from src.panbot.memory import ChatMemory
 from src.tools.db import (
-    db,
+    get_recent_messages,
+    get_reply_chain,
+    get_panbot_memory,
+    upsert_panbot_memory,
     get_panbot_usage,
     increment_panbot_usage,
     reset_panbot_usage_for_date,
     is_bot_message
 )
+from src.tools.structured import (
+    PanBotReply,
+    StructuredOutputError,
+    decode,
+    gemini_generation_config,
+    openai_response_format,
+)
 
 try:
     _encoder = tiktoken.encoding_for_model(config.OPENAI_MODEL_NAME)
@@ -31,16 +43,38 @@ class SarcasmLimitExceeded(Exception):
 class PanBot:
     def __init__(self, daily_limit=config.MESSAGES_PER_USER):
         self.daily_limit = daily_limit
+        self.context_windows = ContextWindows(
+            count_tokens=lambda text: len(_encoder.encode(text)),
+            loader=get_recent_messages,
+            max_age_seconds=config.PANBOT_CONTEXT_HOURS * 60 * 60,
+            max_tokens=config.PANBOT_CONTEXT_MAX_TOKENS,
+            chain_loader=get_reply_chain,
+        )
+        self.memory = ChatMemory(
+            condense=self._condense_memory,
+            loader=get_panbot_memory,
+            saver=upsert_panbot_memory,
+            verbatim_tokens=config.PANBOT_TAIL_MAX_TOKENS,
+            condense_after_tokens=config.PANBOT_MEMORY_CONDENSE_TOKENS,
+        )
+        self.response_cache = ResponseCache(
+            max_entries=config.PANBOT_CACHE_MAX_ENTRIES,
+            ttl_seconds=config.PANBOT_CACHE_TTL_SECONDS,
+            max_distance=config.PANBOT_CACHE_MAX_DISTANCE,
+        )
+        self._background_tasks: set[asyncio.Task] = set()
 
         # Initialize AI clients
         if config.GEMINI_API_KEY:
             genai.configure(api_key=config.GEMINI_API_KEY)
             self.gemini_model = genai.GenerativeModel(
                 config.GEMINI_MODEL_NAME,
-                generation_config={"response_mime_type": "application/json"}
+                generation_config=gemini_generation_config(PanBotReply)
             )
+            self.gemini_memory_model = genai.GenerativeModel(config.PANBOT_MEMORY_MODEL["gemini"])
         else:
             self.gemini_model = None
+            self.gemini_memory_model = None
 
         if config.OPENAI_API_KEY:
             self.openai_client = AsyncOpenAI(api_key=config.OPENAI_API_KEY)
@@ -57,8 +91,9 @@ class PanBot:
 
             chat_id = message.chat.id if hasattr(message, 'chat') else None
             reply_to_message_id = message.reply_to_message.message_id
+            reply_to_ts = int(message.reply_to_message.date.timestamp())
 
-            if chat_id and is_bot_message(chat_id, reply_to_message_id):
+            if chat_id and is_bot_message(chat_id, reply_to_message_id, reply_to_ts):
                 return True
 
         # Check for trigger words (initial contact)
@@ -67,57 +102,88 @@ class PanBot:
 
         return any(trigger in text_lower for trigger in bot_triggers)
 
-    def save_message(self, message):
-        """Save a message to the memory/context."""
-        raise NotImplementedError
-
-    @staticmethod
-    def build_conversation_prompt(message, max_tokens: int = 30_000):
+    def save_message(self, chat_id: int, row: dict):
+        """Save a message (same keys as a ``messages`` row) to the chat's rolling context window."""
+        self.context_windows.add(chat_id, row)
+
+    def _context_records(self, message,
+                         thread_max_tokens: int = config.PANBOT_THREAD_MAX_TOKENS,
+                         tail_max_tokens: int = config.PANBOT_TAIL_MAX_TOKENS):
+        """Reply chain and chat tail records a reply to the message is built from."""
+        reply_to = getattr(message, "reply_to_message", None)
+        return self.context_windows.select(
+            chat_id=message.chat.id,
+            message_id=message.message_id,
+            reply_to_message_id=reply_to.message_id if reply_to else None,
+            now_ts=int(message.date.timestamp()),
+            thread_max_tokens=thread_max_tokens,
+            tail_max_tokens=tail_max_tokens,
+            max_depth=config.PANBOT_THREAD_MAX_DEPTH,
+        )
+
+    def build_conversation_prompt(self, message,
+                                  thread_max_tokens: int = config.PANBOT_THREAD_MAX_TOKENS,
+                                  tail_max_tokens: int = config.PANBOT_TAIL_MAX_TOKENS,
+                                  records=None):
         """
-        Build a context prompt including previous thread messages
-        (excluding the current message).
+        Build a context prompt from the chat's condensed long-term memory, the reply
+        chain of the message and a short tail of the latest chat messages
+        (excluding the current message). ``records`` are the ones returned by
+        ``_context_records``, if already selected.
+        No DB access once the chat's rolling window and memory are loaded.
         """
-        # Get recent messages from the same chat for context
-        chat_id = message.chat.id
-        current_time = int(message.date.timestamp())
-
-        # Look back 12 hours for context
-        lookback_seconds = 60 * 60 * 12
-        start_time = current_time - lookback_seconds
-
-        with closing(db()) as conn, closing(conn.cursor()) as cur:
-            # Get recent messages, excluding the current one
-            cur.execute(
-                """SELECT text, full_name, username
-                   FROM messages
-                   WHERE chat_id = %s
-                     AND ts_utc >= %s
-                     AND ts_utc < %s
-                     AND message_id!=%s
-                   ORDER BY ts_utc DESC LIMIT 1000""",
-                (chat_id, start_time, current_time, message.message_id)
+        if records is None:
+            records = self._context_records(message, thread_max_tokens, tail_max_tokens)
+        context = render_context(*records)
+        memory = self.memory.get(message.chat.id).summary
+        if not memory:
+            return context
+        return f"Пам'ять про попередні розмови:\n{memory}\n\n{context}"
+
+    def _cache_context_key(self, message, records) -> str:
+        """
+        Identify the context a reply depends on: the sender (the prompt addresses them by
+        name), the context-window records the prompt is built from and the version of the
+        chat memory.
+        """
+        user_id = message.from_user.id if message.from_user else 0
+        thread, tail = records
+        memory = self.memory.get(message.chat.id)
+        return f"{user_id}:{context_digest(thread + tail)}:{memory.covered_until_ts}"
+
+    async def _condense_memory(self, chat_id: int, previous_summary: str, lines: list[str]) -> str:
+        """Fold new chat lines into the chat's long-term memory with a cheap model call"""
+        transcript = "\n".join(lines)
+        prompt = (
+            f"Онови коротку пам'ять чату (не більше {config.PANBOT_MEMORY_MAX_WORDS} слів). "
+            "Збережи факти, теми, домовленості, хто що питав у бота і що бот відповідав. "
+            "Пиши стисло, українською, без вступів і без форматування.\n\n"
+            f"Поточна пам'ять:\n{previous_summary or '(порожньо)'}\n\n"
+            f"Нові повідомлення:\n{transcript}"
+        )
+        provider = self._determine_ai_provider(chat_id)
+        if provider == "openai":
+            response = await self.openai_client.chat.completions.create(
+                model=config.PANBOT_MEMORY_MODEL["openai"],
+                messages=[{"role": "user", "content": prompt}],
             )
-            rows = cur.fetchall()
-
-        if not rows:
-            return ""
+            return response.choices[0].message.content or ""
+        response = await self.gemini_memory_model.generate_content_async(prompt)
+        return response.text or ""
 
-        context_lines = []
-        used_tokens = 0
-        for row in rows[::-1]:  # Reverse to chronological order
-            name = row["full_name"] or row["username"] or "Учасник"
-            text = (row["text"] or "").strip()
-            if not text:
-                continue
-            text = text[:200]
-            line = f"{name}: {text}"
-            line_tokens = len(_encoder.encode(line))
-            if used_tokens + line_tokens > max_tokens:
-                break
-            context_lines.append(line)
-            used_tokens += line_tokens
+    async def _refresh_memory(self, chat_id: int, now_ts: int):
+        try:
+            window = self.context_windows.get(chat_id, now_ts)
+            if await self.memory.maybe_condense(chat_id, window, now_ts):
+                config.log.info(f"PanBot memory condensed for chat {chat_id}")
+        except Exception as e:
+            config.log.exception(f"PanBot memory refresh failed for chat {chat_id}: {e}")
 
-        return "\n".join(context_lines)
+    def schedule_memory_refresh(self, chat_id: int, now_ts: int):
+        """Condense the chat's memory in the background, off the reply path."""
+        task = asyncio.create_task(self._refresh_memory(chat_id, now_ts))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
 
 
     async def process_reply(self, message):
@@ -139,6 +205,7 @@ class PanBot:
         new_count = increment_panbot_usage(user_id, chat_id, today)
 
         response = await self._generate_sarcastic_response(message)
+        self.schedule_memory_refresh(chat_id, int(message.date.timestamp()))
 
         remaining = self.daily_limit - new_count
         if remaining <= 1:
@@ -178,8 +245,17 @@ class PanBot:
 
     async def _generate_sarcastic_response(self, message) -> Any:
             """Generate a sarcastic response using the appropriate AI provider"""
-            context = self.build_conversation_prompt(message)
             user_message = message.text or ""
+            records = self._context_records(message)
+            cache_key = self._cache_context_key(message, records)
+            cached = self.response_cache.get(message.chat.id, cache_key, user_message)
+            if cached is not None:
+                metrics.incr("panbot_cache_hits")
+                config.log.info(f"PanBot cache hit in chat {message.chat.id}")
+                return cached
+            metrics.incr("panbot_cache_misses")
+
+            context = self.build_conversation_prompt(message, records=records)
             user_name = message.from_user.full_name if message.from_user else "Невідомий пасажир"
 
             provider = self._determine_ai_provider(message.chat.id)
@@ -241,23 +317,26 @@ class PanBot:
                              "content": "Ти іронічний український чат-бот, який адаптує свій стиль спілкування залежно від тону співрозмовника. Завжди відповідай у JSON форматі."},
                             {"role": "user", "content": prompt}
                         ],
-                        response_format={"type": "json_object"}
+                        response_format=openai_response_format(PanBotReply)
                     )
                     content = response.choices[0].message.content
-                    data = json.loads(content)
-                    return data.get("response", "Вибачте, мій сарказм зламався 🤖")
+                    try:
+                        text = decode(content, PanBotReply).response
+                    except StructuredOutputError:
+                        return "Вибачте, мій сарказм зламався 🤖"
+                    self.response_cache.put(message.chat.id, cache_key, user_message, text)
+                    return text
 
                 elif provider == "gemini":
                     response = self.gemini_model.generate_content(prompt)
                     raw_text = response.text or ""
-                    # Try to extract JSON from the response
-                    match = re.search(r'\{.*\}', raw_text, re.DOTALL)
-                    if match:
-                        data = json.loads(match.group(0))
-                        return data.get("response", "Мій сарказм десь загубився 🤷‍♂️")
-                    else:
+                    try:
+                        text = decode(raw_text, PanBotReply).response
+                    except StructuredOutputError:
                         # Fallback if no JSON found
                         return raw_text or "Схоже, я втратив дар мовлення... Це серйозно 😐"
+                    self.response_cache.put(message.chat.id, cache_key, user_message, text)
+                    return text
 
             except Exception as e:
                 config.log.exception("Error generating sarcastic response: %s", e)
@@ -0,0 +1,104 @@
+import hashlib
+import re
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from dataclasses import dataclass
+
+_NON_WORD_RE = re.compile(r"[^\w\s]+")
+_SPACE_RE = re.compile(r"\s+")
+SIMHASH_BITS = 64
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase, drop punctuation/emoji and collapse whitespace."""
+    text = _NON_WORD_RE.sub(" ", (text or "").lower())
+    return _SPACE_RE.sub(" ", text).strip()
+
+
+def _hash64(token: str) -> int:
+    return int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def simhash(text: str, shingle: int = 3) -> int:
+    """64-bit SimHash over character shingles of already normalised text."""
+    if len(text) <= shingle:
+        shingles = [text]
+    else:
+        shingles = [text[i:i + shingle] for i in range(len(text) - shingle + 1)]
+    weights = [0] * SIMHASH_BITS
+    for sh in shingles:
+        h = _hash64(sh)
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += 1 if (h >> bit) & 1 else -1
+    return sum(1 << bit for bit, w in enumerate(weights) if w > 0)
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+@dataclass(slots=True)
+class _Entry:
+    fingerprint: int
+    response: str
+    expires_at: float
+
+
+class ResponseCache:
+    """
+    LRU + TTL cache of PanBot responses keyed on (chat, context hash, normalised text).
+    A miss on the exact text falls back to near-duplicate matching by SimHash
+    within the same chat and context.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, max_distance: int,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_distance = max_distance
+        self.clock = clock
+        self._entries: OrderedDict[tuple, _Entry] = OrderedDict()
+        self._buckets: dict[tuple, set[tuple]] = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _drop(self, key: tuple):
+        self._entries.pop(key, None)
+        bucket = self._buckets.get(key[:2])
+        if bucket is not None:
+            bucket.discard(key)
+            if not bucket:
+                del self._buckets[key[:2]]
+
+    def get(self, chat_id: int, context_key: str, text: str) -> str | None:
+        norm = normalize_text(text)
+        now = self.clock()
+        key = (chat_id, context_key, norm)
+
+        candidates = [key] if key in self._entries else []
+        if not candidates:
+            fingerprint = simhash(norm)
+            candidates = [
+                k for k in self._buckets.get(key[:2], ())
+                if hamming(self._entries[k].fingerprint, fingerprint) <= self.max_distance
+            ]
+
+        for k in candidates:
+            entry = self._entries[k]
+            if entry.expires_at <= now:
+                self._drop(k)
+                continue
+            self._entries.move_to_end(k)
+            return entry.response
+        return None
+
+    def put(self, chat_id: int, context_key: str, text: str, response: str):
+        norm = normalize_text(text)
+        key = (chat_id, context_key, norm)
+        self._drop(key)
+        self._entries[key] = _Entry(simhash(norm), response, self.clock() + self.ttl_seconds)
+        self._buckets.setdefault(key[:2], set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
@@ -0,0 +1,225 @@
+import hashlib
+from collections import deque
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass
+
+MAX_LINE_CHARS = 200
+
+
+@dataclass(slots=True)
+class ContextRecord:
+    message_id: int
+    ts_utc: int
+    name: str
+    text: str
+    tokens: int
+    reply_to_message_id: int | None = None
+
+    @property
+    def line(self) -> str:
+        return f"{self.name}: {self.text}"
+
+
+class ChatWindow:
+    """
+    Rolling window of the most recent messages of one chat, bounded by age and by
+    the total number of tokens. Token counts are computed once, on append.
+    """
+
+    def __init__(self, max_age_seconds: int, max_tokens: int):
+        self.max_age_seconds = max_age_seconds
+        self.max_tokens = max_tokens
+        self.records: deque[ContextRecord] = deque()
+        self.by_id: dict[int, ContextRecord] = {}
+        self.total_tokens = 0
+        self.hydrated = False
+
+    def append(self, record: ContextRecord):
+        self.records.append(record)
+        self.by_id[record.message_id] = record
+        self.total_tokens += record.tokens
+        self.evict(record.ts_utc)
+
+    def evict(self, now_ts: int):
+        oldest_allowed = now_ts - self.max_age_seconds
+        while self.records and (
+            self.records[0].ts_utc < oldest_allowed or self.total_tokens > self.max_tokens
+        ):
+            old = self.records.popleft()
+            self.total_tokens -= old.tokens
+            self.by_id.pop(old.message_id, None)
+
+    def merge(self, records: Iterable[ContextRecord]):
+        """Merge records loaded from the DB with the ones that arrived meanwhile."""
+        known = {r.message_id for r in self.records}
+        merged = [r for r in records if r.message_id not in known] + list(self.records)
+        merged.sort(key=lambda r: (r.ts_utc, r.message_id))
+        self.records = deque(merged)
+        self.by_id = {r.message_id: r for r in merged}
+        self.total_tokens = sum(r.tokens for r in merged)
+        if merged:
+            self.evict(merged[-1].ts_utc)
+
+    def tail(self, before_ts: int, exclude_ids: set[int] | frozenset = frozenset(),
+             max_tokens: int | None = None) -> list[ContextRecord]:
+        """
+        Return the newest records sent before ``before_ts`` that fit in ``max_tokens``,
+        in chronological order.
+        """
+        budget = self.max_tokens if max_tokens is None else max_tokens
+        oldest_allowed = before_ts - self.max_age_seconds
+        picked = []
+        used = 0
+        for r in reversed(self.records):
+            if r.ts_utc >= before_ts or r.message_id in exclude_ids:
+                continue
+            if r.ts_utc < oldest_allowed or used + r.tokens > budget:
+                break
+            picked.append(r)
+            used += r.tokens
+        return picked[::-1]
+
+    def render(self, before_ts: int, exclude_message_id: int | None = None,
+               max_tokens: int | None = None) -> str:
+        exclude = {exclude_message_id} if exclude_message_id is not None else frozenset()
+        return "\n".join(r.line for r in self.tail(before_ts, exclude, max_tokens))
+
+    def reply_chain(self, message_id: int | None, max_depth: int) -> tuple[list[ContextRecord], int | None]:
+        """
+        Walk the reply chain upwards starting at ``message_id``, nearest message first.
+        Returns the records found in the window and the id of the first ancestor
+        that is not in the window (or None if the chain is complete).
+        """
+        chain = []
+        seen = set()
+        while message_id is not None and message_id not in seen and len(chain) < max_depth:
+            record = self.by_id.get(message_id)
+            if record is None:
+                return chain, message_id
+            seen.add(message_id)
+            chain.append(record)
+            message_id = record.reply_to_message_id
+        return chain, None
+
+
+class ContextWindows:
+    """
+    Per-chat rolling windows fed by incoming messages. A chat's window is lazily
+    hydrated from the DB the first time it is needed (e.g. after a restart).
+
+    :param count_tokens: returns the number of tokens in a string.
+    :param loader: ``loader(chat_id, since_ts)`` returns message rows (dicts) newer than ``since_ts``.
+    :param chain_loader: ``chain_loader(chat_id, message_id, max_depth)`` returns the reply
+        chain starting at ``message_id``, nearest message first; used for threads that
+        reach beyond the window.
+    """
+
+    def __init__(self, count_tokens: Callable[[str], int],
+                 loader: Callable[[int, int], list[dict]],
+                 max_age_seconds: int, max_tokens: int,
+                 chain_loader: Callable[[int, int, int], list[dict]] | None = None):
+        self.count_tokens = count_tokens
+        self.loader = loader
+        self.chain_loader = chain_loader
+        self.max_age_seconds = max_age_seconds
+        self.max_tokens = max_tokens
+        self._windows: dict[int, ChatWindow] = {}
+
+    def _window(self, chat_id: int) -> ChatWindow:
+        window = self._windows.get(chat_id)
+        if window is None:
+            window = self._windows[chat_id] = ChatWindow(self.max_age_seconds, self.max_tokens)
+        return window
+
+    def make_record(self, row: dict) -> ContextRecord | None:
+        text = (row.get("text") or "").strip()
+        if not text:
+            return None
+        text = text[:MAX_LINE_CHARS]
+        name = row.get("full_name") or row.get("username") or "Учасник"
+        return ContextRecord(
+            message_id=row["message_id"],
+            ts_utc=row["ts_utc"],
+            name=name,
+            text=text,
+            tokens=self.count_tokens(f"{name}: {text}"),
+            reply_to_message_id=row.get("reply_to_message_id"),
+        )
+
+    def add(self, chat_id: int, row: dict):
+        """Append one message (same keys as a ``messages`` row) to the chat window."""
+        record = self.make_record(row)
+        if record is not None:
+            self._window(chat_id).append(record)
+
+    def invalidate(self, chat_id: int):
+        """Drop a chat's window so the next ``get`` re-reads it from the DB (for a process that
+        does not see the chat's incoming messages, e.g. a job worker)."""
+        self._windows.pop(chat_id, None)
+
+    def get(self, chat_id: int, now_ts: int) -> ChatWindow:
+        window = self._window(chat_id)
+        if not window.hydrated:
+            rows = self.loader(chat_id, now_ts - self.max_age_seconds)
+            window.merge(r for r in map(self.make_record, rows) if r is not None)
+            window.hydrated = True
+        window.evict(now_ts)
+        return window
+
+    def thread(self, chat_id: int, reply_to_message_id: int | None, now_ts: int,
+               max_depth: int) -> list[ContextRecord]:
+        """Reply chain above a message, nearest message first."""
+        if reply_to_message_id is None:
+            return []
+        window = self.get(chat_id, now_ts)
+        chain, missing_id = window.reply_chain(reply_to_message_id, max_depth)
+        if missing_id is not None and self.chain_loader is not None:
+            rows = self.chain_loader(chat_id, missing_id, max_depth - len(chain))
+            chain.extend(r for r in map(self.make_record, rows) if r is not None)
+        return chain
+
+    def select(self, chat_id: int, message_id: int, reply_to_message_id: int | None,
+               now_ts: int, thread_max_tokens: int, tail_max_tokens: int,
+               max_depth: int = 50) -> tuple[list[ContextRecord], list[ContextRecord]]:
+        """
+        Records a reply to ``message_id`` is built from: its reply chain (up to
+        ``thread_max_tokens``) and a short tail of the latest chat messages (up to
+        ``tail_max_tokens``), both in chronological order.
+        """
+        thread = []
+        used = 0
+        for r in self.thread(chat_id, reply_to_message_id, now_ts, max_depth):
+            if used + r.tokens > thread_max_tokens:
+                break
+            thread.append(r)
+            used += r.tokens
+        thread.reverse()
+
+        exclude = {message_id} | {r.message_id for r in thread}
+        tail = self.get(chat_id, now_ts).tail(now_ts, exclude, tail_max_tokens)
+        return thread, tail
+
+    def build_context(self, chat_id: int, message_id: int, reply_to_message_id: int | None,
+                      now_ts: int, thread_max_tokens: int, tail_max_tokens: int,
+                      max_depth: int = 50) -> str:
+        """Context for a reply to ``message_id``, see ``select``."""
+        return render_context(*self.select(
+            chat_id, message_id, reply_to_message_id, now_ts, thread_max_tokens, tail_max_tokens, max_depth
+        ))
+
+
+def render_context(thread: list[ContextRecord], tail: list[ContextRecord]) -> str:
+    sections = []
+    if thread:
+        sections.append("Гілка розмови:\n" + "\n".join(r.line for r in thread))
+    if tail:
+        sections.append("Останні повідомлення чату:\n" + "\n".join(r.line for r in tail))
+    return "\n\n".join(sections)
+
+
+def context_digest(records: Iterable[ContextRecord]) -> str:
+    """Stable short hash of the (message_id, ts_utc) of the given records."""
+    h = hashlib.blake2b(digest_size=8)
+    for r in records:
+        h.update(f"{r.message_id}:{r.ts_utc};".encode())
+    return h.hexdigest()
@@ -0,0 +1,74 @@
+import asyncio
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+
+from src.panbot.context import ChatWindow
+
+
+@dataclass(slots=True)
+class MemoryState:
+    summary: str = ""
+    covered_until_ts: int = 0
+
+
+class ChatMemory:
+    """
+    Per-chat long-term memory for PanBot: a short condensed summary of everything
+    older than the verbatim tail, refreshed by a cheap model call once enough
+    new messages have drifted out of the tail.
+
+    :param condense: ``condense(chat_id, previous_summary, lines)`` returns the new summary.
+    :param loader: ``loader(chat_id)`` returns the stored memory row (dict) or None.
+    :param saver: ``saver(chat_id, summary, covered_until_ts)`` persists the memory.
+    :param verbatim_tokens: size of the newest part of the window that is never condensed.
+    :param condense_after_tokens: condense once this many tokens are waiting outside the tail.
+    """
+
+    def __init__(self, condense: Callable[[int, str, list[str]], Awaitable[str]],
+                 loader: Callable[[int], dict | None],
+                 saver: Callable[[int, str, int], None],
+                 verbatim_tokens: int, condense_after_tokens: int):
+        self.condense = condense
+        self.loader = loader
+        self.saver = saver
+        self.verbatim_tokens = verbatim_tokens
+        self.condense_after_tokens = condense_after_tokens
+        self._states: dict[int, MemoryState] = {}
+        self._locks: dict[int, asyncio.Lock] = {}
+
+    def get(self, chat_id: int) -> MemoryState:
+        state = self._states.get(chat_id)
+        if state is None:
+            row = self.loader(chat_id)
+            state = MemoryState(row["summary"], row["covered_until_ts"]) if row else MemoryState()
+            self._states[chat_id] = state
+        return state
+
+    def pending(self, chat_id: int, window: ChatWindow, now_ts: int) -> list:
+        """Records that are newer than the memory but already outside the verbatim tail."""
+        state = self.get(chat_id)
+        tail = window.tail(now_ts + 1, max_tokens=self.verbatim_tokens)
+        tail_start = tail[0].ts_utc if tail else now_ts + 1
+        return [
+            r for r in window.records
+            if state.covered_until_ts < r.ts_utc < tail_start
+        ]
+
+    async def maybe_condense(self, chat_id: int, window: ChatWindow, now_ts: int) -> bool:
+        """Fold pending records into the summary if there are enough of them."""
+        lock = self._locks.setdefault(chat_id, asyncio.Lock())
+        if lock.locked():
+            return False
+        async with lock:
+            pending = self.pending(chat_id, window, now_ts)
+            if sum(r.tokens for r in pending) < self.condense_after_tokens:
+                return False
+            state = self.get(chat_id)
+            summary = await self.condense(chat_id, state.summary, [r.line for r in pending])
+            summary = (summary or "").strip()
+            if not summary:
+                return False
+            covered_until_ts = pending[-1].ts_utc
+            self.saver(chat_id, summary, covered_until_ts)
+            self._states[chat_id] = MemoryState(summary, covered_until_ts)
+            return True
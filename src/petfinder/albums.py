@@ -0,0 +1,59 @@
+"""
+Buffering of Telegram albums (media groups).
+
+An album of N photos arrives as N separate updates sharing a ``media_group_id``.
+``AlbumBuffer`` collects them and hands the whole album to ``flush`` once no new
+photo of that group has arrived for ``delay`` seconds, so it is stored and
+detected as one unit.
+"""
+import asyncio
+from collections.abc import Awaitable, Callable, Hashable
+from typing import Any
+
+import src.tools.config as config
+
+FlushFn = Callable[[Hashable, list[Any]], Awaitable[None]]
+
+
+class AlbumBuffer:
+    def __init__(self, flush: FlushFn, delay: float, max_items: int = 10):
+        self.flush = flush
+        self.delay = delay
+        self.max_items = max_items  # Telegram albums hold at most 10 items
+        self._items: dict[Hashable, list[Any]] = {}
+        self._timers: dict[Hashable, asyncio.Task] = {}
+
+    def __len__(self):
+        return len(self._items)
+
+    def add(self, key: Hashable, item: Any):
+        self._items.setdefault(key, []).append(item)
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        if len(self._items[key]) >= self.max_items:
+            self._timers[key] = asyncio.create_task(self._flush(key))
+        else:
+            self._timers[key] = asyncio.create_task(self._flush_later(key))
+
+    async def _flush_later(self, key: Hashable):
+        await asyncio.sleep(self.delay)
+        await self._flush(key)
+
+    async def _flush(self, key: Hashable):
+        self._timers.pop(key, None)
+        items = self._items.pop(key, None)
+        if not items:
+            return
+        try:
+            await self.flush(key, items)
+        except Exception as e:
+            config.log.exception(f"Album flush failed for {key}: {e}")
+
+    async def drain(self):
+        """Flush everything still buffered (on shutdown)."""
+        for key in list(self._items):
+            timer = self._timers.pop(key, None)
+            if timer is not None:
+                timer.cancel()
+            await self._flush(key)
@@ -0,0 +1,64 @@
+"""
+Per-image latency of the local pet prefilter.
+
+    python -m src.petfinder.benchmark --backend numpy --model model.npz [--images dir] [-n 200]
+
+Without ``--images`` random thumbnails of Telegram's smallest size (90x90) are used.
+Run it pinned to one core (e.g. ``taskset -c 0``) to mimic the shared vCPU.
+"""
+import argparse
+import statistics
+import time
+from pathlib import Path
+
+import numpy as np
+
+from src.petfinder.detectors import NumpyPrefilter, OnnxPrefilter, decode_rgb, parse_classes
+
+
+def _images(path: str | None, n: int, size: int) -> list:
+    if path:
+        images = [decode_rgb(p.read_bytes()) for p in sorted(Path(path).iterdir()) if p.is_file()]
+        images = [img for img in images if img is not None]
+        if not images:
+            raise SystemExit("No decodable images (is Pillow installed?)")
+        return (images * (n // len(images) + 1))[:n]
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 255, size=(size, size, 3), dtype=np.uint8) for _ in range(n)]
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["numpy", "onnx"], required=True)
+    parser.add_argument("--model", required=True)
+    parser.add_argument("--images")
+    parser.add_argument("-n", type=int, default=200)
+    parser.add_argument("--size", type=int, default=90)
+    parser.add_argument("--classes", default="151-268,281-285")
+    parser.add_argument("--input-size", type=int, default=224)
+    args = parser.parse_args(argv)
+
+    if args.backend == "numpy":
+        prefilter = NumpyPrefilter(args.model)
+    else:
+        prefilter = OnnxPrefilter(args.model, parse_classes(args.classes), args.input_size)
+
+    images = _images(args.images, args.n, args.size)
+    started = time.perf_counter()
+    prefilter.pet_probability(images[0])  # lazy model load
+    print(f"model load + first image: {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    latencies = []
+    for image in images:
+        started = time.perf_counter()
+        prefilter.pet_probability(image)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    latencies.sort()
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(f"{args.backend}: n={len(latencies)} mean={statistics.fmean(latencies):.2f} ms "
+          f"p50={statistics.median(latencies):.2f} ms p95={p95:.2f} ms max={latencies[-1]:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
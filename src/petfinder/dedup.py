@@ -0,0 +1,176 @@
+"""
+Perceptual-hash deduplication in front of the vision model.
+
+The same meme or pet photo is often forwarded into several chats or reposted in
+the same one. Before a vision call we look the photo up by Telegram's
+``file_unique_id`` (identical for forwarded copies) and then by a 64-bit dHash
+of its smallest thumbnail; a stored detection within ``max_distance`` bits is
+reused instead of calling the model.
+
+NumPy and Pillow are project dependencies but still imported defensively: without
+them only the exact ``file_unique_id`` match is used, and a warning is logged.
+"""
+from collections.abc import Awaitable, Callable
+from io import BytesIO
+from itertools import combinations
+
+import src.tools.config as config
+from src.tools import metrics
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - depends on the deployment
+    np = None
+
+HASH_SIZE = 8
+# Stored hashes are indexed by four 16-bit bands (see the photo_hashes band indexes)
+BANDS = 4
+BAND_BITS = 16
+
+
+def _resize_gray(gray, height: int, width: int):
+    """Area-average a 2-D array down to ``height x width`` (vectorised, no Pillow needed)."""
+    gray = np.asarray(gray, dtype=np.float32)
+    h, w = gray.shape
+    if h < height or w < width:
+        gray = np.repeat(np.repeat(gray, -(-height // h), axis=0), -(-width // w), axis=1)
+        h, w = gray.shape
+    rows = np.linspace(0, h, height + 1).astype(int)[:-1]
+    cols = np.linspace(0, w, width + 1).astype(int)[:-1]
+    sums = np.add.reduceat(np.add.reduceat(gray, rows, axis=0), cols, axis=1)
+    counts = np.outer(np.diff(np.append(rows, h)), np.diff(np.append(cols, w)))
+    return sums / counts
+
+
+def dhash(gray, hash_size: int = HASH_SIZE) -> int:
+    """Difference hash of a grayscale image array: one bit per horizontal gradient sign."""
+    small = _resize_gray(gray, hash_size, hash_size + 1)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def to_signed64(value: int) -> int:
+    """Hashes are stored in a BIGINT column."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def band_probes(value: int, max_distance: int) -> list[list[int]]:
+    """
+    Band values to look up, per band, so that every hash within ``max_distance`` bits is found.
+    Hashes that close differ in at most ``max_distance // BANDS`` bits in one of the bands
+    (pigeonhole), so each band is probed with its value and all values that close to it.
+    """
+    radius = max(0, max_distance) // BANDS
+    mask = (1 << BAND_BITS) - 1
+    probes = []
+    for band in range(BANDS):
+        base = (value >> (band * BAND_BITS)) & mask
+        values = [base]
+        for r in range(1, radius + 1):
+            for bits in combinations(range(BAND_BITS), r):
+                flip = 0
+                for bit in bits:
+                    flip |= 1 << bit
+                values.append(base ^ flip)
+        probes.append(values)
+    return probes
+
+
+def decode_grayscale(data: bytes):
+    """Decode image bytes to a grayscale array, or None when Pillow/NumPy are unavailable."""
+    if np is None:
+        return None
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    with Image.open(BytesIO(data)) as img:
+        return np.asarray(img.convert("L"))
+
+
+def hashing_available() -> bool:
+    if np is None:
+        return False
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+DetectFn = Callable[[], Awaitable[tuple[str, float, str]]]
+FetchFn = Callable[[], Awaitable[bytes]]
+
+
+class PhotoDeduper:
+    """
+    :param find_exact: ``file_unique_id -> row | None``
+    :param find_similar: ``(signed dhash, max_distance) -> row | None``; rows carry species, confidence, caption
+    :param save: ``(chat_id, message_id, file_unique_id, signed dhash | None, species, confidence, caption)``
+    """
+
+    def __init__(self, find_exact, find_similar, save, max_distance: int):
+        self.find_exact = find_exact
+        self.find_similar = find_similar
+        self.save = save
+        self.max_distance = max_distance
+        self.hits = 0
+        self.misses = 0
+        if not hashing_available():
+            config.log.warning("NumPy or Pillow is not installed, photo dedup matches identical files only")
+
+    def _record(self, hit: bool):
+        if hit:
+            self.hits += 1
+            metrics.incr("pet_dedup_hits")
+            metrics.incr("pet_vision_calls_saved")
+        else:
+            self.misses += 1
+            metrics.incr("pet_dedup_misses")
+        metrics.set_gauge("pet_dedup_hit_rate", self.hits / (self.hits + self.misses))
+
+    async def _hash(self, fetch_thumbnail: FetchFn | None) -> int | None:
+        if fetch_thumbnail is None or not hashing_available():
+            return None
+        try:
+            gray = decode_grayscale(await fetch_thumbnail())
+        except Exception as e:
+            config.log.warning(f"Cannot hash photo thumbnail: {e}")
+            return None
+        return None if gray is None else to_signed64(dhash(gray))
+
+    async def lookup(self, file_unique_id: str | None,
+                     fetch_thumbnail: FetchFn | None = None) -> tuple[tuple[str, float, str] | None, int | None]:
+        """Return ``(stored result or None, thumbnail hash)``; the hash is needed to index a miss."""
+        if file_unique_id:
+            found = self.find_exact(file_unique_id)
+            if found is not None:
+                self._record(True)
+                return (found["species"], found["confidence"], found["caption"] or ""), None
+
+        phash = await self._hash(fetch_thumbnail)
+        if phash is not None:
+            found = self.find_similar(phash, self.max_distance)
+            if found is not None:
+                self._record(True)
+                return (found["species"], found["confidence"], found["caption"] or ""), phash
+
+        self._record(False)
+        return None, phash
+
+    def index(self, chat_id: int, message_id: int, file_unique_id: str | None, phash: int | None,
+              species: str, conf: float, caption: str):
+        try:
+            self.save(chat_id, message_id, file_unique_id, phash, species, conf, caption)
+        except Exception as e:
+            config.log.exception(f"Cannot index photo hash for {chat_id}/{message_id}: {e}")
+
+    async def detect(self, chat_id: int, message_id: int, file_unique_id: str | None,
+                     detect: DetectFn, fetch_thumbnail: FetchFn | None = None) -> tuple[str, float, str]:
+        """Return a stored result for a duplicate photo, otherwise run ``detect`` and index the result."""
+        found, phash = await self.lookup(file_unique_id, fetch_thumbnail)
+        if found is not None:
+            return found
+        species, conf, caption = await detect()
+        self.index(chat_id, message_id, file_unique_id, phash, species, conf, caption)
+        return species, conf, caption
@@ -0,0 +1,193 @@
+"""
+Local CPU prefilter in front of the vision LLM.
+
+Most chat photos are screenshots and memes. A small local classifier scores the
+photo thumbnail and obvious non-pets are rejected without a vision request; the
+rest still go to the LLM, which makes the final call and writes the caption.
+
+Backends (``PET_PREFILTER_BACKEND``):
+
+* ``none``  -- disabled, every photo goes to the LLM (default);
+* ``numpy`` -- logistic regression over downsampled pixels, weights in an ``.npz``
+  file with ``weights``, ``bias``, ``size`` and optional ``mean`` / ``std``;
+* ``onnx``  -- any image classifier exported to ONNX (needs the ``onnx`` extra);
+  the probabilities of ``PET_PREFILTER_PET_CLASSES`` are summed.
+
+Models are loaded lazily on first use. NumPy and Pillow are project dependencies and
+onnxruntime is optional; if one a backend needs is missing, the prefilter is disabled
+with a warning.
+"""
+import asyncio
+import importlib.util
+import math
+import time
+from collections.abc import Awaitable, Callable
+from io import BytesIO
+
+import src.tools.config as config
+from src.tools import metrics
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - depends on the deployment
+    np = None
+
+# ImageNet normalisation used by the usual torchvision/timm exports
+_IMAGENET_MEAN = (0.485, 0.456, 0.406)
+_IMAGENET_STD = (0.229, 0.224, 0.225)
+
+
+def parse_classes(spec: str) -> list[int]:
+    """``"151-268,281-285"`` -> class indices."""
+    classes: list[int] = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            lo, hi = part.split("-", 1)
+            classes.extend(range(int(lo), int(hi) + 1))
+        else:
+            classes.append(int(part))
+    return classes
+
+
+def decode_rgb(data: bytes):
+    """Decode image bytes to an ``HxWx3`` uint8 array, or None when Pillow/NumPy are unavailable."""
+    if np is None:
+        return None
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    with Image.open(BytesIO(data)) as img:
+        return np.asarray(img.convert("RGB"))
+
+
+def resize(image, height: int, width: int):
+    """Nearest-neighbour resize of an ``HxW[xC]`` array (fast enough for thumbnails, no Pillow needed)."""
+    h, w = image.shape[:2]
+    rows = (np.arange(height) * h // height).clip(0, h - 1)
+    cols = (np.arange(width) * w // width).clip(0, w - 1)
+    return image[rows][:, cols]
+
+
+class Prefilter:
+    """Scores an RGB image with the probability that it shows a cat or a dog."""
+    name = "none"
+
+    def pet_probability(self, image) -> float:
+        return 1.0
+
+
+class NumpyPrefilter(Prefilter):
+    name = "numpy"
+
+    def __init__(self, model_path: str):
+        self.model_path = model_path
+        self._model = None
+
+    def _load(self):
+        if self._model is None:
+            with np.load(self.model_path) as data:
+                model = {k: data[k] for k in data.files}
+            model["size"] = tuple(int(v) for v in model["size"])
+            model["weights"] = model["weights"].astype(np.float32).ravel()
+            self._model = model
+            config.log.info(f"Loaded NumPy pet prefilter from {self.model_path}")
+        return self._model
+
+    def pet_probability(self, image) -> float:
+        model = self._load()
+        h, w = model["size"]
+        x = resize(np.asarray(image), h, w).astype(np.float32).ravel() / 255.0
+        if "mean" in model:
+            x = (x - model["mean"]) / model["std"]
+        logit = float(x @ model["weights"] + model["bias"])
+        return 1.0 / (1.0 + math.exp(-logit))
+
+
+class OnnxPrefilter(Prefilter):
+    name = "onnx"
+
+    def __init__(self, model_path: str, pet_classes: list[int], input_size: int = 224):
+        self.model_path = model_path
+        self.pet_classes = pet_classes
+        self.input_size = input_size
+        self._session = None
+
+    def _load(self):
+        if self._session is None:
+            import onnxruntime as ort
+
+            options = ort.SessionOptions()
+            options.intra_op_num_threads = 1  # one shared vCPU
+            self._session = ort.InferenceSession(self.model_path, options, providers=["CPUExecutionProvider"])
+            config.log.info(f"Loaded ONNX pet prefilter from {self.model_path}")
+        return self._session
+
+    def pet_probability(self, image) -> float:
+        session = self._load()
+        x = resize(np.asarray(image), self.input_size, self.input_size).astype(np.float32) / 255.0
+        x = (x - np.array(_IMAGENET_MEAN, dtype=np.float32)) / np.array(_IMAGENET_STD, dtype=np.float32)
+        x = x.transpose(2, 0, 1)[None]  # NCHW
+        logits = session.run(None, {session.get_inputs()[0].name: x})[0][0].astype(np.float64)
+        probs = np.exp(logits - logits.max())
+        probs /= probs.sum()
+        return float(probs[self.pet_classes].sum())
+
+
+_prefilter: Prefilter | None = None
+_prefilter_unavailable = False
+
+
+def missing_modules(backend: str) -> list[str]:
+    """Modules the ``backend`` needs that are not installed."""
+    required = ["numpy", "PIL"] + (["onnxruntime"] if backend == "onnx" else [])
+    return [name for name in required if importlib.util.find_spec(name) is None]
+
+
+def get_prefilter() -> Prefilter | None:
+    """The configured prefilter, created on first use; None when disabled or unavailable."""
+    global _prefilter, _prefilter_unavailable
+    backend = config.PET_PREFILTER_BACKEND
+    if backend == "none" or _prefilter_unavailable:
+        return None
+    if _prefilter is None:
+        if backend in ("numpy", "onnx") and (missing := missing_modules(backend)):
+            config.log.warning(f"PET_PREFILTER_BACKEND={backend} needs {', '.join(missing)}, prefilter disabled")
+            _prefilter_unavailable = True
+            return None
+        if backend == "numpy":
+            _prefilter = NumpyPrefilter(config.PET_PREFILTER_MODEL_PATH)
+        elif backend == "onnx":
+            _prefilter = OnnxPrefilter(config.PET_PREFILTER_MODEL_PATH,
+                                       parse_classes(config.PET_PREFILTER_PET_CLASSES),
+                                       config.PET_PREFILTER_INPUT_SIZE)
+        else:
+            config.log.warning(f"Unknown PET_PREFILTER_BACKEND {backend!r}, prefilter disabled")
+            return None
+    return _prefilter
+
+
+async def rejects(prefilter: Prefilter | None, fetch_image: Callable[[], Awaitable[bytes]] | None,
+                  threshold: float) -> bool:
+    """True when the prefilter is confident the photo has no pet; any failure lets the photo through."""
+    if prefilter is None or fetch_image is None:
+        return False
+    try:
+        image = decode_rgb(await fetch_image())
+        if image is None:
+            return False
+        started = time.perf_counter()
+        # Inference is CPU-bound: keep it off the event loop
+        prob = await asyncio.to_thread(prefilter.pet_probability, image)
+        metrics.observe("pet_prefilter_seconds", time.perf_counter() - started)
+    except Exception as e:
+        config.log.warning(f"Pet prefilter failed, falling back to the vision model: {e}")
+        return False
+    if prob < threshold:
+        metrics.incr("pet_prefilter_rejects")
+        return True
+    metrics.incr("pet_prefilter_passes")
+    return False
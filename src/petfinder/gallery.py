@@ -0,0 +1,73 @@
+"""
+Ranged, paginated /petfinder: argument parsing and inline-keyboard callback data.
+
+``/petfinder 7d кіт`` lists the last 7 days of cat photos; pages are fetched with a
+keyset cursor ``(ts_utc, message_id)`` carried in the callback data, so paging
+never re-reads earlier rows and every page costs one bounded indexed query.
+"""
+import re
+from dataclasses import dataclass
+
+CALLBACK_PREFIX = "pf"
+
+_RANGE_RE = re.compile(r"^(\d{1,3})\s*(d|д|дн|днів|дні)?$")
+_SPECIES = {
+    "cat": "cat", "cats": "cat", "кіт": "cat", "коти": "cat", "котики": "cat",
+    "dog": "dog", "dogs": "dog", "пес": "dog", "пси": "dog", "собаки": "dog",
+}
+_SPECIES_CODES = {"cat": "c", "dog": "d", None: "a"}
+_CODES_SPECIES = {v: k for k, v in _SPECIES_CODES.items()}
+
+
+@dataclass(slots=True)
+class PetfinderQuery:
+    days: int | None = None      # None -> today with live catch-up
+    species: str | None = None   # "cat" | "dog" | None for both
+    regen: bool = False
+
+
+def parse_args(args: list[str], max_days: int) -> PetfinderQuery:
+    query = PetfinderQuery()
+    for arg in args:
+        arg = arg.strip().lower()
+        if arg == "regen":
+            query.regen = True
+        elif arg in _SPECIES:
+            query.species = _SPECIES[arg]
+        elif (m := _RANGE_RE.match(arg)) is not None:
+            query.days = max(1, min(max_days, int(m.group(1))))
+    return query
+
+
+@dataclass(frozen=True, slots=True)
+class PageCursor:
+    start_ts: int
+    end_ts: int
+    species: str | None
+    direction: str               # "n" -> rows after the anchor, "p" -> rows before it
+    anchor: tuple[int, int] | None  # (ts_utc, message_id)
+
+    def encode(self) -> str:
+        anchor = f"{self.anchor[0]}:{self.anchor[1]}" if self.anchor else "0:0"
+        # Fits Telegram's 64-byte callback_data limit
+        return (f"{CALLBACK_PREFIX}:{self.start_ts}:{self.end_ts}:"
+                f"{_SPECIES_CODES[self.species]}:{self.direction}:{anchor}")
+
+    @classmethod
+    def decode(cls, data: str) -> "PageCursor":
+        prefix, start_ts, end_ts, species, direction, ts, mid = data.split(":")
+        if prefix != CALLBACK_PREFIX or direction not in ("n", "p"):
+            raise ValueError(f"Not a petfinder page: {data!r}")
+        anchor = (int(ts), int(mid)) if int(ts) else None
+        return cls(int(start_ts), int(end_ts), _CODES_SPECIES[species], direction, anchor)
+
+
+def split_page(rows: list, cursor: PageCursor, limit: int) -> tuple[list, bool, bool]:
+    """Trim the ``limit + 1`` rows of a keyset query to one page; returns ``(rows, has_prev, has_next)``."""
+    forward = cursor.direction == "n"
+    more = len(rows) > limit
+    if more:
+        rows = rows[:limit] if forward else rows[1:]
+    if forward:
+        return rows, cursor.anchor is not None, more
+    return rows, more, True  # paging back always comes from a later page
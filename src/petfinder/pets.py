@@ -1,14 +1,31 @@
+import asyncio
 import os
 
 from telegram.ext import ContextTypes
 from openai import AsyncOpenAI
-import json
 
-from src.tools import config
+from src.tools import config, metrics
+from src.tools.structured import (
+    PetBatchReply,
+    PetDetection,
+    StructuredOutputError,
+    decode,
+    openai_response_format,
+)
 
 # Configuration
 PET_CONFIDENCE_THRESHOLD = float(os.getenv("PET_CONFIDENCE_THRESHOLD", "0.6"))
 SARCASM_LEVEL = 7
+PET_VISION_MODEL = os.getenv("PET_VISION_MODEL", "gpt-4o-mini")
+# Smallest variant whose longer side reaches this is sent with detail="low" (the model downsizes to 512 anyway)
+PET_LOW_RES_SIDE = int(os.getenv("PET_LOW_RES_SIDE", "512"))
+# Re-run on the full-size photo with detail="high" when confidence is this close to the threshold
+PET_ESCALATION_MARGIN = float(os.getenv("PET_ESCALATION_MARGIN", "0.15"))
+# Images per multi-image vision request (1 disables batching)
+PET_DETECTION_BATCH_SIZE = int(os.getenv("PET_DETECTION_BATCH_SIZE", "6"))
+
+SYSTEM_PROMPT = "Ти іронічний помічник, який допомагає знаходити фото котів або собак в чаті. Завжди відповідай у форматі JSON"
+GENERIC_CAPTION = "Фото ніби натякає, що люди тут раби для тварин."
 
 def _openai_enabled() -> bool:
     return bool(os.getenv("OPENAI_API_KEY"))
@@ -43,23 +60,41 @@ def _build_joint_prompt(sarcasm_level: int = SARCASM_LEVEL, lang: str = "uk") ->
     return f"{instr_uk}\n\n{tone}\n\n{output_spec}"
 
 
+def _build_batch_prompt(count: int, sarcasm_level: int = SARCASM_LEVEL) -> str:
+    """Joint prompt for N images in one request, one indexed JSON result per image."""
+    tone = (
+        f"Ступінь сарказму: {max(0, min(9, sarcasm_level))} з 9. "
+        "Будь дотепним без токсичності чи образ. Одне коротке речення, без емодзі, без форматування."
+    )
+    instr_uk = (
+        f"Нижче {count} зображень, кожне позначене номером від 0 до {count - 1}. "
+        "Для КОЖНОГО визнач, чи є там кіт або пес (якщо ні — species='none'), "
+        "і дай окремий короткий іронічний підпис українською (1 речення),"
+        " без емодзі, без форматування, без згадок про ШІ чи моделі."
+    )
+    output_spec = (
+        "Відповідай СТРОГО у форматі JSON, по одному елементу на кожне зображення:\n"
+        '{\n'
+        '  "results": [\n'
+        '    {"index": number, "species": "cat" | "dog" | "none", "confidence": number (0..1), "caption": "..."}\n'
+        '  ]\n'
+        '}\n'
+        "Без додаткового тексту поза JSON."
+    )
+    return f"{instr_uk}\n\n{tone}\n\n{output_spec}"
+
+
 def _parse_joint_json(text: str) -> tuple[str, float, str]:
     try:
-        data = json.loads(text.strip())
-        species = str(data.get("species", "none")).lower()
-        if species not in ("cat", "dog", "none"):
-            species = "none"
-        conf = float(data.get("confidence", 0.0))
-        if conf < 0 or conf > 1:
-            conf = 0.0
-        caption = str(data.get("caption") or "").strip()
-        return species, conf, caption
-    except Exception as e:
-        config.log.exception(f"JSON parsing failed: {e}")
+        det = decode(text, PetDetection)
+        return det.species, det.confidence, det.caption
+    except StructuredOutputError as e:
+        config.log.warning(f"JSON parsing failed: {e}")
         return "none", 0.0, ""
 
 
-async def detect_and_caption_from_url(image_url: str, sarcasm_level: int = SARCASM_LEVEL) -> tuple[str, float, str]:
+async def detect_and_caption_from_url(image_url: str, sarcasm_level: int = SARCASM_LEVEL,
+                                      detail: str = "auto") -> tuple[str, float, str]:
     """
     Detects and generates a sarcastic caption from the given image URL.
 
@@ -72,16 +107,16 @@ async def detect_and_caption_from_url(image_url: str, sarcasm_level: int = SARCA
     :param image_url: The URL of the image to be processed.
     :param sarcasm_level: An integer representing the level of sarcasm in the
         generated caption. Default is 5.
+    :param detail: OpenAI image detail level: "low", "high" or "auto".
     :return: A tuple consisting of:
         - The type of caption as a string (e.g., "sarcastic").
         - The confidence score as a float between 0 and 1.
         - The generated sarcastic caption as a string.
     """
     if not _openai_enabled():
-        generic_caption = "Фото ніби натякає, що люди тут раби для тварин."
-        return "none", 0.0, generic_caption
+        return "none", 0.0, GENERIC_CAPTION
 
-    model = "gpt-4o-mini"
+    model = PET_VISION_MODEL
     prompt = _build_joint_prompt(sarcasm_level=sarcasm_level, lang="uk")
 
     async with AsyncOpenAI() as client:
@@ -90,23 +125,134 @@ async def detect_and_caption_from_url(image_url: str, sarcasm_level: int = SARCA
             messages=[
                 {
                     "role": "system",
-                    "content": "Ти іронічний помічник, який допомагає знаходити фото котів або собак в чаті. Завжди відповідай у форматі JSON"
+                    "content": SYSTEM_PROMPT
                 },
                 {
                     "role": "user",
                     "content": [
                         {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": image_url}},
+                        {"type": "image_url", "image_url": {"url": image_url, "detail": detail}},
                     ],
                 }
             ],
-            response_format={"type": "json_object"},
+            response_format=openai_response_format(PetDetection),
         )
 
     text = (resp.choices[0].message.content or "").strip()
     return _parse_joint_json(text)
 
 
+def pick_low_res_size(sizes: list[dict], min_side: int = PET_LOW_RES_SIDE) -> dict | None:
+    """Smallest size variant whose longer side is at least ``min_side`` (or the largest one available)."""
+    if not sizes:
+        return None
+    ordered = sorted(sizes, key=lambda s: s["width"] * s["height"])
+    for size in ordered:
+        if max(size["width"], size["height"]) >= min_side:
+            return size
+    return ordered[-1]
+
+
+def _near_threshold(species: str, conf: float) -> bool:
+    return species in ("cat", "dog") and abs(conf - PET_CONFIDENCE_THRESHOLD) <= PET_ESCALATION_MARGIN
+
+
+async def detect_and_caption_with_bot(bot, file_id: str, sarcasm_level: int = SARCASM_LEVEL,
+                                      sizes: list[dict] | None = None) -> tuple[str, float, str]:
+    """
+    Resolves Telegram file_id to a direct file URL and runs detection via URL (no base64 inlining).
+    With ``sizes`` (all PhotoSize variants) a small variant is sent with low detail first and the
+    full-size photo with high detail only when the answer is close to ``PET_CONFIDENCE_THRESHOLD``.
+    A photo without a variant of ``PET_LOW_RES_SIDE`` is itself the low-res pick.
+    Errors are propagated, so background workers can retry.
+    """
+    small = pick_low_res_size(sizes or [])
+    if small is not None:
+        file = await bot.get_file(small["file_id"])
+        species, conf, caption = await detect_and_caption_from_url(file.file_path, sarcasm_level, detail="low")
+        if not _near_threshold(species, conf):
+            metrics.incr("pet_detection_low_res")
+            return species, conf, caption
+        metrics.incr("pet_detection_escalations")
+
+    file = await bot.get_file(file_id)
+    return await detect_and_caption_from_url(file.file_path, sarcasm_level=sarcasm_level,
+                                             detail="auto" if small is None else "high")
+
+
+async def detect_and_caption_batch_from_urls(image_urls: list[str], sarcasm_level: int = SARCASM_LEVEL,
+                                             detail: str = "low") -> list[tuple[str, float, str] | None]:
+    """
+    Detects pets on several images in one vision request.
+    Returns one result per image, in input order; ``None`` marks an image whose entry
+    was missing or unparsable, so the caller can re-check it with a single-image call.
+    """
+    if not _openai_enabled():
+        return [("none", 0.0, GENERIC_CAPTION) for _ in image_urls]
+
+    content: list[dict] = [{"type": "text", "text": _build_batch_prompt(len(image_urls), sarcasm_level)}]
+    for i, url in enumerate(image_urls):
+        content.append({"type": "text", "text": f"Зображення {i}:"})
+        content.append({"type": "image_url", "image_url": {"url": url, "detail": detail}})
+
+    async with AsyncOpenAI() as client:
+        resp = await client.chat.completions.create(
+            model=PET_VISION_MODEL,
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": content},
+            ],
+            response_format=openai_response_format(PetBatchReply),
+        )
+
+    results: list[tuple[str, float, str] | None] = [None] * len(image_urls)
+    try:
+        reply = decode(resp.choices[0].message.content or "", PetBatchReply)
+    except StructuredOutputError as e:
+        config.log.warning(f"Batch JSON parsing failed: {e}")
+        return results
+    for item in reply.results:
+        if 0 <= item.index < len(results) and results[item.index] is None:
+            results[item.index] = (item.species, item.confidence, item.caption)
+    return results
+
+
+async def detect_and_caption_batch_with_bot(bot, photos: list[tuple[str, list[dict] | None]],
+                                            sarcasm_level: int = SARCASM_LEVEL) -> list:
+    """
+    Batched counterpart of ``detect_and_caption_with_bot`` for ``(file_id, sizes)`` pairs.
+    Images the batch could not answer fall back to single-image calls, and answers close to
+    the threshold are re-checked on the full-size photo. Returns a result or an exception per photo.
+    """
+    if len(photos) == 1:
+        file_id, sizes = photos[0]
+        return list(await asyncio.gather(
+            detect_and_caption_with_bot(bot, file_id, sarcasm_level, sizes=sizes), return_exceptions=True
+        ))
+
+    variants = []
+    for file_id, sizes in photos:
+        small = pick_low_res_size(sizes or [])
+        variants.append(small["file_id"] if small is not None else file_id)
+    files = await asyncio.gather(*(bot.get_file(v) for v in variants))
+    batch = await detect_and_caption_batch_from_urls([f.file_path for f in files], sarcasm_level)
+    metrics.incr("pet_detection_batches")
+
+    async def resolve(i: int):
+        file_id, sizes = photos[i]
+        result = batch[i]
+        if result is None:
+            metrics.incr("pet_batch_fallbacks")
+            return await detect_and_caption_with_bot(bot, file_id, sarcasm_level, sizes=sizes)
+        if _near_threshold(result[0], result[1]):
+            metrics.incr("pet_detection_escalations")
+            file = await bot.get_file(file_id)
+            return await detect_and_caption_from_url(file.file_path, sarcasm_level=sarcasm_level, detail="high")
+        return result
+
+    return list(await asyncio.gather(*(resolve(i) for i in range(len(photos))), return_exceptions=True))
+
+
 async def detect_and_caption_by_file_id(context: ContextTypes.DEFAULT_TYPE, file_id: str,
                                         sarcasm_level: int = SARCASM_LEVEL) -> tuple[str, float, str]:
     """
@@ -119,4 +265,4 @@ async def detect_and_caption_by_file_id(context: ContextTypes.DEFAULT_TYPE, file
         config.log.exception(f"Failed to resolve file_id to URL: {e}")
         return "none", 0.0, ""
 
-    return await detect_and_caption_from_url(image_url, sarcasm_level=sarcasm_level)
\ No newline at end of file
+    return await detect_and_caption_from_url(image_url, sarcasm_level=sarcasm_level)
@@ -0,0 +1,246 @@
+"""
+Background pet-detection pipeline.
+
+``on_photo`` submits every stored photo to a bounded asyncio queue; a small pool
+of workers runs the vision model and writes results, so ``/petfinder`` only has
+to read ``pet_photos``. Photos that could not be queued (queue full) or were
+queued before a restart stay unprocessed in ``photo_messages`` and are picked up
+again by ``recover``.
+"""
+import asyncio
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+
+import src.tools.config as config
+from src.tools import metrics
+
+
+@dataclass(frozen=True, slots=True)
+class PhotoJob:
+    chat_id: int
+    message_id: int
+    ts_utc: int
+    file_id: str
+    caption_only: bool = False  # (re)generate the caption of an already detected pet
+    file_unique_id: str | None = None
+    thumb_file_id: str | None = None  # smallest PhotoSize, used for perceptual dedup
+    sizes: tuple[dict, ...] = ()  # all PhotoSize variants: file_id, width, height
+    # Album (media group) members, representative first; an album is detected and stored as one unit
+    album: tuple["PhotoJob", ...] = ()
+
+    @property
+    def message_ids(self) -> list[int]:
+        return [m.message_id for m in self.album] if self.album else [self.message_id]
+
+
+def jobs_from_rows(rows: list[dict], caption_only: bool = False) -> list[PhotoJob]:
+    """Build jobs from ``photo_messages`` rows; rows of one media group become a single album job."""
+    slots: list[PhotoJob | tuple] = []
+    albums: dict[tuple, list[PhotoJob]] = {}
+    for r in rows:
+        job = PhotoJob(r["chat_id"], r["message_id"], r["ts_utc"], r["file_id"], caption_only,
+                       file_unique_id=r.get("file_unique_id"), thumb_file_id=r.get("thumb_file_id"),
+                       sizes=tuple(r.get("sizes") or ()))
+        group = r.get("media_group_id")
+        if group and not caption_only:
+            key = (r["chat_id"], group)
+            if key not in albums:
+                albums[key] = []
+                slots.append(key)
+            albums[key].append(job)
+        else:
+            slots.append(job)
+    return [album_job(albums[s]) if isinstance(s, tuple) else s for s in slots]
+
+
+def album_job(members: list[PhotoJob]) -> PhotoJob:
+    if len(members) == 1:
+        return members[0]
+    members = sorted(members, key=lambda j: (j.ts_utc, j.message_id))
+    first = members[0]
+    return PhotoJob(first.chat_id, first.message_id, first.ts_utc, first.file_id,
+                    file_unique_id=first.file_unique_id, thumb_file_id=first.thumb_file_id,
+                    sizes=first.sizes, album=tuple(members))
+
+
+# Results are (species, confidence, caption); album verdicts append the file_id of the member they were found on
+DetectFn = Callable[[PhotoJob], Awaitable[tuple]]
+StoreFn = Callable[..., None]
+FailFn = Callable[[PhotoJob], int]
+ResultFn = Callable[[PhotoJob, str, float, str], Awaitable[None]]
+# Detects several photos in one go; returns a result tuple or an exception per job, in order
+BatchDetectFn = Callable[[list[PhotoJob]], Awaitable[list]]
+
+
+def _batched(jobs: list[PhotoJob], size: int) -> list[list[PhotoJob]]:
+    size = max(1, size)
+    return [jobs[i:i + size] for i in range(0, len(jobs), size)]
+
+
+async def detect_concurrently(jobs: list[PhotoJob], detect: DetectFn, *, limit: int, timeout: float,
+                              on_result: ResultFn | None = None, detect_batch: BatchDetectFn | None = None,
+                              batch_size: int = 1) -> tuple[list[tuple], list[PhotoJob]]:
+    """
+    Run ``detect`` for all jobs with at most ``limit`` calls in flight and a per-call timeout.
+    With ``detect_batch``, jobs are grouped ``batch_size`` at a time into one call each.
+    ``on_result`` is awaited as each detection completes (in completion order).
+    Returns ``(results, failed)``; results are ``(job, *result)`` ordered by timestamp.
+    """
+    semaphore = asyncio.Semaphore(limit)
+    results: list[tuple] = []
+    failed: list[PhotoJob] = []
+
+    async def run_one(job: PhotoJob):
+        return [await detect(job)]
+
+    async def run(batch: list[PhotoJob]):
+        async with semaphore:
+            try:
+                with metrics.timed("pet_detection_seconds"):
+                    call = detect_batch(batch) if detect_batch is not None else run_one(batch[0])
+                    outcomes = await asyncio.wait_for(call, timeout)
+            except Exception as e:
+                outcomes = [e] * len(batch)
+        for job, outcome in zip(batch, outcomes):
+            if isinstance(outcome, BaseException):
+                metrics.incr("pet_detection_inline_failures")
+                config.log.warning(f"Inline pet detection failed for {job}: {outcome}")
+                failed.append(job)
+                continue
+            results.append((job, *outcome))
+            if on_result is not None:
+                await on_result(job, *outcome[:3])
+
+    await asyncio.gather(*(run(b) for b in _batched(jobs, batch_size if detect_batch is not None else 1)))
+    results.sort(key=lambda r: (r[0].ts_utc, r[0].message_id))
+    failed.sort(key=lambda j: (j.ts_utc, j.message_id))
+    return results, failed
+
+
+class DetectionPipeline:
+    """
+    :param detect: runs the detector for a job; must raise on transient failures.
+    :param store: persists a detection result and marks the photo as processed.
+    :param record_failure: records a failed attempt and returns the attempts made so far.
+    :param detect_batch: optional multi-photo detector; workers then take up to ``batch_size``
+        queued photos at once.
+    """
+
+    def __init__(self, detect: DetectFn, store: StoreFn, record_failure: FailFn, *,
+                 workers: int, max_queue: int, max_attempts: int,
+                 retry_delay: float, timeout: float,
+                 detect_batch: BatchDetectFn | None = None, batch_size: int = 1):
+        self.detect = detect
+        self.detect_batch = detect_batch
+        self.batch_size = batch_size if detect_batch is not None else 1
+        self.store = store
+        self.record_failure = record_failure
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.timeout = timeout
+        self.queue: asyncio.Queue[PhotoJob] = asyncio.Queue(maxsize=max_queue)
+        self._in_flight: set[tuple[int, int]] = set()
+        self._tasks: set[asyncio.Task] = set()
+
+    def submit(self, job: PhotoJob) -> bool:
+        """Queue a photo without waiting. Returns False if it is dropped (backpressure)."""
+        key = (job.chat_id, job.message_id)
+        if key in self._in_flight:
+            return True
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            metrics.incr("pet_pipeline_dropped")
+            config.log.warning(f"Pet detection queue is full, deferring {key}")
+            return False
+        self._in_flight.add(key)
+        metrics.set_gauge("pet_pipeline_queue_depth", self.queue.qsize())
+        return True
+
+    def is_queued(self, chat_id: int, message_id: int) -> bool:
+        return (chat_id, message_id) in self._in_flight
+
+    def start(self):
+        for i in range(self.workers):
+            self._spawn(self._worker(i))
+
+    async def stop(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def recover(self, rows: list[dict], caption_only: bool = False) -> int:
+        """Re-queue unprocessed ``photo_messages`` rows; returns how many were queued."""
+        queued = 0
+        for job in jobs_from_rows(rows, caption_only):
+            if not self.submit(job):
+                break
+            queued += 1
+        return queued
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _retry_later(self, job: PhotoJob, delay: float):
+        await asyncio.sleep(delay)
+        self.submit(job)
+
+    async def _worker(self, idx: int):
+        while True:
+            jobs = [await self.queue.get()]
+            while len(jobs) < self.batch_size and not self.queue.empty():
+                jobs.append(self.queue.get_nowait())
+            metrics.set_gauge("pet_pipeline_queue_depth", self.queue.qsize())
+            try:
+                if len(jobs) == 1:
+                    await self._process(jobs[0])
+                else:
+                    await self._process_batch(jobs)
+            finally:
+                for job in jobs:
+                    self._in_flight.discard((job.chat_id, job.message_id))
+                    self.queue.task_done()
+
+    async def _process(self, job: PhotoJob):
+        try:
+            with metrics.timed("pet_detection_seconds"):
+                outcome = await asyncio.wait_for(self.detect(job), self.timeout)
+            self.store(job, *outcome)
+            metrics.incr("pet_pipeline_processed")
+        except Exception as e:
+            self._failed(job, e)
+
+    async def _process_batch(self, jobs: list[PhotoJob]):
+        try:
+            with metrics.timed("pet_detection_batch_seconds"):
+                outcomes = await asyncio.wait_for(self.detect_batch(jobs), self.timeout)
+        except Exception as e:
+            outcomes = [e] * len(jobs)
+        for job, outcome in zip(jobs, outcomes):
+            if isinstance(outcome, BaseException):
+                self._failed(job, outcome)
+                continue
+            try:
+                self.store(job, *outcome)
+                metrics.incr("pet_pipeline_processed")
+            except Exception as e:
+                self._failed(job, e)
+
+    def _failed(self, job: PhotoJob, e: BaseException):
+        metrics.incr("pet_pipeline_failures")
+        try:
+            attempts = self.record_failure(job)
+        except Exception as db_error:
+            config.log.exception(f"Cannot record detection failure for {job}: {db_error}")
+            return
+        if attempts < self.max_attempts:
+            delay = self.retry_delay * 2 ** (attempts - 1)
+            config.log.warning(f"Pet detection failed for {job} (attempt {attempts}), retrying in {delay:.0f}s: {e}")
+            self._spawn(self._retry_later(job, delay))
+        else:
+            config.log.error(f"Pet detection gave up on {job} after {attempts} attempts: {e}")
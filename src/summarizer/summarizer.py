@@ -1,8 +1,7 @@
-import re
-import orjson as json
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable
 from datetime import datetime
 from zoneinfo import ZoneInfo
-from contextlib import closing
 from html import escape
 
 import google.generativeai as genai
@@ -13,17 +12,27 @@ from telegram import Chat
 from telegram.ext import ContextTypes
 
 import src.tools.config as config
-from src.tools.db import db
+from src.tools import metrics
+from src.tools.db import get_day_messages
+from src.tools.structured import (
+    StreamItemParser,
+    Topic,
+    TopicsReply,
+    decode,
+    gemini_generation_config,
+    openai_response_format,
+)
 from src.tools.utils import utc_ts, clean_text, message_link, user_link
 
 genai.configure(api_key=config.GEMINI_API_KEY)
 gemini_model = genai.GenerativeModel(
     config.GEMINI_MODEL_NAME,
-    generation_config={"response_mime_type": "application/json"},
+    generation_config=gemini_generation_config(TopicsReply),
 )
 openai_client = AsyncOpenAI(api_key=config.OPENAI_API_KEY)
 
 MAX_TOPICS_NUM = 7
+SUMMARY_SYSTEM_PROMPT = "Ти — надзвичайно саркастичний та їдкий помічник, що групує повідомлення чату у теми за календарний день. Завжди відповідай у форматі JSON"
 
 
 def get_toxicity_prompt(toxicity_level: int) -> str:
@@ -53,7 +62,7 @@ def get_toxicity_prompt(toxicity_level: int) -> str:
 }}
 
 УВАГА:
-- Орієнтуйся на reply-ланцюжки як ознаку теми; для нереплайних — об'єднуй за змістом.
+- Орієнтуйся на reply-ланцюжки як ознаку теми (thread= — message_id першого повідомлення ланцюжка); для нереплайних — об'єднуй за змістом.
 - Ігноруй службові повідомлення/стікери, якщо вони нічого не додають по суті.
 """
 
@@ -153,8 +162,12 @@ except KeyError:
     _encoder = tiktoken.get_encoding("cl100k_base")
 
 
+def count_tokens(text: str) -> int:
+    return len(_encoder.encode(text))
+
+
 def build_messages_snippet(
-    rows, max_tokens: int = 30_000, toxicity_level: int = 9
+    rows, max_tokens: int = 30_000, toxicity_level: int = 9, tz: ZoneInfo | None = None
 ) -> str:
     """Build messages snippet with token limit using tiktoken"""
     lines = []
@@ -165,7 +178,7 @@ def build_messages_snippet(
 
     for r in rows:
         ts = datetime.fromtimestamp(r["ts_utc"], tz=ZoneInfo("UTC")).astimezone(
-            config.KYIV
+            tz or config.KYIV
         )
         time = ts.strftime("%H:%M")
         name = (
@@ -179,6 +192,9 @@ def build_messages_snippet(
         reply = (
             f", reply_to={r['reply_to_message_id']}" if r["reply_to_message_id"] else ""
         )
+        # Deeper replies also name the first message of their chain
+        if (r.get("thread_depth") or 0) > 1:
+            reply += f", thread={r['thread_root_id']}"
 
         line = f"[{time}] {name} (uid={r['user_id']}, mid={r['message_id']}{reply}): {frag}"
 
@@ -192,43 +208,89 @@ def build_messages_snippet(
     return "\n".join(lines)
 
 
-async def get_openai_summary(prompt: str) -> dict:
+async def get_openai_summary(prompt: str) -> TopicsReply:
     """Get summary from OpenAI"""
     config.log.info(f"OpenAI prompt: {prompt}")
     try:
         response = await openai_client.chat.completions.create(
             model=config.OPENAI_MODEL_NAME,
             messages=[
-                {
-                    "role": "system",
-                    "content": "Ти — надзвичайно саркастичний та їдкий помічник, що групує повідомлення чату у теми за календарний день. Завжди відповідай у форматі JSON",
-                },
+                {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
                 {"role": "user", "content": prompt},
             ],
-            response_format={"type": "json_object"},
+            response_format=openai_response_format(TopicsReply),
         )
 
-        content = response.choices[0].message.content
-        return json.loads(content)
+        message = response.choices[0].message
+        if getattr(message, "refusal", None):
+            raise ValueError(f"content_filter: {message.refusal}")
+        return decode(message.content, TopicsReply)
     except Exception as e:
         config.log.exception("OpenAI API error: %s", e)
         raise
 
 
-async def get_gemini_summary(prompt: str) -> dict:
+async def get_gemini_summary(prompt: str) -> TopicsReply:
     """Get summary from Gemini"""
     try:
         config.log.info(f"Gemini prompt: {prompt}")
         resp = gemini_model.generate_content(prompt)
-        raw = resp.text or ""
-        m = re.search(r"\{.*\}", raw, re.S)
-        data = json.loads(m.group(0) if m else raw)
-        return data
+        return decode(resp.text, TopicsReply)
     except Exception as e:
         config.log.exception("Gemini API error: %s", e)
         raise
 
 
+async def stream_openai_summary(prompt: str) -> AsyncIterator[str]:
+    """Stream raw JSON text chunks of an OpenAI summary"""
+    config.log.info(f"OpenAI streaming prompt: {prompt}")
+    stream = await openai_client.chat.completions.create(
+        model=config.OPENAI_MODEL_NAME,
+        messages=[
+            {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt},
+        ],
+        response_format=openai_response_format(TopicsReply),
+        stream=True,
+    )
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        choice = chunk.choices[0]
+        if getattr(choice.delta, "refusal", None) or choice.finish_reason == "content_filter":
+            raise ValueError("content_filter")
+        if choice.delta.content:
+            yield choice.delta.content
+
+
+async def stream_gemini_summary(prompt: str) -> AsyncIterator[str]:
+    """Stream raw JSON text chunks of a Gemini summary"""
+    config.log.info(f"Gemini streaming prompt: {prompt}")
+    resp = await gemini_model.generate_content_async(prompt, stream=True)
+    async for chunk in resp:
+        # chunk.text raises ValueError on safety blocks, same as the non-streaming path
+        yield chunk.text
+
+
+async def stream_topics(
+    prompt: str,
+    use_openai: bool,
+    on_topics: Callable[[list[Topic]], Awaitable[None]],
+) -> TopicsReply:
+    """
+    Stream a summary, parsing topics incrementally and calling ``on_topics`` with
+    every topic parsed so far as soon as another one completes.
+    """
+    parser = StreamItemParser(Topic)
+    stream = stream_openai_summary(prompt) if use_openai else stream_gemini_summary(prompt)
+    async for chunk in stream:
+        if parser.feed(chunk):
+            await on_topics(list(parser.items))
+    if parser.items:
+        return TopicsReply(topics=parser.items)
+    return parser.finish(TopicsReply)
+
+
 def should_use_openai(chat_id: int) -> bool:
     """Determine if we should use OpenAI for this chat"""
     return chat_id in config.OPENAI_CHAT_IDS
@@ -244,13 +306,56 @@ def is_chat_configured(chat_id: int) -> bool:
     return chat_id in config.ALLOWED_CHAT_IDS
 
 
+def render_topics(chat: Chat, day_str: str, topics: list[Topic], rows: list[dict]) -> str:
+    """Render topics as the HTML summary post"""
+    header = f"<b>#Підсумки_дня — {escape(day_str)}</b>"
+    items = []
+
+    by_mid = {r["message_id"]: r for r in rows}
+    by_uid = {}
+    for r in rows:
+        by_uid.setdefault(r["user_id"], r)
+
+    for t in topics[:MAX_TOPICS_NUM]:
+        title = clean_text(t.short_title)
+        summ = clean_text(t.summary)
+        mid = t.first_message_id
+        uid = t.initiator_user_id
+
+        if mid in by_mid:
+            msg_url = message_link(chat, mid)
+            title_html = f'<a href="{msg_url}">{escape(title or "Тема")}</a>'
+        else:
+            title_html = escape(title or "Тема")
+
+        urow = by_uid.get(uid) or {}
+        initiator_html = user_link(
+            user_id=urow.get("user_id", uid or 0),
+            username=urow.get("username"),
+            full_name=urow.get("full_name") or "Учасник",
+        )
+
+        line = f"• {title_html} — ініціатор {initiator_html}"
+        if summ:
+            line += f"\nКоротко: {escape(summ)}"
+        items.append(line)
+
+    return header + "\n\n" + "\n\n".join(items)
+
+
 async def summarize_day(
     chat: Chat,
     start_local: datetime,
     end_local: datetime,
     ctx: ContextTypes.DEFAULT_TYPE,
     toxicity_level: int = 9,
+    on_progress: Callable[[str], Awaitable[None]] | None = None,
 ) -> str | None:
+    """
+    Summarize the chat between ``start_local`` and ``end_local``.
+    If ``on_progress`` is given, the summary is streamed and ``on_progress`` receives
+    the partially rendered post every time another topic is parsed.
+    """
     # Check if chat is configured for any AI provider
     if not is_chat_configured(chat.id):
         config.log.warning(f"Chat {chat.id} is not configured for any AI provider")
@@ -258,18 +363,13 @@ async def summarize_day(
 
     start_utc = start_local.astimezone(ZoneInfo("UTC"))
     end_utc = end_local.astimezone(ZoneInfo("UTC"))
-    with closing(db()) as conn, closing(conn.cursor()) as cur:
-        cur.execute(
-            "SELECT * FROM messages WHERE chat_id=%s AND ts_utc>=%s AND ts_utc<%s ORDER BY ts_utc ASC",
-            (chat.id, utc_ts(start_utc), utc_ts(end_utc)),
-        )
-        rows = [dict(r) for r in cur.fetchall()]
+    rows = get_day_messages(chat.id, utc_ts(start_utc), utc_ts(end_utc))
 
     rows = [r for r in rows if clean_text(r["text"])]
     if not rows:
         return None
 
-    snippet = build_messages_snippet(rows)
+    snippet = build_messages_snippet(rows, tz=start_local.tzinfo)
     day_str = (start_local.date()).strftime("%d.%m.%Y")
 
     # Determine which AI provider to use
@@ -290,7 +390,7 @@ async def summarize_day(
 
     # Try from requested toxicity_level down to 0 until we get a response (fallback on safety blocks)
     requested_level = max(0, min(9, toxicity_level))
-    topics = []
+    topics: list[Topic] = []
     safety_blocked_encountered = False
 
     for level in range(requested_level, -1, -1):
@@ -304,12 +404,27 @@ async def summarize_day(
                 f"Current toxicity level: {level} (requested: {requested_level})"
             )
             config.log.info(f"Current number of tokens: {len(_encoder.encode(prompt))}")
-            if use_openai:
+            started = time.perf_counter()
+            if on_progress is not None:
+                first_topic_seen = False
+
+                async def on_topics(partial: list[Topic]):
+                    nonlocal first_topic_seen
+                    if not first_topic_seen:
+                        first_topic_seen = True
+                        ttft = time.perf_counter() - started
+                        metrics.observe("summary_time_to_first_topic_seconds", ttft)
+                        config.log.info(f"First topic for chat {chat.id} after {ttft:.2f}s")
+                    await on_progress(render_topics(chat, day_str, partial, rows))
+
+                data = await stream_topics(prompt, use_openai, on_topics)
+            elif use_openai:
                 data = await get_openai_summary(prompt)
             else:
                 data = await get_gemini_summary(prompt)
+            metrics.observe("summary_generation_seconds", time.perf_counter() - started)
 
-            topics = data.get("topics", [])
+            topics = data.topics
             if topics:
                 toxicity_level = level  # record the actual level that worked
                 break
@@ -349,36 +464,4 @@ async def summarize_day(
             return random.choice(ironic_messages)
         return None
 
-    header = f"<b>#Підсумки_дня — {escape(day_str)}</b>"
-    items = []
-
-    by_mid = {r["message_id"]: r for r in rows}
-    by_uid = {}
-    for r in rows:
-        by_uid.setdefault(r["user_id"], r)
-
-    for t in topics[:MAX_TOPICS_NUM]:
-        title = clean_text(t.get("short_title") or "")
-        summ = clean_text(t.get("summary") or "")
-        mid = t.get("first_message_id")
-        uid = t.get("initiator_user_id")
-
-        if isinstance(mid, int) and mid in by_mid:
-            msg_url = message_link(chat, mid)
-            title_html = f'<a href="{msg_url}">{escape(title or "Тема")}</a>'
-        else:
-            title_html = escape(title or "Тема")
-
-        urow = by_uid.get(uid) or {}
-        initiator_html = user_link(
-            user_id=urow.get("user_id", uid or 0),
-            username=urow.get("username"),
-            full_name=urow.get("full_name") or "Учасник",
-        )
-
-        line = f"• {title_html} — ініціатор {initiator_html}"
-        if summ:
-            line += f"\nКоротко: {escape(summ)}"
-        items.append(line)
-
-    return header + "\n\n" + "\n\n".join(items)
+    return render_topics(chat, day_str, topics, rows)
@@ -0,0 +1,61 @@
+"""
+Concurrent update processing with per-chat ordering.
+
+PTB processes updates one at a time by default, so a slow handler in one chat
+stalls every other chat. ``PerChatUpdateProcessor`` lets up to
+``max_concurrent_updates`` updates run at once while updates of the same chat
+still run strictly in arrival order.
+"""
+import asyncio
+from collections.abc import Awaitable
+from typing import Any
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from src.tools import metrics
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._locks: dict[int, asyncio.Lock] = {}
+        self._waiters: dict[int, int] = {}
+
+    @staticmethod
+    def _chat_key(update: object) -> int | None:
+        if isinstance(update, Update) and update.effective_chat is not None:
+            return update.effective_chat.id
+        return None
+
+    async def process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        """
+        Wait for the chat's turn first and only then take a global slot, so updates queued
+        behind a slow handler of one chat do not hold slots that other chats could use.
+        """
+        key = self._chat_key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            async with lock:
+                await super().process_update(update, coroutine)
+        finally:
+            # Drop the lock of an idle chat so the map does not grow with every chat ever seen
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+                del self._locks[key]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        metrics.set_gauge("updates_in_flight", self.current_concurrent_updates)
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
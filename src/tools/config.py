@@ -18,6 +18,114 @@ OPENAI_MODEL_NAME = os.getenv("OPENAI_MODEL_NAME", "gpt-4o-mini")
 BOT_USER_ID = -1  # Special ID for bot messages
 MESSAGES_PER_USER = 10
 
+# Update delivery: "polling" (default) or "webhook" on PORT (the Fly http_service internal_port)
+TELEGRAM_MODE = os.getenv("TELEGRAM_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # public base URL, e.g. https://xxl-bot-summarizer.fly.dev
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+PORT = int(os.getenv("PORT", "8080"))
+
+# Updates handled concurrently across chats; updates of one chat are still processed in order
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "32"))
+
+# Outbound Bot API limits (Telegram: ~30 msg/s overall, 1 msg/s per chat, 20 msg/min per group)
+SEND_GLOBAL_PER_SECOND = float(os.getenv("SEND_GLOBAL_PER_SECOND", "25"))
+SEND_CHAT_PER_SECOND = float(os.getenv("SEND_CHAT_PER_SECOND", "1"))
+SEND_GROUP_PER_MINUTE = float(os.getenv("SEND_GROUP_PER_MINUTE", "20"))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "3"))
+
+# Where summaries, PanBot replies and pet detection run: "inline" in the bot process (default)
+# or "postgres" to enqueue them for `python -m src.worker` processes
+JOB_QUEUE_MODE = os.getenv("JOB_QUEUE_MODE", "inline").lower()
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "4"))
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", "1"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_DELAY_SECONDS = float(os.getenv("JOB_RETRY_DELAY_SECONDS", "15"))
+JOB_TIMEOUT_SECONDS = float(os.getenv("JOB_TIMEOUT_SECONDS", "300"))
+# Running jobs of a worker that died are re-queued after this long
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "900"))
+JOB_RETENTION_DAYS = int(os.getenv("JOB_RETENTION_DAYS", "7"))
+# Failed deliveries of finished jobs (e.g. Telegram errors) are retried this many times;
+# a result being delivered is re-taken after the lease if the bot died meanwhile
+JOB_DELIVERY_MAX_ATTEMPTS = int(os.getenv("JOB_DELIVERY_MAX_ATTEMPTS", "5"))
+JOB_DELIVERY_LEASE_SECONDS = int(os.getenv("JOB_DELIVERY_LEASE_SECONDS", "120"))
+
+# PanBot rolling context window per chat
+PANBOT_CONTEXT_HOURS = int(os.getenv("PANBOT_CONTEXT_HOURS", "12"))
+PANBOT_CONTEXT_MAX_TOKENS = int(os.getenv("PANBOT_CONTEXT_MAX_TOKENS", "30000"))
+# Token caps for the sections of a PanBot prompt: the reply chain and the latest chat tail
+PANBOT_THREAD_MAX_TOKENS = int(os.getenv("PANBOT_THREAD_MAX_TOKENS", "2000"))
+PANBOT_TAIL_MAX_TOKENS = int(os.getenv("PANBOT_TAIL_MAX_TOKENS", "800"))
+PANBOT_THREAD_MAX_DEPTH = int(os.getenv("PANBOT_THREAD_MAX_DEPTH", "50"))
+# PanBot long-term memory: messages older than the verbatim tail are condensed by a cheap model
+# PANBOT_MEMORY_MODEL overrides the model for both providers, by default each uses its small tier
+PANBOT_MEMORY_MODEL = {
+    "openai": os.getenv("PANBOT_MEMORY_MODEL") or "gpt-4o-mini",
+    "gemini": os.getenv("PANBOT_MEMORY_MODEL") or "gemini-2.5-flash-lite",
+}
+PANBOT_MEMORY_CONDENSE_TOKENS = int(os.getenv("PANBOT_MEMORY_CONDENSE_TOKENS", "1500"))
+PANBOT_MEMORY_MAX_WORDS = int(os.getenv("PANBOT_MEMORY_MAX_WORDS", "150"))
+# PanBot response cache for repeated / near-duplicate triggers in the same context
+PANBOT_CACHE_TTL_SECONDS = int(os.getenv("PANBOT_CACHE_TTL_SECONDS", "600"))
+PANBOT_CACHE_MAX_ENTRIES = int(os.getenv("PANBOT_CACHE_MAX_ENTRIES", "512"))
+PANBOT_CACHE_MAX_DISTANCE = int(os.getenv("PANBOT_CACHE_MAX_DISTANCE", "5"))
+
+# Background pet detection pipeline
+PET_DETECTION_WORKERS = int(os.getenv("PET_DETECTION_WORKERS", "2"))
+PET_DETECTION_QUEUE_SIZE = int(os.getenv("PET_DETECTION_QUEUE_SIZE", "200"))
+PET_DETECTION_MAX_ATTEMPTS = int(os.getenv("PET_DETECTION_MAX_ATTEMPTS", "3"))
+PET_DETECTION_RETRY_DELAY_SECONDS = float(os.getenv("PET_DETECTION_RETRY_DELAY_SECONDS", "10"))
+PET_DETECTION_TIMEOUT_SECONDS = float(os.getenv("PET_DETECTION_TIMEOUT_SECONDS", "60"))
+PET_DETECTION_RECOVERY_DAYS = int(os.getenv("PET_DETECTION_RECOVERY_DAYS", "2"))
+PET_CAPTION_BACKFILL_LIMIT = int(os.getenv("PET_CAPTION_BACKFILL_LIMIT", "500"))
+# Reuse detections of photos whose thumbnail dHash differs by at most this many bits
+PET_DEDUP_MAX_DISTANCE = int(os.getenv("PET_DEDUP_MAX_DISTANCE", "6"))
+# Local CPU prefilter that rejects obvious non-pets before the vision model (see src/petfinder/detectors.py)
+PET_PREFILTER_BACKEND = os.getenv("PET_PREFILTER_BACKEND", "none").lower()  # none | numpy | onnx
+PET_PREFILTER_MODEL_PATH = os.getenv("PET_PREFILTER_MODEL_PATH", "")
+PET_PREFILTER_THRESHOLD = float(os.getenv("PET_PREFILTER_THRESHOLD", "0.1"))  # reject below this pet probability
+PET_PREFILTER_PET_CLASSES = os.getenv("PET_PREFILTER_PET_CLASSES", "151-268,281-285")  # ImageNet dogs and cats
+PET_PREFILTER_INPUT_SIZE = int(os.getenv("PET_PREFILTER_INPUT_SIZE", "224"))
+# How long to wait for the rest of an album (media group) before storing it as one batch
+ALBUM_BUFFER_SECONDS = float(os.getenv("ALBUM_BUFFER_SECONDS", "1.5"))
+# Ranged /petfinder galleries
+PETFINDER_PAGE_SIZE = int(os.getenv("PETFINDER_PAGE_SIZE", "15"))
+PETFINDER_MAX_DAYS = int(os.getenv("PETFINDER_MAX_DAYS", "90"))
+# Concurrent vision calls when /petfinder catches up on photos the pipeline has not reached
+PETFINDER_CONCURRENCY = int(os.getenv("PETFINDER_CONCURRENCY", "4"))
+
+# Minimum interval between progressive edits of a placeholder message (Telegram edit rate limits)
+SUMMARY_EDIT_INTERVAL_SECONDS = float(os.getenv("SUMMARY_EDIT_INTERVAL_SECONDS", "3"))
+
+# Daily summaries: up to SUMMARY_CATCHUP_DAYS days missed while the bot was down are caught up;
+# a run claimed but not finished within the lease is retried
+SUMMARY_CATCHUP_DAYS = int(os.getenv("SUMMARY_CATCHUP_DAYS", "2"))
+SUMMARY_RUN_LEASE_SECONDS = int(os.getenv("SUMMARY_RUN_LEASE_SECONDS", "10800"))
+# A failed summary is retried after SUMMARY_RETRY_DELAY_SECONDS, doubling each time, up to
+# SUMMARY_MAX_ATTEMPTS attempts
+SUMMARY_RETRY_DELAY_SECONDS = int(os.getenv("SUMMARY_RETRY_DELAY_SECONDS", "600"))
+SUMMARY_MAX_ATTEMPTS = int(os.getenv("SUMMARY_MAX_ATTEMPTS", "4"))
+# Default local time of the daily summary (chats can override it and their timezone with
+# /summary_schedule); each chat gets a stable offset within SUMMARY_SPREAD_MINUTES after it
+SUMMARY_TIME = os.getenv("SUMMARY_TIME", "23:59")
+SUMMARY_SPREAD_MINUTES = int(os.getenv("SUMMARY_SPREAD_MINUTES", "30"))
+SUMMARY_TICK_SECONDS = int(os.getenv("SUMMARY_TICK_SECONDS", "60"))
+
+# messages and photo_messages are partitioned by month; partitions are created this many months
+# ahead. With a retention > 0, older months are detached, archived to ARCHIVE_DIR
+# as gzipped CSV and dropped (0 keeps everything)
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "2"))
+MESSAGE_RETENTION_MONTHS = int(os.getenv("MESSAGE_RETENTION_MONTHS", "0"))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "/app/data/archive")
+PARTITION_MAINTENANCE_HOURS = float(os.getenv("PARTITION_MAINTENANCE_HOURS", "6"))
+
+# Recent messages whose reply-thread position is kept in memory to resolve new replies
+THREAD_CACHE_SIZE = int(os.getenv("THREAD_CACHE_SIZE", "50000"))
+
+# /stats: longest period in days and the number of users ranked
+STATS_MAX_DAYS = int(os.getenv("STATS_MAX_DAYS", "365"))
+STATS_TOP_USERS = int(os.getenv("STATS_TOP_USERS", "10"))
+
 # Configuration for Gemini-enabled chat IDs
 _gemini_env = os.getenv("GEMINI_CHAT_IDS")
 GEMINI_CHAT_IDS = set()
@@ -104,5 +212,6 @@ log.info(f"ALLOWED_CHAT_IDS={ALLOWED_CHAT_IDS}")
 log.info(f"DATABASE_URL={DATABASE_URL}")
 log.info(f"GEMINI_MODEL_NAME={GEMINI_MODEL_NAME}")
 log.info(f"OPENAI_MODEL_NAME={OPENAI_MODEL_NAME}")
+log.info(f"PANBOT_MEMORY_MODEL={PANBOT_MEMORY_MODEL}")
 log.info(f"PANBOT_CHAT_IDS={PANBOT_CHAT_IDS}")
 log.info(f"MESSAGES_PER_USER={MESSAGES_PER_USER}")
\ No newline at end of file
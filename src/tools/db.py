@@ -1,11 +1,22 @@
-from contextlib import closing
+import re
+from contextlib import closing, contextmanager
+from datetime import date, datetime, timezone
+from typing import BinaryIO
+
 import psycopg
+from psycopg import sql
 from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
 from telegram import Chat
 
 import src.tools.config as config
+from src.petfinder.dedup import band_probes
+from src.tools.threads import ThreadPosition, ThreadResolver
+from src.tools.utils import month_start, utc_ts
 
-SCHEMA = """
+# Schema of migration 1, the tables as they were before versioned migrations (all IF NOT EXISTS,
+# so it also applies cleanly to databases created by the old start-up script)
+INITIAL_SCHEMA = """
 CREATE TABLE IF NOT EXISTS messages (
     chat_id BIGINT NOT NULL,
     message_id BIGINT NOT NULL,
@@ -15,8 +26,11 @@ CREATE TABLE IF NOT EXISTS messages (
     text TEXT,
     reply_to_message_id BIGINT,
     ts_utc BIGINT NOT NULL,
-    PRIMARY KEY (chat_id, message_id)
-);
+    PRIMARY KEY (chat_id, message_id, ts_utc)  -- the partition key must be part of the key
+) PARTITION BY RANGE (ts_utc);
+
+-- Monthly partitions messages_pYYYY_MM are created by ensure_partitions, rows outside them land here
+CREATE TABLE IF NOT EXISTS messages_default PARTITION OF messages DEFAULT;
 
 CREATE INDEX IF NOT EXISTS idx_messages_chat_ts ON messages(chat_id, ts_utc);
 
@@ -26,6 +40,9 @@ CREATE TABLE IF NOT EXISTS chats (
     enabled INTEGER NOT NULL DEFAULT 0
 );
 
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS tz TEXT;            -- IANA name, NULL -> config.TZ
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS summary_time TEXT;  -- 'HH:MM' local, NULL -> config.SUMMARY_TIME
+
 CREATE TABLE IF NOT EXISTS panbot_limits (
     user_id BIGINT NOT NULL,
     chat_id BIGINT NOT NULL,
@@ -35,6 +52,13 @@ CREATE TABLE IF NOT EXISTS panbot_limits (
 );
 
 CREATE INDEX IF NOT EXISTS idx_panbot_limits_date ON panbot_limits(date);
+
+CREATE TABLE IF NOT EXISTS panbot_memory (
+    chat_id BIGINT PRIMARY KEY,
+    summary TEXT NOT NULL,
+    covered_until_ts BIGINT NOT NULL, -- newest message folded into the summary
+    updated_at_utc BIGINT NOT NULL
+);
     
 CREATE TABLE IF NOT EXISTS pet_photos (
     chat_id BIGINT NOT NULL,
@@ -48,6 +72,12 @@ CREATE TABLE IF NOT EXISTS pet_photos (
 );
 
 CREATE INDEX IF NOT EXISTS idx_pet_photos_chat_ts ON pet_photos(chat_id, ts_utc);
+
+ALTER TABLE pet_photos ADD COLUMN IF NOT EXISTS caption TEXT;  -- NULL until captioned (backfill)
+ALTER TABLE pet_photos ADD COLUMN IF NOT EXISTS sarcasm_level INTEGER;
+ALTER TABLE pet_photos ADD COLUMN IF NOT EXISTS model TEXT;
+
+CREATE INDEX IF NOT EXISTS idx_pet_photos_uncaptioned ON pet_photos(ts_utc) WHERE caption IS NULL;
     
 
 CREATE TABLE IF NOT EXISTS photo_messages (
@@ -55,10 +85,72 @@ CREATE TABLE IF NOT EXISTS photo_messages (
     message_id BIGINT NOT NULL,
     ts_utc BIGINT NOT NULL,
     file_id TEXT NOT NULL,
+    PRIMARY KEY (chat_id, message_id, ts_utc)
+) PARTITION BY RANGE (ts_utc);
+
+CREATE TABLE IF NOT EXISTS photo_messages_default PARTITION OF photo_messages DEFAULT;
+
+CREATE INDEX IF NOT EXISTS idx_photo_messages_chat_ts ON photo_messages(chat_id, ts_utc);
+
+ALTER TABLE photo_messages ADD COLUMN IF NOT EXISTS detected_at_utc BIGINT;  -- NULL until the detector ran
+ALTER TABLE photo_messages ADD COLUMN IF NOT EXISTS detection_attempts INTEGER NOT NULL DEFAULT 0;
+
+CREATE INDEX IF NOT EXISTS idx_photo_messages_undetected ON photo_messages(ts_utc) WHERE detected_at_utc IS NULL;
+
+ALTER TABLE photo_messages ADD COLUMN IF NOT EXISTS file_unique_id TEXT;  -- same for forwarded copies
+ALTER TABLE photo_messages ADD COLUMN IF NOT EXISTS thumb_file_id TEXT;   -- smallest PhotoSize, for hashing
+ALTER TABLE photo_messages ADD COLUMN IF NOT EXISTS sizes JSONB;           -- [{file_id, width, height}, ...]
+ALTER TABLE photo_messages ADD COLUMN IF NOT EXISTS media_group_id TEXT;   -- album the photo belongs to
+
+CREATE TABLE IF NOT EXISTS photo_hashes (
+    chat_id BIGINT NOT NULL,
+    message_id BIGINT NOT NULL,
+    file_unique_id TEXT,
+    dhash BIGINT,                    -- 64-bit dHash of the thumbnail, NULL if hashing is unavailable
+    species TEXT NOT NULL,           -- detection result reused for duplicates
+    confidence REAL NOT NULL,
+    caption TEXT,
+    created_at_utc BIGINT NOT NULL,
     PRIMARY KEY (chat_id, message_id)
 );
 
-CREATE INDEX IF NOT EXISTS idx_photo_messages_chat_ts ON photo_messages(chat_id, ts_utc);
+CREATE INDEX IF NOT EXISTS idx_photo_hashes_unique_id ON photo_hashes(file_unique_id);
+
+CREATE TABLE IF NOT EXISTS jobs (
+    id BIGSERIAL PRIMARY KEY,
+    kind TEXT NOT NULL,              -- 'summary' | 'panbot_reply' | 'pet_detection'
+    payload JSONB NOT NULL,
+    dedup_key TEXT,                  -- at most one queued or running job per key
+    status TEXT NOT NULL DEFAULT 'queued',  -- 'queued' | 'running' | 'done' | 'failed'
+    attempts INTEGER NOT NULL DEFAULT 0,
+    run_after BIGINT NOT NULL,
+    locked_by TEXT,
+    locked_at BIGINT,
+    result JSONB,
+    error TEXT,
+    created_at_utc BIGINT NOT NULL,
+    finished_at_utc BIGINT,
+    delivered_at_utc BIGINT          -- NULL until the bot process delivered the result
+);
+
+CREATE INDEX IF NOT EXISTS idx_jobs_queued ON jobs(run_after, id) WHERE status = 'queued';
+CREATE INDEX IF NOT EXISTS idx_jobs_running ON jobs(locked_at) WHERE status = 'running';
+CREATE INDEX IF NOT EXISTS idx_jobs_undelivered ON jobs(id)
+    WHERE status IN ('done', 'failed') AND delivered_at_utc IS NULL;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_active_dedup ON jobs(dedup_key)
+    WHERE dedup_key IS NOT NULL AND status IN ('queued', 'running');
+
+CREATE TABLE IF NOT EXISTS summary_runs (
+    chat_id BIGINT NOT NULL,
+    day DATE NOT NULL,               -- local (Kyiv) day the summary covers
+    status TEXT NOT NULL,            -- 'running' | 'queued' (handed to a worker) | 'sent' | 'failed'
+    attempts INTEGER NOT NULL DEFAULT 1,
+    message_id BIGINT,               -- the delivered summary
+    error TEXT,
+    started_at_utc BIGINT NOT NULL,
+    finished_at_utc BIGINT,
+    PRIMARY KEY (chat_id, day)
+);
 """
 
 
@@ -68,21 +160,318 @@ def db():
 
 
 def init_db():
-    with closing(db()) as conn, conn, closing(conn.cursor()) as cur:
-        statements = [stmt.strip() for stmt in SCHEMA.split(';') if stmt.strip()]
-        for stmt in statements:
-            cur.execute(stmt)
+    with closing(db()) as conn:
+        conn.autocommit = True
+        migrate(conn)
+    ensure_partitions(utc_ts(datetime.now(timezone.utc)), config.PARTITION_MONTHS_AHEAD)
     enable_daily_summaries_for_all_allowed_chats()
 
+
+# Tables range-partitioned by month on ts_utc
+PARTITIONED_TABLES = ("messages", "photo_messages")
+_PARTITION_RE = re.compile(r"^(?P<table>.+)_p(?P<year>\d{4})_(?P<month>\d{2})$")
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month:%Y_%m}"
+
+
+def partition_bounds(month: date) -> tuple[int, int]:
+    """[start, end) of a monthly partition in UTC epoch seconds."""
+    start = datetime.combine(month_start(month), datetime.min.time(), tzinfo=timezone.utc)
+    end = datetime.combine(month_start(month, 1), datetime.min.time(), tzinfo=timezone.utc)
+    return utc_ts(start), utc_ts(end)
+
+
+def _create_partition(cur, table: str, month: date) -> bool:
+    """
+    Create the partition of ``month`` unless it exists. Rows of that month that already
+    landed in the default partition are moved into it before it is attached.
+    """
+    name = partition_name(table, month)
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL AS present", (name,))
+    if cur.fetchone()["present"]:
+        return False
+    start, end = partition_bounds(month)
+    cur.execute(sql.SQL("CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS)").format(
+        sql.Identifier(name), sql.Identifier(table)))
+    cur.execute(
+        sql.SQL("WITH moved AS (DELETE FROM {} WHERE ts_utc >= %s AND ts_utc < %s RETURNING *) "
+                "INSERT INTO {} SELECT * FROM moved").format(sql.Identifier(f"{table}_default"), sql.Identifier(name)),
+        (start, end),
+    )
+    cur.execute(sql.SQL("ALTER TABLE {} ATTACH PARTITION {} FOR VALUES FROM ({}) TO ({})").format(
+        sql.Identifier(table), sql.Identifier(name), sql.Literal(start), sql.Literal(end)))
+    return True
+
+
+def _create_partitions(cur, table: str, first_month: date, last_month: date) -> list[str]:
+    created = []
+    month = month_start(first_month)
+    while month <= last_month:
+        if _create_partition(cur, table, month):
+            created.append(partition_name(table, month))
+        month = month_start(month, 1)
+    return created
+
+
+def _rename_unpartitioned_tables(cur) -> dict[str, str]:
+    """
+    Move plain (pre-partitioning) tables aside so SCHEMA creates the partitioned ones;
+    their indexes and primary key are dropped to free the names. Returns {table: old name}.
+    """
+    legacy = {}
+    for table in PARTITIONED_TABLES:
+        cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+        row = cur.fetchone()
+        if row is None or row["relkind"] != "r":
+            continue
+        old = f"{table}_unpartitioned"
+        cur.execute(sql.SQL("ALTER TABLE {} RENAME TO {}").format(sql.Identifier(table), sql.Identifier(old)))
+        cur.execute(
+            """SELECT c.relname AS name, i.indisprimary FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+               WHERE i.indrelid = to_regclass(%s)""",
+            (old,),
+        )
+        for index in cur.fetchall():
+            if index["indisprimary"]:
+                cur.execute(sql.SQL("ALTER TABLE {} DROP CONSTRAINT {}").format(
+                    sql.Identifier(old), sql.Identifier(index["name"])))
+            else:
+                cur.execute(sql.SQL("DROP INDEX {}").format(sql.Identifier(index["name"])))
+        legacy[table] = old
+    return legacy
+
+
+def _copy_unpartitioned_table(cur, table: str, old: str):
+    cur.execute(sql.SQL("SELECT min(ts_utc) AS first_ts, count(*) AS n FROM {}").format(sql.Identifier(old)))
+    stats = cur.fetchone()
+    if stats["first_ts"] is not None:
+        first_month = datetime.fromtimestamp(stats["first_ts"], timezone.utc).date()
+        _create_partitions(cur, table, first_month, datetime.now(timezone.utc).date())
+    cur.execute(
+        "SELECT column_name FROM information_schema.columns WHERE table_schema = current_schema() AND table_name = %s",
+        (old,),
+    )
+    columns = sql.SQL(", ").join(sql.Identifier(r["column_name"]) for r in cur.fetchall())
+    cur.execute(sql.SQL("INSERT INTO {} ({}) SELECT {} FROM {} ON CONFLICT DO NOTHING").format(
+        sql.Identifier(table), columns, columns, sql.Identifier(old)))
+    cur.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(old)))
+    config.log.info(f"Moved {stats['n']} rows of {table} into monthly partitions")
+
+
+def _initial_schema(cur):
+    legacy = _rename_unpartitioned_tables(cur)
+    cur.execute(INITIAL_SCHEMA)
+    for table, old in legacy.items():
+        _copy_unpartitioned_table(cur, table, old)
+
+
+# Append only: (version, description, SQL or a function of the cursor). Each migration runs
+# once, in its own transaction, and is recorded in schema_migrations.
+MIGRATIONS = [
+    (1, "initial schema", _initial_schema),
+    (2, "indexes for the hot message queries", """
+        -- summarize_day's day scan and PanBot's lookback only read rows with text
+        CREATE INDEX IF NOT EXISTS idx_messages_chat_ts_text ON messages(chat_id, ts_utc) WHERE text <> '';
+        -- is_bot_message: bot-authored rows (config.BOT_USER_ID) are few, an index-only probe
+        CREATE INDEX IF NOT EXISTS idx_messages_bot ON messages(chat_id, message_id) WHERE user_id = -1;
+    """),
+    (3, "reply thread root and depth", """
+        ALTER TABLE messages ADD COLUMN IF NOT EXISTS thread_root_id BIGINT;  -- first message of the reply chain
+        ALTER TABLE messages ADD COLUMN IF NOT EXISTS thread_depth INTEGER;   -- 0 for the root
+
+        -- Backfill top-down from the roots. A reply to a message that was never stored
+        -- starts a thread rooted at that message, like at ingest (see ThreadResolver)
+        WITH RECURSIVE thread AS (
+            SELECT m.chat_id, m.message_id, m.ts_utc,
+                   COALESCE(m.reply_to_message_id, m.message_id) AS root,
+                   CASE WHEN m.reply_to_message_id IS NULL THEN 0 ELSE 1 END AS depth
+            FROM messages m
+            WHERE m.reply_to_message_id IS NULL
+               OR NOT EXISTS (SELECT 1 FROM messages p
+                              WHERE p.chat_id = m.chat_id AND p.message_id = m.reply_to_message_id)
+            UNION ALL
+            SELECT c.chat_id, c.message_id, c.ts_utc, t.root, t.depth + 1
+            FROM messages c
+            JOIN thread t ON c.chat_id = t.chat_id AND c.reply_to_message_id = t.message_id
+                         AND c.message_id > t.message_id
+        )
+        UPDATE messages m SET thread_root_id = t.root, thread_depth = t.depth
+        FROM thread t
+        WHERE m.chat_id = t.chat_id AND m.message_id = t.message_id AND m.ts_utc = t.ts_utc;
+
+        CREATE INDEX IF NOT EXISTS idx_messages_thread ON messages(chat_id, thread_root_id);
+    """),
+    (4, "hourly chat activity aggregates", """
+        CREATE TABLE IF NOT EXISTS chat_activity (
+            chat_id BIGINT NOT NULL,
+            hour_utc BIGINT NOT NULL,        -- start of the UTC hour
+            user_id BIGINT NOT NULL,         -- 0 for messages without a sender
+            username TEXT,                   -- latest seen, for display
+            full_name TEXT,
+            messages INTEGER NOT NULL DEFAULT 0,
+            chars BIGINT NOT NULL DEFAULT 0,
+            tokens BIGINT NOT NULL DEFAULT 0,
+            replies INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (chat_id, hour_utc, user_id)
+        );
+
+        -- History was stored without token counts, estimate ~4 characters per token
+        INSERT INTO chat_activity (chat_id, hour_utc, user_id, username, full_name, messages, chars, tokens, replies)
+        SELECT chat_id, ts_utc - ts_utc % 3600, COALESCE(user_id, 0),
+               (array_agg(username ORDER BY ts_utc DESC))[1], (array_agg(full_name ORDER BY ts_utc DESC))[1],
+               count(*), sum(char_length(COALESCE(text, ''))), sum((char_length(COALESCE(text, '')) + 3) / 4),
+               count(reply_to_message_id)
+        FROM messages
+        GROUP BY 1, 2, 3
+        ON CONFLICT (chat_id, hour_utc, user_id) DO NOTHING;
+    """),
+    (5, "dHash band indexes for near-duplicate photos", """
+        -- find_similar_photo_hash only compares hashes that share a probed 16-bit band
+        CREATE INDEX IF NOT EXISTS idx_photo_hashes_band0 ON photo_hashes((dhash & 65535)) WHERE dhash IS NOT NULL;
+        CREATE INDEX IF NOT EXISTS idx_photo_hashes_band1 ON photo_hashes(((dhash >> 16) & 65535))
+            WHERE dhash IS NOT NULL;
+        CREATE INDEX IF NOT EXISTS idx_photo_hashes_band2 ON photo_hashes(((dhash >> 32) & 65535))
+            WHERE dhash IS NOT NULL;
+        CREATE INDEX IF NOT EXISTS idx_photo_hashes_band3 ON photo_hashes(((dhash >> 48) & 65535))
+            WHERE dhash IS NOT NULL;
+    """),
+    (6, "job result delivery retries", """
+        ALTER TABLE jobs ADD COLUMN IF NOT EXISTS delivery_attempts INTEGER NOT NULL DEFAULT 0;
+        -- Set while a bot process is delivering the result (lease) or waiting to retry it
+        ALTER TABLE jobs ADD COLUMN IF NOT EXISTS deliver_after BIGINT;
+    """),
+    (7, "drop PanBot replies from chat activity", f"""
+        DELETE FROM chat_activity WHERE user_id = {int(config.BOT_USER_ID)};
+    """),
+]
+
+MIGRATION_LOCK_KEY = 0x4D494752  # "MIGR"
+
+
+def migrate(conn) -> list[int]:
+    """
+    Apply the pending MIGRATIONS in order on an autocommit connection; returns the versions
+    applied. The bot and the workers may start together, so the runner holds an advisory lock.
+    """
+    conn.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+    try:
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS schema_migrations (
+                   version INTEGER PRIMARY KEY,
+                   description TEXT NOT NULL,
+                   applied_at_utc BIGINT NOT NULL
+               )"""
+        )
+        applied = {r["version"] for r in conn.execute("SELECT version FROM schema_migrations").fetchall()}
+        done = []
+        for version, description, step in MIGRATIONS:
+            if version in applied:
+                continue
+            with conn.transaction(), closing(conn.cursor()) as cur:
+                if callable(step):
+                    step(cur)
+                else:
+                    cur.execute(step)
+                cur.execute(
+                    "INSERT INTO schema_migrations (version, description, applied_at_utc) VALUES (%s, %s, %s)",
+                    (version, description, utc_ts(datetime.now(timezone.utc))),
+                )
+            config.log.info(f"Applied migration {version}: {description}")
+            done.append(version)
+        return done
+    finally:
+        conn.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+
+
+def ensure_partitions(now_utc: int, months_ahead: int) -> list[str]:
+    """Create the partitions of the current month and ``months_ahead`` following ones; returns the new ones."""
+    month = month_start(datetime.fromtimestamp(now_utc, timezone.utc).date())
+    created = []
+    with closing(db()) as conn, conn, closing(conn.cursor()) as cur:
+        for table in PARTITIONED_TABLES:
+            created += _create_partitions(cur, table, month, month_start(month, months_ahead))
+    return created
+
+
+def get_expired_partitions(before_month: date) -> list[dict]:
+    """
+    Monthly partitions (attached or already detached) of months before ``before_month``,
+    oldest first: [{table, partition, month, attached}].
+    """
+    with closing(db()) as conn, closing(conn.cursor()) as cur:
+        cur.execute(
+            """SELECT relname, relispartition FROM pg_class
+               WHERE relkind = 'r' AND relnamespace = current_schema()::regnamespace AND relname ~ '_p[0-9]{4}_[0-9]{2}$'"""
+        )
+        rows = cur.fetchall()
+    expired = []
+    for row in rows:
+        m = _PARTITION_RE.match(row["relname"])
+        if m is None or m.group("table") not in PARTITIONED_TABLES:
+            continue
+        month = date(int(m.group("year")), int(m.group("month")), 1)
+        if month < before_month:
+            expired.append({"table": m.group("table"), "partition": row["relname"], "month": month,
+                            "attached": row["relispartition"]})
+    return sorted(expired, key=lambda p: (p["month"], p["table"]))
+
+
+def detach_partition(table: str, partition: str):
+    with closing(db()) as conn, conn, closing(conn.cursor()) as cur:
+        cur.execute(sql.SQL("ALTER TABLE {} DETACH PARTITION {}").format(sql.Identifier(table), sql.Identifier(partition)))
+
+
+def copy_partition_to(partition: str, out: BinaryIO) -> int:
+    """Write a (detached) partition to ``out`` as CSV with a header; returns the bytes written."""
+    written = 0
+    with closing(db()) as conn, closing(conn.cursor()) as cur:
+        query = sql.SQL("COPY {} TO STDOUT WITH (FORMAT csv, HEADER)").format(sql.Identifier(partition))
+        with cur.copy(query) as copy:
+            for chunk in copy:
+                out.write(chunk)
+                written += len(chunk)
+    return written
+
+
+def drop_partition(partition: str):
+    with closing(db()) as conn, conn, closing(conn.cursor()) as cur:
+        cur.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(partition)))
+
 def add_message(
-    chat_id, message_id, user_id, username, full_name, text, reply_to_message_id, ts_utc
+    chat_id, message_id, user_id, username, full_name, text, reply_to_message_id, ts_utc, tokens=0,
+    reply_to_ts_utc=None,
 ):
+    """
+    Store a message and, if it is new, add it to the chat's hourly activity in the same statement
+    (PanBot's own replies are not counted as activity).
+    ``reply_to_ts_utc`` (the parent's date) lets a thread lookup read a single partition.
+    """
+    thread_root_id, thread_depth = threads.resolve(chat_id, message_id, reply_to_message_id, reply_to_ts_utc)
     with closing(db()) as conn, closing(conn.cursor()) as cur:
         cur.execute(
-            """INSERT INTO messages
-               (chat_id, message_id, user_id, username, full_name, text, reply_to_message_id, ts_utc)
-               VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-               ON CONFLICT (chat_id, message_id) DO NOTHING""",
+            """WITH inserted AS (
+                   INSERT INTO messages
+                   (chat_id, message_id, user_id, username, full_name, text, reply_to_message_id, ts_utc,
+                    thread_root_id, thread_depth)
+                   VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                   ON CONFLICT (chat_id, message_id, ts_utc) DO NOTHING
+                   RETURNING chat_id, user_id, username, full_name, text, reply_to_message_id, ts_utc
+               )
+               INSERT INTO chat_activity AS a
+               (chat_id, hour_utc, user_id, username, full_name, messages, chars, tokens, replies)
+               SELECT chat_id, ts_utc - ts_utc % 3600, COALESCE(user_id, 0), username, full_name,
+                      1, char_length(COALESCE(text, '')), %s, (reply_to_message_id IS NOT NULL)::int
+               FROM inserted
+               WHERE user_id IS DISTINCT FROM %s
+               ON CONFLICT (chat_id, hour_utc, user_id) DO UPDATE
+               SET messages = a.messages + 1,
+                   chars = a.chars + EXCLUDED.chars,
+                   tokens = a.tokens + EXCLUDED.tokens,
+                   replies = a.replies + EXCLUDED.replies,
+                   username = EXCLUDED.username,
+                   full_name = EXCLUDED.full_name""",
             (
                 chat_id,
                 message_id,
@@ -92,11 +481,48 @@ def add_message(
                 text,
                 reply_to_message_id,
                 ts_utc,
+                thread_root_id,
+                thread_depth,
+                tokens,
+                config.BOT_USER_ID,
             ),
         )
         conn.commit()
 
 
+def get_chat_activity(chat_id: int, start_ts_utc: int, end_ts_utc: int) -> list[dict]:
+    """Hourly per-user activity rows of a chat with ``hour_utc`` in [start, end)."""
+    with closing(db()) as conn, closing(conn.cursor()) as cur:
+        cur.execute(
+            """SELECT hour_utc, user_id, username, full_name, messages, chars, tokens, replies
+               FROM chat_activity
+               WHERE chat_id=%s AND hour_utc >= %s AND hour_utc < %s""",
+            (chat_id, start_ts_utc, end_ts_utc),
+        )
+        return list(cur.fetchall())
+
+
+def get_thread_position(chat_id: int, message_id: int, ts_utc: int | None = None) -> ThreadPosition | None:
+    """Stored thread position of a message; pass its ``ts_utc`` when known to read one partition."""
+    conditions = ["chat_id=%s", "message_id=%s", "thread_root_id IS NOT NULL"]
+    params: list = [chat_id, message_id]
+    if ts_utc is not None:
+        conditions.append("ts_utc=%s")
+        params.append(ts_utc)
+    with closing(db()) as conn, closing(conn.cursor()) as cur:
+        cur.execute(
+            f"""SELECT thread_root_id, thread_depth FROM messages
+                WHERE {" AND ".join(conditions)}
+                LIMIT 1""",
+            params,
+        )
+        row = cur.fetchone()
+        return (row["thread_root_id"], row["thread_depth"]) if row else None
+
+
+threads = ThreadResolver(get_thread_position, config.THREAD_CACHE_SIZE)
+
+
 def ensure_chat_record(chat: Chat, *, enable_default: int = 1):
     title = chat.title or chat.username or str(chat.id)
     with closing(db()) as conn, closing(conn.cursor()) as cur:
@@ -137,6 +563,24 @@ def get_enabled_chat_ids() -> list[int]:
         return [r["chat_id"] for r in cur.fetchall()]
 
 
+def get_enabled_chat_schedules() -> list[dict]:
+    with closing(db()) as conn, closing(conn.cursor()) as cur:
+        cur.execute("SELECT chat_id, tz, summary_time FROM chats WHERE enabled=1")
+        return list(cur.fetchall())
+
+
+def get_chat_schedule(chat_id: int) -> dict | None:
+    with closing(db()) as conn, closing(conn.cursor()) as cur:
+        cur.execute("SELECT chat_id, tz, summary_time FROM chats WHERE chat_id=%s", (chat_id,))
+        return cur.fetchone()
+
+
+def set_chat_schedule(chat_id: int, tz: str | None, summary_time: str | None):
+    with closing(db()) as conn, closing(conn.cursor()) as cur:
+        cur.execute("UPDATE chats SET tz=%s, summary_time=%s WHERE chat_id=%s", (tz, summary_time, chat_id))
+        conn.commit()
+
+
 def get_panbot_usage(user_id: int, chat_id: int, date: str) -> int:
     with closing(db()) as conn, closing(conn.cursor()) as cur:
         cur.execute(
@@ -168,34 +612,163 @@ def reset_panbot_usage_for_date(date: str):
         conn.commit()
 
 
-def is_bot_message(chat_id: int, message_id: int) -> bool:
+def get_panbot_memory(chat_id: int) -> dict | None:
     with closing(db()) as conn, closing(conn.cursor()) as cur:
         cur.execute(
-            "SELECT user_id FROM messages WHERE chat_id=%s AND message_id=%s",
-            (chat_id, message_id),
+            "SELECT summary, covered_until_ts FROM panbot_memory WHERE chat_id=%s",
+            (chat_id,),
         )
-        row = cur.fetchone()
-        return row is not None and row["user_id"] == config.BOT_USER_ID
+        return cur.fetchone()
 
-def upsert_pet_photo(chat_id: int, message_id: int, ts_utc: int, species: str, confidence: float, file_id: str | None, created_at_utc: int):
+
+def upsert_panbot_memory(chat_id: int, summary: str, covered_until_ts: int):
     with closing(db()) as conn, closing(conn.cursor()) as cur:
         cur.execute(
-            """INSERT INTO pet_photos (chat_id, message_id, ts_utc, species, confidence, file_id, created_at_utc)
-               VALUES (%s, %s, %s, %s, %s, %s, %s)
+            """INSERT INTO panbot_memory (chat_id, summary, covered_until_ts, updated_at_utc)
+               VALUES (%s, %s, %s, EXTRACT(EPOCH FROM now())::BIGINT)
+               ON CONFLICT (chat_id)
+               DO UPDATE SET summary=EXCLUDED.summary,
+                             covered_until_ts=EXCLUDED.covered_until_ts,
+                             updated_at_utc=EXCLUDED.updated_at_utc""",
+            (chat_id, summary, covered_until_ts),
+        )
+        conn.commit()
+
+
+# The hot message queries, kept here so tests can EXPLAIN exactly what runs. The bot user id
+# and the text filter are literals so the planner can match the partial indexes of migration 2.
+IS_BOT_MESSAGE_SQL = f"""SELECT EXISTS (
+    SELECT 1 FROM messages
+    WHERE chat_id=%s AND message_id=%s AND ts_utc=%s AND user_id = {int(config.BOT_USER_ID)}
+) AS is_bot"""
+RECENT_MESSAGES_SQL = """SELECT message_id, user_id, username, full_name, text, reply_to_message_id, ts_utc
+    FROM messages
+    WHERE chat_id=%s AND ts_utc >= %s AND text <> ''
+    ORDER BY ts_utc DESC LIMIT %s"""
+DAY_MESSAGES_SQL = """SELECT chat_id, message_id, user_id, username, full_name, text, reply_to_message_id, ts_utc,
+           thread_root_id, thread_depth
+    FROM messages
+    WHERE chat_id=%s AND ts_utc >= %s AND ts_utc < %s AND text <> ''
+    ORDER BY ts_utc ASC"""
+
+
+def is_bot_message(chat_id: int, message_id: int, ts_utc: int) -> bool:
+    with closing(db()) as conn, closing(conn.cursor()) as cur:
+        cur.execute(IS_BOT_MESSAGE_SQL, (chat_id, message_id, ts_utc))
+        return cur.fetchone()["is_bot"]
+
+def get_recent_messages(chat_id: int, since_ts_utc: int, limit: int = 1000) -> list[dict]:
+    """Newest ``limit`` messages with text of a chat since ``since_ts_utc``, in chronological order."""
+    with closing(db()) as conn, closing(conn.cursor()) as cur:
+        cur.execute(RECENT_MESSAGES_SQL, (chat_id, since_ts_utc, limit))
+        return list(cur.fetchall())[::-1]
+
+
+def get_day_messages(chat_id: int, start_ts_utc: int, end_ts_utc: int) -> list[dict]:
+    """Messages with text in [start, end), oldest first (the summarize_day scan)."""
+    with closing(db()) as conn, closing(conn.cursor()) as cur:
+        cur.execute(DAY_MESSAGES_SQL, (chat_id, start_ts_utc, end_ts_utc))
+        return list(cur.fetchall())
+
+def get_reply_chain(chat_id: int, message_id: int, max_depth: int = 50) -> list[dict]:
+    """
+    Reply chain starting at ``message_id`` and walking up ``reply_to_message_id``, nearest first.
+    The candidates are read in one indexed query over the message's thread.
+    """
+    with closing(db()) as conn, closing(conn.cursor()) as cur:
+        cur.execute(
+            """SELECT m.message_id, m.user_id, m.username, m.full_name, m.text, m.reply_to_message_id, m.ts_utc
+               FROM messages s
+               JOIN messages m ON m.chat_id = s.chat_id AND m.thread_root_id = s.thread_root_id
+                              AND m.thread_depth > s.thread_depth - %s AND m.thread_depth <= s.thread_depth
+                              AND m.ts_utc <= s.ts_utc
+               WHERE s.chat_id=%s AND s.message_id=%s""",
+            (max_depth, chat_id, message_id),
+        )
+        by_id = {r["message_id"]: r for r in cur.fetchall()}
+    chain = []
+    next_id = message_id
+    while next_id in by_id and len(chain) < max_depth:
+        row = by_id.pop(next_id)
+        chain.append(row)
+        next_id = row["reply_to_message_id"]
+    return chain
+
+
+def upsert_pet_photo(chat_id: int, message_id: int, ts_utc: int, species: str, confidence: float, file_id: str | None, created_at_utc: int,
+                     caption: str | None = None, sarcasm_level: int | None = None, model: str | None = None):
+    with closing(db()) as conn, closing(conn.cursor()) as cur:
+        cur.execute(
+            """INSERT INTO pet_photos (chat_id, message_id, ts_utc, species, confidence, file_id, created_at_utc,
+                                       caption, sarcasm_level, model)
+               VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
                ON CONFLICT (chat_id, message_id)
                DO UPDATE SET species=EXCLUDED.species,
                              confidence=EXCLUDED.confidence,
                              file_id=EXCLUDED.file_id,
                              ts_utc=EXCLUDED.ts_utc,
-                             created_at_utc=EXCLUDED.created_at_utc""",
-            (chat_id, message_id, ts_utc, species, confidence, file_id, created_at_utc),
+                             created_at_utc=EXCLUDED.created_at_utc,
+                             caption=EXCLUDED.caption,
+                             sarcasm_level=EXCLUDED.sarcasm_level,
+                             model=EXCLUDED.model""",
+            (chat_id, message_id, ts_utc, species, confidence, file_id, created_at_utc,
+             caption, sarcasm_level, model),
         )
         conn.commit()
 
+
+def upsert_pet_photos(rows: list[dict]):
+    """Batch version of ``upsert_pet_photo``: one round trip and one commit for many detections."""
+    if not rows:
+        return
+    with closing(db()) as conn, closing(conn.cursor()) as cur:
+        cur.executemany(
+            """INSERT INTO pet_photos (chat_id, message_id, ts_utc, species, confidence, file_id, created_at_utc,
+                                       caption, sarcasm_level, model)
+               VALUES (%(chat_id)s, %(message_id)s, %(ts_utc)s, %(species)s, %(confidence)s, %(file_id)s,
+                       %(created_at_utc)s, %(caption)s, %(sarcasm_level)s, %(model)s)
+               ON CONFLICT (chat_id, message_id)
+               DO UPDATE SET species=EXCLUDED.species,
+                             confidence=EXCLUDED.confidence,
+                             file_id=EXCLUDED.file_id,
+                             ts_utc=EXCLUDED.ts_utc,
+                             created_at_utc=EXCLUDED.created_at_utc,
+                             caption=EXCLUDED.caption,
+                             sarcasm_level=EXCLUDED.sarcasm_level,
+                             model=EXCLUDED.model""",
+            rows,
+        )
+        conn.commit()
+
+
+def update_pet_caption(chat_id: int, message_id: int, caption: str, sarcasm_level: int, model: str):
+    """Store a (re)generated caption without touching the detection itself."""
+    with closing(db()) as conn, closing(conn.cursor()) as cur:
+        cur.execute(
+            """UPDATE pet_photos SET caption=%s, sarcasm_level=%s, model=%s
+               WHERE chat_id=%s AND message_id=%s""",
+            (caption, sarcasm_level, model, chat_id, message_id),
+        )
+        conn.commit()
+
+
+def get_uncaptioned_pet_photos(limit: int = 500) -> list[dict]:
+    """Pet photos detected before captions were stored, newest first."""
+    with closing(db()) as conn, closing(conn.cursor()) as cur:
+        cur.execute(
+            """SELECT chat_id, message_id, ts_utc, file_id
+               FROM pet_photos
+               WHERE caption IS NULL AND file_id IS NOT NULL
+               ORDER BY ts_utc DESC
+               LIMIT %s""",
+            (limit,),
+        )
+        return list(cur.fetchall())
+
 def get_pet_messages_between(chat_id: int, start_ts_utc: int, end_ts_utc: int) -> list[dict]:
     with closing(db()) as conn, closing(conn.cursor()) as cur:
         cur.execute(
-            """SELECT chat_id, message_id, ts_utc, species, confidence, file_id
+            """SELECT chat_id, message_id, ts_utc, species, confidence, file_id, caption
                FROM pet_photos
                WHERE chat_id=%s AND ts_utc >= %s AND ts_utc < %s
                ORDER BY ts_utc ASC""",
@@ -204,24 +777,396 @@ def get_pet_messages_between(chat_id: int, start_ts_utc: int, end_ts_utc: int) -
         return list(cur.fetchall())
 
 
-def upsert_photo_message(chat_id: int, message_id: int, ts_utc: int, file_id: str):
+def get_pet_page(chat_id: int, start_ts_utc: int, end_ts_utc: int, species: str | None,
+                 anchor: tuple[int, int] | None, forward: bool, limit: int) -> list[dict]:
+    """
+    One keyset page of pet photos ordered by (ts_utc, message_id). It reads pet_photos alone,
+    so no photo_messages partition is scanned and pets outlive archived partitions.
+    ``forward`` reads rows after ``anchor``, otherwise rows before it. Returns up to
+    ``limit + 1`` rows in ascending order; the extra row tells the caller there is another
+    page in that direction.
+    """
+    conditions = ["p.chat_id = %s", "p.ts_utc >= %s", "p.ts_utc < %s"]
+    params: list = [chat_id, start_ts_utc, end_ts_utc]
+    if species is not None:
+        conditions.append("p.species = %s")
+        params.append(species)
+    if anchor is not None:
+        conditions.append("(p.ts_utc, p.message_id) > (%s, %s)" if forward else "(p.ts_utc, p.message_id) < (%s, %s)")
+        params.extend(anchor)
+    order = "ASC" if forward else "DESC"
     with closing(db()) as conn, closing(conn.cursor()) as cur:
         cur.execute(
-            """INSERT INTO photo_messages (chat_id, message_id, ts_utc, file_id)
-               VALUES (%s, %s, %s, %s)
-               ON CONFLICT (chat_id, message_id)
-               DO UPDATE SET ts_utc=EXCLUDED.ts_utc, file_id=EXCLUDED.file_id""",
-            (chat_id, message_id, ts_utc, file_id),
+            f"""SELECT p.message_id, p.ts_utc, p.species, p.confidence, p.caption
+                FROM pet_photos p
+                WHERE {" AND ".join(conditions)}
+                ORDER BY p.ts_utc {order}, p.message_id {order}
+                LIMIT %s""",
+            (*params, limit + 1),
+        )
+        rows = list(cur.fetchall())
+    return rows if forward else rows[::-1]
+
+
+def upsert_photo_message(chat_id: int, message_id: int, ts_utc: int, file_id: str,
+                         file_unique_id: str | None = None, thumb_file_id: str | None = None,
+                         sizes: list[dict] | None = None):
+    with closing(db()) as conn, closing(conn.cursor()) as cur:
+        cur.execute(
+            """INSERT INTO photo_messages (chat_id, message_id, ts_utc, file_id, file_unique_id, thumb_file_id, sizes)
+               VALUES (%s, %s, %s, %s, %s, %s, %s)
+               ON CONFLICT (chat_id, message_id, ts_utc)
+               DO UPDATE SET file_id=EXCLUDED.file_id,
+                             file_unique_id=EXCLUDED.file_unique_id, thumb_file_id=EXCLUDED.thumb_file_id,
+                             sizes=EXCLUDED.sizes""",
+            (chat_id, message_id, ts_utc, file_id, file_unique_id, thumb_file_id,
+             Jsonb(sizes) if sizes is not None else None),
+        )
+        conn.commit()
+
+def upsert_photo_messages(rows: list[dict]):
+    """Batch insert of photo rows (e.g. a whole album) in one round trip."""
+    if not rows:
+        return
+    rows = [{**r, "sizes": Jsonb(r["sizes"]) if r.get("sizes") is not None else None} for r in rows]
+    with closing(db()) as conn, closing(conn.cursor()) as cur:
+        cur.executemany(
+            """INSERT INTO photo_messages (chat_id, message_id, ts_utc, file_id, file_unique_id, thumb_file_id,
+                                           sizes, media_group_id)
+               VALUES (%(chat_id)s, %(message_id)s, %(ts_utc)s, %(file_id)s, %(file_unique_id)s,
+                       %(thumb_file_id)s, %(sizes)s, %(media_group_id)s)
+               ON CONFLICT (chat_id, message_id, ts_utc)
+               DO UPDATE SET file_id=EXCLUDED.file_id,
+                             file_unique_id=EXCLUDED.file_unique_id, thumb_file_id=EXCLUDED.thumb_file_id,
+                             sizes=EXCLUDED.sizes, media_group_id=EXCLUDED.media_group_id""",
+            rows,
         )
         conn.commit()
 
+
 def get_photo_messages_between(chat_id: int, start_ts_utc: int, end_ts_utc: int) -> list[dict]:
     with closing(db()) as conn, closing(conn.cursor()) as cur:
         cur.execute(
-            """SELECT chat_id, message_id, ts_utc, file_id
+            """SELECT chat_id, message_id, ts_utc, file_id, file_unique_id, thumb_file_id, sizes, media_group_id,
+                      detected_at_utc, detection_attempts
                FROM photo_messages
                WHERE chat_id=%s AND ts_utc >= %s AND ts_utc < %s
                ORDER BY ts_utc ASC""",
             (chat_id, start_ts_utc, end_ts_utc),
         )
         return list(cur.fetchall())
+
+
+def get_undetected_photo_messages(since_ts_utc: int, max_attempts: int, limit: int = 1000) -> list[dict]:
+    """Photos the background detector has not processed yet (e.g. queued before a restart)."""
+    with closing(db()) as conn, closing(conn.cursor()) as cur:
+        cur.execute(
+            """SELECT chat_id, message_id, ts_utc, file_id, file_unique_id, thumb_file_id, sizes, media_group_id
+               FROM photo_messages
+               WHERE detected_at_utc IS NULL AND ts_utc >= %s AND detection_attempts < %s
+               ORDER BY ts_utc ASC
+               LIMIT %s""",
+            (since_ts_utc, max_attempts, limit),
+        )
+        return list(cur.fetchall())
+
+
+def mark_photo_detected(chat_id: int, message_id: int, ts_utc: int, detected_at_utc: int):
+    with closing(db()) as conn, closing(conn.cursor()) as cur:
+        cur.execute(
+            "UPDATE photo_messages SET detected_at_utc=%s WHERE chat_id=%s AND message_id=%s AND ts_utc=%s",
+            (detected_at_utc, chat_id, message_id, ts_utc),
+        )
+        conn.commit()
+
+
+def mark_photos_detected(chat_id: int, message_ids: list[int], since_ts_utc: int, detected_at_utc: int):
+    """Mark several photos, none older than ``since_ts_utc`` (which bounds the partitions read)."""
+    if not message_ids:
+        return
+    with closing(db()) as conn, closing(conn.cursor()) as cur:
+        cur.execute(
+            """UPDATE photo_messages SET detected_at_utc=%s
+               WHERE chat_id=%s AND message_id = ANY(%s) AND ts_utc >= %s""",
+            (detected_at_utc, chat_id, list(message_ids), since_ts_utc),
+        )
+        conn.commit()
+
+
+def find_photo_hash_by_unique_id(file_unique_id: str) -> dict | None:
+    with closing(db()) as conn, closing(conn.cursor()) as cur:
+        cur.execute(
+            """SELECT species, confidence, caption FROM photo_hashes
+               WHERE file_unique_id=%s ORDER BY created_at_utc DESC LIMIT 1""",
+            (file_unique_id,),
+        )
+        return cur.fetchone()
+
+
+# Expressions must match the band indexes of migration 5 (and dedup.BANDS/BAND_BITS)
+SIMILAR_PHOTO_HASH_SQL = """
+    SELECT species, confidence, caption, bit_count((dhash # %s)::bit(64)) AS distance
+    FROM photo_hashes
+    WHERE dhash IS NOT NULL
+      AND ((dhash & 65535) = ANY(%s::bigint[])
+           OR ((dhash >> 16) & 65535) = ANY(%s::bigint[])
+           OR ((dhash >> 32) & 65535) = ANY(%s::bigint[])
+           OR ((dhash >> 48) & 65535) = ANY(%s::bigint[]))
+      AND bit_count((dhash # %s)::bit(64)) <= %s
+    ORDER BY distance ASC, created_at_utc DESC
+    LIMIT 1"""
+
+
+def find_similar_photo_hash(dhash: int, max_distance: int) -> dict | None:
+    """
+    Nearest stored detection whose dHash is within ``max_distance`` bits (Hamming distance).
+    Only hashes sharing a probed band are compared, through the band indexes.
+    """
+    with closing(db()) as conn, closing(conn.cursor()) as cur:
+        cur.execute(SIMILAR_PHOTO_HASH_SQL, (dhash, *band_probes(dhash, max_distance), dhash, max_distance))
+        return cur.fetchone()
+
+
+def save_photo_hash(chat_id: int, message_id: int, file_unique_id: str | None, dhash: int | None,
+                    species: str, confidence: float, caption: str, created_at_utc: int):
+    with closing(db()) as conn, closing(conn.cursor()) as cur:
+        cur.execute(
+            """INSERT INTO photo_hashes (chat_id, message_id, file_unique_id, dhash, species, confidence,
+                                         caption, created_at_utc)
+               VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+               ON CONFLICT (chat_id, message_id)
+               DO UPDATE SET file_unique_id=EXCLUDED.file_unique_id, dhash=EXCLUDED.dhash,
+                             species=EXCLUDED.species, confidence=EXCLUDED.confidence,
+                             caption=EXCLUDED.caption, created_at_utc=EXCLUDED.created_at_utc""",
+            (chat_id, message_id, file_unique_id, dhash, species, confidence, caption, created_at_utc),
+        )
+        conn.commit()
+
+
+def increment_photo_detection_attempts(chat_id: int, message_id: int, ts_utc: int) -> int:
+    with closing(db()) as conn, closing(conn.cursor()) as cur:
+        cur.execute(
+            """UPDATE photo_messages SET detection_attempts = detection_attempts + 1
+               WHERE chat_id=%s AND message_id=%s AND ts_utc=%s
+               RETURNING detection_attempts""",
+            (chat_id, message_id, ts_utc),
+        )
+        row = cur.fetchone()
+        conn.commit()
+        return row["detection_attempts"] if row else 0
+
+
+@contextmanager
+def advisory_lock(key: int):
+    """
+    Try to take a session-level advisory lock for the duration of the block; yields whether
+    this process got it. Only one holder at a time across all processes and machines.
+    """
+    with closing(db()) as conn:
+        conn.autocommit = True
+        acquired = conn.execute("SELECT pg_try_advisory_lock(%s) AS acquired", (key,)).fetchone()["acquired"]
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                conn.execute("SELECT pg_advisory_unlock(%s)", (key,))
+
+
+def claim_summary_run(chat_id: int, day: str, now_utc: int, stale_before_utc: int,
+                      retry_delay: int, max_attempts: int) -> bool:
+    """
+    Claim the summary of ``chat_id`` for ``day`` (ISO date). False if it was already sent or
+    is in progress elsewhere. Failed runs are re-claimed after ``retry_delay * 2**(attempts-1)``
+    seconds and runs started before ``stale_before_utc`` are taken over, both only until
+    ``max_attempts`` attempts were made.
+    """
+    with closing(db()) as conn, closing(conn.cursor()) as cur:
+        cur.execute(
+            """INSERT INTO summary_runs (chat_id, day, status, started_at_utc)
+               VALUES (%s, %s, 'running', %s)
+               ON CONFLICT (chat_id, day) DO UPDATE
+                   SET status='running', attempts=summary_runs.attempts + 1, error=NULL,
+                       started_at_utc=EXCLUDED.started_at_utc, finished_at_utc=NULL
+                   WHERE summary_runs.attempts < %s
+                     AND ((summary_runs.status = 'failed'
+                           AND summary_runs.finished_at_utc
+                               <= EXCLUDED.started_at_utc - %s * (1::bigint << (summary_runs.attempts - 1)))
+                          OR (summary_runs.status IN ('running', 'queued') AND summary_runs.started_at_utc < %s))
+               RETURNING chat_id""",
+            (chat_id, day, now_utc, max_attempts, retry_delay, stale_before_utc),
+        )
+        claimed = cur.fetchone() is not None
+        conn.commit()
+        return claimed
+
+
+def finish_summary_run(chat_id: int, day: str, status: str, now_utc: int,
+                       message_id: int | None = None, error: str | None = None):
+    with closing(db()) as conn, closing(conn.cursor()) as cur:
+        cur.execute(
+            """UPDATE summary_runs SET status=%s, message_id=%s, error=%s, finished_at_utc=%s
+               WHERE chat_id=%s AND day=%s""",
+            (status, message_id, error, None if status == "queued" else now_utc, chat_id, day),
+        )
+        conn.commit()
+
+
+def get_sent_summary_runs(since_day: str) -> set[tuple[int, str]]:
+    """(chat_id, ISO day) pairs already delivered since ``since_day``."""
+    with closing(db()) as conn, closing(conn.cursor()) as cur:
+        cur.execute("SELECT chat_id, day FROM summary_runs WHERE day >= %s AND status='sent'", (since_day,))
+        return {(r["chat_id"], r["day"].isoformat()) for r in cur.fetchall()}
+
+
+def get_chats_with_summary_runs() -> set[int]:
+    """Chats the scheduler has run for before; only these are caught up on missed days."""
+    with closing(db()) as conn, closing(conn.cursor()) as cur:
+        cur.execute("SELECT DISTINCT chat_id FROM summary_runs")
+        return {r["chat_id"] for r in cur.fetchall()}
+
+
+def enqueue_jobs(kind: str, items: list[tuple[dict, str | None]], now_utc: int) -> int:
+    """Queue ``(payload, dedup_key)`` jobs; a key that already has a queued or running job is skipped."""
+    if not items:
+        return 0
+    with closing(db()) as conn, closing(conn.cursor()) as cur:
+        queued = 0
+        for payload, dedup_key in items:
+            cur.execute(
+                """INSERT INTO jobs (kind, payload, dedup_key, run_after, created_at_utc)
+                   VALUES (%s, %s, %s, %s, %s)
+                   ON CONFLICT (dedup_key) WHERE dedup_key IS NOT NULL AND status IN ('queued', 'running')
+                   DO NOTHING""",
+                (kind, Jsonb(payload), dedup_key, now_utc, now_utc),
+            )
+            queued += cur.rowcount
+        conn.commit()
+        return queued
+
+
+def claim_jobs(kinds: list[str], worker_id: str, limit: int, now_utc: int) -> list[dict]:
+    """Lock up to ``limit`` due jobs for ``worker_id``; concurrent workers skip each other's rows."""
+    with closing(db()) as conn, closing(conn.cursor()) as cur:
+        cur.execute(
+            """UPDATE jobs SET status='running', attempts=attempts + 1, locked_by=%s, locked_at=%s
+               WHERE id IN (
+                   SELECT id FROM jobs
+                   WHERE status='queued' AND run_after <= %s AND kind = ANY(%s)
+                   ORDER BY run_after, id
+                   LIMIT %s
+                   FOR UPDATE SKIP LOCKED
+               )
+               RETURNING id, kind, payload, attempts, created_at_utc""",
+            (worker_id, now_utc, now_utc, list(kinds), limit),
+        )
+        rows = sorted(cur.fetchall(), key=lambda r: r["id"])
+        conn.commit()
+        return rows
+
+
+def complete_job(job_id: int, result: dict | None, now_utc: int, deliver: bool = True):
+    """Mark a job done; without ``deliver`` there is nothing for the bot process to pick up."""
+    with closing(db()) as conn, closing(conn.cursor()) as cur:
+        cur.execute(
+            """UPDATE jobs SET status='done', result=%s, error=NULL, finished_at_utc=%s,
+                              delivered_at_utc=%s, locked_by=NULL, locked_at=NULL
+               WHERE id=%s""",
+            (Jsonb(result) if result is not None else None, now_utc, None if deliver else now_utc, job_id),
+        )
+        conn.commit()
+
+
+def fail_job(job_id: int, error: str, now_utc: int, retry_at: int | None, deliver: bool = True):
+    """Re-queue a failed job to run at ``retry_at``, or give up on it when ``retry_at`` is None."""
+    with closing(db()) as conn, closing(conn.cursor()) as cur:
+        if retry_at is not None:
+            cur.execute(
+                """UPDATE jobs SET status='queued', error=%s, run_after=%s, locked_by=NULL, locked_at=NULL
+                   WHERE id=%s""",
+                (error, retry_at, job_id),
+            )
+        else:
+            cur.execute(
+                """UPDATE jobs SET status='failed', error=%s, finished_at_utc=%s, delivered_at_utc=%s,
+                                  locked_by=NULL, locked_at=NULL
+                   WHERE id=%s""",
+                (error, now_utc, None if deliver else now_utc, job_id),
+            )
+        conn.commit()
+
+
+def requeue_stale_jobs(locked_before_utc: int) -> int:
+    """Give running jobs of a worker that died (lease expired) back to the queue."""
+    with closing(db()) as conn, closing(conn.cursor()) as cur:
+        cur.execute(
+            """UPDATE jobs SET status='queued', locked_by=NULL, locked_at=NULL
+               WHERE status='running' AND locked_at < %s""",
+            (locked_before_utc,),
+        )
+        count = cur.rowcount
+        conn.commit()
+        return count
+
+
+def purge_finished_jobs(finished_before_utc: int) -> int:
+    with closing(db()) as conn, closing(conn.cursor()) as cur:
+        cur.execute(
+            """DELETE FROM jobs
+               WHERE status IN ('done', 'failed') AND delivered_at_utc IS NOT NULL AND finished_at_utc < %s""",
+            (finished_before_utc,),
+        )
+        count = cur.rowcount
+        conn.commit()
+        return count
+
+
+def take_job_results(kinds: list[str], limit: int, now_utc: int, lease_seconds: int) -> list[dict]:
+    """
+    Finished jobs whose results are due for delivery, leased for ``lease_seconds`` in the same
+    statement so two bot processes never deliver one result at once. The caller confirms with
+    ``mark_job_delivered`` or reschedules with ``retry_job_delivery``; a result whose lease runs
+    out (the bot died mid-delivery) is taken again.
+    """
+    with closing(db()) as conn, closing(conn.cursor()) as cur:
+        cur.execute(
+            """UPDATE jobs SET deliver_after=%s, delivery_attempts = delivery_attempts + 1
+               WHERE id IN (
+                   SELECT id FROM jobs
+                   WHERE status IN ('done', 'failed') AND delivered_at_utc IS NULL AND kind = ANY(%s)
+                     AND (deliver_after IS NULL OR deliver_after <= %s)
+                   ORDER BY id
+                   LIMIT %s
+                   FOR UPDATE SKIP LOCKED
+               )
+               RETURNING id, kind, payload, status, result, error, delivery_attempts""",
+            (now_utc + lease_seconds, list(kinds), now_utc, limit),
+        )
+        rows = sorted(cur.fetchall(), key=lambda r: r["id"])
+        conn.commit()
+        return rows
+
+
+def mark_job_delivered(job_id: int, now_utc: int):
+    with closing(db()) as conn, closing(conn.cursor()) as cur:
+        cur.execute("UPDATE jobs SET delivered_at_utc=%s, deliver_after=NULL WHERE id=%s", (now_utc, job_id))
+        conn.commit()
+
+
+def retry_job_delivery(job_id: int, retry_at: int):
+    """Take the result again at ``retry_at`` after a failed delivery."""
+    with closing(db()) as conn, closing(conn.cursor()) as cur:
+        cur.execute("UPDATE jobs SET deliver_after=%s WHERE id=%s", (retry_at, job_id))
+        conn.commit()
+
+
+def get_active_job_keys(dedup_keys: list[str]) -> set[str]:
+    """The subset of ``dedup_keys`` that has a queued or running job."""
+    if not dedup_keys:
+        return set()
+    with closing(db()) as conn, closing(conn.cursor()) as cur:
+        cur.execute(
+            """SELECT dedup_key FROM jobs
+               WHERE dedup_key = ANY(%s) AND status IN ('queued', 'running')""",
+            (list(dedup_keys),),
+        )
+        return {r["dedup_key"] for r in cur.fetchall()}
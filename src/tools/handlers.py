@@ -1,24 +1,66 @@
-from datetime import datetime, timezone, time as dtime
+from datetime import datetime, timedelta, timezone, time as dtime
+import asyncio
 from contextlib import closing
+from functools import partial
+import html
 import random
+import time
 
-from telegram import Update, Chat, Message
+from zoneinfo import ZoneInfo
+
+from telegram import Update, Chat, ChatMember, Message, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ParseMode
-from telegram.ext import ContextTypes
+from telegram.error import BadRequest
+from telegram.ext import ContextTypes, Application
 
 import src.tools.config as config
 from src.tools.db import (
     db,
     ensure_chat_record,
     add_message,
-    upsert_photo_message,
+    upsert_photo_messages,
     get_photo_messages_between,
     get_pet_messages_between,
-    upsert_pet_photo
+    get_pet_page,
+    get_undetected_photo_messages,
+    get_uncaptioned_pet_photos,
+    increment_photo_detection_attempts,
+    find_photo_hash_by_unique_id,
+    find_similar_photo_hash,
+    save_photo_hash,
+    mark_photo_detected,
+    mark_photos_detected,
+    upsert_pet_photo,
+    upsert_pet_photos,
+    update_pet_caption,
+    enqueue_jobs,
+    get_active_job_keys,
+    take_job_results,
+    mark_job_delivered,
+    retry_job_delivery,
+    finish_summary_run,
+    get_chat_schedule,
+    set_chat_schedule,
+    get_chat_activity,
 )
 from src.panbot.bot import PanBot, SarcasmLimitExceeded
-from src.summarizer.summarizer import summarize_day
-from src.petfinder.pets import detect_and_caption_by_file_id, PET_CONFIDENCE_THRESHOLD
+from src.summarizer.summarizer import summarize_day, count_tokens
+from src.petfinder.pets import (
+    detect_and_caption_batch_with_bot,
+    detect_and_caption_with_bot,
+    PET_CONFIDENCE_THRESHOLD,
+    PET_DETECTION_BATCH_SIZE,
+    PET_VISION_MODEL,
+)
+from src.petfinder.albums import AlbumBuffer
+from src.petfinder.dedup import PhotoDeduper
+from src.petfinder.gallery import PageCursor, split_page, parse_args as parse_petfinder_args
+from src.petfinder.detectors import get_prefilter, rejects as prefilter_rejects
+from src.petfinder.pipeline import DetectionPipeline, PhotoJob, detect_concurrently, jobs_from_rows
+from src.tools.schedules import ChatSchedule, parse_summary_time, parse_timezone, spread_offset
+from src.tools.jobqueue import JOB_PANBOT_REPLY, JOB_PET_DETECTION, JOB_SUMMARY, ResultDelivery
+from src.tools.sendqueue import PRIORITY_BACKGROUND
+from src.tools.stats import compute_stats, render_stats
 from src.tools.utils import utc_ts, local_midnight_bounds, message_link
 
 INITIAL_PLACEHOLDERS = [
@@ -40,7 +82,310 @@ INITIAL_PLACEHOLDERS = [
     "🎯 Цікаво, скільки разів ви сьогодні минули суть повз вуха?",
 ]
 
+PETFINDER_SARCASM_LEVEL = 5
+PROGRESS_SUFFIX = "\n\n⏳ <i>Думаю далі…</i>"
+
 panbot = PanBot(daily_limit=config.MESSAGES_PER_USER)
+pet_pipeline: DetectionPipeline | None = None
+job_delivery: ResultDelivery | None = None
+
+SUMMARY_FAILED_TEXT = "❌ Не вдалося сформувати підсумок, спробуйте пізніше."
+PANBOT_FAILED_TEXT = ("Щось пішло не так з моїм сарказмом... "
+                      "Можливо, ваше питання було занадто складним для мого штучного інтелекту 🤖")
+
+
+def _use_job_queue() -> bool:
+    """Whether expensive work is enqueued for ``src.worker`` processes instead of running here."""
+    return config.JOB_QUEUE_MODE == "postgres"
+
+
+def _now_utc() -> int:
+    return utc_ts(datetime.now(timezone.utc))
+
+
+def _chat_schedule(chat_id: int) -> ChatSchedule:
+    return ChatSchedule.from_row(get_chat_schedule(chat_id) or {"chat_id": chat_id})
+
+
+def _chat_timezone(chat_id: int) -> ZoneInfo:
+    """The chat's own timezone (``/summary_schedule``), ``config.KYIV`` by default."""
+    try:
+        return _chat_schedule(chat_id).tz
+    except Exception as e:
+        config.log.exception(f"Reading the schedule of chat {chat_id} failed: {e}")
+        return config.KYIV
+
+
+class ThrottledEditor:
+    """
+    Edits a placeholder message progressively, at most once per ``interval`` seconds.
+    Intermediate texts that arrive too fast are dropped; ``finish`` always
+    delivers the final text.
+    """
+
+    def __init__(self, message: Message, interval: float = config.SUMMARY_EDIT_INTERVAL_SECONDS):
+        self.message = message
+        self.interval = interval
+        self._last_edit = 0.0
+        self._last_text: str | None = None
+
+    async def _edit(self, text: str):
+        if text == self._last_text:
+            return
+        try:
+            await self.message.edit_text(
+                text, parse_mode=ParseMode.HTML, disable_web_page_preview=True
+            )
+            self._last_text = text
+        except BadRequest as e:
+            config.log.warning(f"Progressive edit failed: {e}")
+        self._last_edit = time.monotonic()
+
+    async def update(self, text: str):
+        if time.monotonic() - self._last_edit < self.interval:
+            return
+        await self._edit(text + PROGRESS_SUFFIX)
+
+    async def finish(self, text: str):
+        await self._edit(text)
+
+
+def _save_photo_hash(chat_id, message_id, file_unique_id, dhash, species, conf, caption):
+    save_photo_hash(chat_id, message_id, file_unique_id, dhash, species, conf, caption,
+                    created_at_utc=utc_ts(datetime.now(timezone.utc)))
+
+
+pet_deduper = PhotoDeduper(
+    find_exact=find_photo_hash_by_unique_id,
+    find_similar=find_similar_photo_hash,
+    save=_save_photo_hash,
+    max_distance=config.PET_DEDUP_MAX_DISTANCE,
+)
+
+
+def _thumbnail_fetcher(bot, job: PhotoJob):
+    """Downloads the smallest variant once; shared by the dedup hash and the prefilter."""
+    if not job.thumb_file_id:
+        return None
+    cached: list[bytes] = []
+
+    async def fetch_thumbnail():
+        if not cached:
+            file = await bot.get_file(job.thumb_file_id)
+            cached.append(bytes(await file.download_as_bytearray()))
+        return cached[0]
+
+    return fetch_thumbnail
+
+
+async def _prefilter_rejects(fetch_thumbnail) -> bool:
+    return await prefilter_rejects(get_prefilter(), fetch_thumbnail, config.PET_PREFILTER_THRESHOLD)
+
+
+async def _detect_album(bot, job: PhotoJob) -> tuple[str, float, str, str]:
+    """
+    One verdict per album: its photos share one batched request and the most confident pet wins.
+    The verdict carries the file_id of the member it was found on as a fourth element.
+    """
+    outcomes = await _detect_pets(bot, list(job.album))
+    results = [(*o, m.file_id) for m, o in zip(job.album, outcomes) if not isinstance(o, BaseException)]
+    if not results:
+        raise outcomes[0]
+    pets = [r for r in results if r[0] in ("cat", "dog")]
+    return max(pets, key=lambda r: r[1]) if pets else results[0]
+
+
+async def _detect_pet(bot, job: PhotoJob) -> tuple[str, float, str]:
+    """Vision detection behind the perceptual-hash dedup and the local prefilter;
+    caption regeneration always calls the model."""
+    if job.album:
+        return await _detect_album(bot, job)
+    fetch_thumbnail = _thumbnail_fetcher(bot, job)
+
+    async def vision():
+        if not job.caption_only and await _prefilter_rejects(fetch_thumbnail):
+            return "none", 0.0, ""
+        return await detect_and_caption_with_bot(bot, job.file_id, sarcasm_level=PETFINDER_SARCASM_LEVEL,
+                                                 sizes=list(job.sizes))
+
+    if job.caption_only:
+        return await vision()
+    return await pet_deduper.detect(job.chat_id, job.message_id, job.file_unique_id, vision, fetch_thumbnail)
+
+
+async def _no_lookup():
+    return None, None
+
+
+async def _not_rejected():
+    return False
+
+
+async def _detect_pets(bot, jobs: list[PhotoJob]) -> list:
+    """Batched ``_detect_pet``: duplicates are answered from the hash index, obvious non-pets by the
+    prefilter, and the rest share vision requests."""
+    if any(job.album for job in jobs):
+        singles = [job for job in jobs if not job.album]
+        single_outcomes = iter(await _detect_pets(bot, singles) if singles else [])
+        album_outcomes = iter(await asyncio.gather(
+            *(_detect_album(bot, job) for job in jobs if job.album), return_exceptions=True
+        ))
+        return [next(album_outcomes) if job.album else next(single_outcomes) for job in jobs]
+
+    fetchers = [_thumbnail_fetcher(bot, job) for job in jobs]
+    lookups = await asyncio.gather(*(
+        pet_deduper.lookup(job.file_unique_id, fetch) if not job.caption_only else _no_lookup()
+        for job, fetch in zip(jobs, fetchers)
+    ), return_exceptions=True)
+
+    outcomes: list = [None] * len(jobs)
+    misses: list[tuple[int, int | None]] = []
+    for i, lookup in enumerate(lookups):
+        if isinstance(lookup, BaseException):
+            outcomes[i] = lookup
+        elif lookup[0] is not None:
+            outcomes[i] = lookup[0]
+        else:
+            misses.append((i, lookup[1]))
+
+    rejected = await asyncio.gather(*(
+        _prefilter_rejects(fetchers[i]) if not jobs[i].caption_only else _not_rejected() for i, _ in misses
+    ))
+    for (i, phash), reject in zip(misses, rejected):
+        if reject:
+            outcomes[i] = ("none", 0.0, "")
+            pet_deduper.index(jobs[i].chat_id, jobs[i].message_id, jobs[i].file_unique_id, phash, *outcomes[i])
+    misses = [m for m, reject in zip(misses, rejected) if not reject]
+
+    detected = await detect_and_caption_batch_with_bot(
+        bot, [(jobs[i].file_id, list(jobs[i].sizes)) for i, _ in misses], PETFINDER_SARCASM_LEVEL
+    ) if misses else []
+    for (i, phash), outcome in zip(misses, detected):
+        outcomes[i] = outcome
+        job = jobs[i]
+        if not isinstance(outcome, BaseException) and not job.caption_only:
+            pet_deduper.index(job.chat_id, job.message_id, job.file_unique_id, phash, *outcome)
+    return outcomes
+
+
+def _store_pet_detection(job: PhotoJob, species: str, conf: float, caption: str, file_id: str | None = None):
+    if job.caption_only:
+        update_pet_caption(job.chat_id, job.message_id, caption, PETFINDER_SARCASM_LEVEL, PET_VISION_MODEL)
+        return
+    now_utc = utc_ts(datetime.now(timezone.utc))
+    if species in ("cat", "dog") and conf >= PET_CONFIDENCE_THRESHOLD:
+        upsert_pet_photo(
+            chat_id=job.chat_id,
+            message_id=job.message_id,
+            ts_utc=job.ts_utc,
+            species=species,
+            confidence=conf,
+            file_id=file_id or job.file_id,
+            created_at_utc=now_utc,
+            caption=caption,
+            sarcasm_level=PETFINDER_SARCASM_LEVEL,
+            model=PET_VISION_MODEL,
+        )
+    if job.album:
+        # The representative is the album's earliest photo
+        mark_photos_detected(job.chat_id, job.message_ids, job.ts_utc, now_utc)
+    else:
+        mark_photo_detected(job.chat_id, job.message_id, job.ts_utc, now_utc)
+
+
+_PET_JOB_ROW_KEYS = ("chat_id", "message_id", "ts_utc", "file_id", "file_unique_id", "thumb_file_id", "sizes",
+                     "media_group_id")
+
+
+def _pet_job_key(job: PhotoJob) -> str:
+    return f"{'caption' if job.caption_only else 'pet'}:{job.chat_id}:{job.message_id}"
+
+
+def _enqueue_pet_jobs(rows: list[dict], caption_only: bool = False) -> int:
+    """Queue photo rows for the workers; one job per photo or album, never twice while pending."""
+    by_id = {(r["chat_id"], r["message_id"]): r for r in rows}
+    items = []
+    for job in jobs_from_rows(rows, caption_only):
+        members = [{k: by_id[(job.chat_id, mid)].get(k) for k in _PET_JOB_ROW_KEYS} for mid in job.message_ids]
+        items.append(({"rows": members, "caption_only": caption_only}, _pet_job_key(job)))
+    return enqueue_jobs(JOB_PET_DETECTION, items, _now_utc())
+
+
+def record_pet_detection_job_failure(payload: dict):
+    """Count a failed worker attempt on the job's photos, like the in-process pipeline does,
+    so /petfinder and recovery give up on them after ``PET_DETECTION_MAX_ATTEMPTS``."""
+    if payload.get("caption_only"):
+        return
+    for row in payload["rows"]:
+        increment_photo_detection_attempts(row["chat_id"], row["message_id"], row["ts_utc"])
+
+
+async def run_pet_detection_jobs(bot, payloads: list[dict]) -> list:
+    """Worker side of pet detection jobs: detect and store a batch, ``None`` or an exception per job."""
+    jobs = [jobs_from_rows(p["rows"], p.get("caption_only", False))[0] for p in payloads]
+    outcomes = []
+    for job, outcome in zip(jobs, await _detect_pets(bot, jobs)):
+        if not isinstance(outcome, BaseException):
+            try:
+                _store_pet_detection(job, *outcome)
+                outcome = None
+            except Exception as e:
+                outcome = e
+        outcomes.append(outcome)
+    return outcomes
+
+
+async def start_pet_pipeline(app: Application):
+    """post_init hook: start detection workers and re-queue photos left unprocessed."""
+    global pet_pipeline
+
+    if _use_job_queue():
+        # Detection runs in src.worker; only hand over what an earlier run left behind
+        since = _now_utc() - config.PET_DETECTION_RECOVERY_DAYS * 24 * 60 * 60
+        try:
+            queued = _enqueue_pet_jobs(get_undetected_photo_messages(since, config.PET_DETECTION_MAX_ATTEMPTS))
+            captions = _enqueue_pet_jobs(get_uncaptioned_pet_photos(config.PET_CAPTION_BACKFILL_LIMIT),
+                                         caption_only=True)
+            config.log.info(f"Queued {queued} photos and {captions} pet captions for the workers")
+        except Exception as e:
+            config.log.exception(f"Pet job recovery failed: {e}")
+        return
+
+    async def detect(job: PhotoJob):
+        return await _detect_pet(app.bot, job)
+
+    async def detect_batch(jobs: list[PhotoJob]):
+        return await _detect_pets(app.bot, jobs)
+
+    pet_pipeline = DetectionPipeline(
+        detect=detect,
+        detect_batch=detect_batch,
+        batch_size=PET_DETECTION_BATCH_SIZE,
+        store=_store_pet_detection,
+        record_failure=lambda job: increment_photo_detection_attempts(job.chat_id, job.message_id, job.ts_utc),
+        workers=config.PET_DETECTION_WORKERS,
+        max_queue=config.PET_DETECTION_QUEUE_SIZE,
+        max_attempts=config.PET_DETECTION_MAX_ATTEMPTS,
+        retry_delay=config.PET_DETECTION_RETRY_DELAY_SECONDS,
+        timeout=config.PET_DETECTION_TIMEOUT_SECONDS,
+    )
+    pet_pipeline.start()
+
+    since = utc_ts(datetime.now(timezone.utc)) - config.PET_DETECTION_RECOVERY_DAYS * 24 * 60 * 60
+    try:
+        rows = get_undetected_photo_messages(since, config.PET_DETECTION_MAX_ATTEMPTS)
+        config.log.info(f"Pet pipeline started, recovered {pet_pipeline.recover(rows)} photos")
+        # Backfill captions of pets detected before captions were persisted
+        rows = get_uncaptioned_pet_photos(config.PET_CAPTION_BACKFILL_LIMIT)
+        config.log.info(f"Queued {pet_pipeline.recover(rows, caption_only=True)} pet captions for backfill")
+    except Exception as e:
+        config.log.exception(f"Pet pipeline recovery failed: {e}")
+
+
+async def stop_pet_pipeline(app: Application):
+    await album_buffer.drain()
+    if pet_pipeline is not None:
+        await pet_pipeline.stop()
 
 
 async def on_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -61,51 +406,129 @@ async def on_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if ts.tzinfo is None:
         ts = ts.replace(tzinfo=timezone.utc)
 
-    add_message(
-        chat.id,
-        msg.message_id,
-        (msg.from_user and msg.from_user.id) or None,
-        (msg.from_user and msg.from_user.username) or None,
-        (msg.from_user and msg.from_user.full_name) or None,
-        text,
-        (msg.reply_to_message and msg.reply_to_message.message_id) or None,
-        utc_ts(ts.astimezone(timezone.utc)),
+    row = dict(
+        message_id=msg.message_id,
+        user_id=(msg.from_user and msg.from_user.id) or None,
+        username=(msg.from_user and msg.from_user.username) or None,
+        full_name=(msg.from_user and msg.from_user.full_name) or None,
+        text=text,
+        reply_to_message_id=(msg.reply_to_message and msg.reply_to_message.message_id) or None,
+        ts_utc=utc_ts(ts.astimezone(timezone.utc)),
     )
+    reply_to_ts = msg.reply_to_message.date if msg.reply_to_message else None
+    if reply_to_ts is not None and reply_to_ts.tzinfo is None:
+        reply_to_ts = reply_to_ts.replace(tzinfo=timezone.utc)
+    add_message(chat.id, **row, tokens=count_tokens(text),
+                reply_to_ts_utc=utc_ts(reply_to_ts.astimezone(timezone.utc)) if reply_to_ts else None)
 
-    # Check if PanBot should reply to this message
-    if chat.id in config.PANBOT_CHAT_IDS and panbot.should_reply(msg):
-        try:
-            response = await panbot.process_reply(msg)
-            bot_message = await msg.reply_text(response, parse_mode=ParseMode.HTML)
-            bot_ts = bot_message.date
-            if bot_ts.tzinfo is None:
-                bot_ts = bot_ts.replace(tzinfo=timezone.utc)
-            add_message(
-                chat.id,
-                bot_message.message_id,
-                config.BOT_USER_ID,
-                None,
-                "PanBot",
-                response,
-                msg.message_id,
-                utc_ts(bot_ts.astimezone(timezone.utc)),
-            )
+    if chat.id not in config.PANBOT_CHAT_IDS:
+        return
+    panbot.save_message(chat.id, row)
+
+    # Check if PanBot should reply to this message; the LLM call runs in the background so
+    # storage of the chat's next updates is not held up behind it
+    if panbot.should_reply(msg):
+        if _use_job_queue():
+            enqueue_jobs(JOB_PANBOT_REPLY, [({"message": msg.to_dict()}, f"panbot:{chat.id}:{msg.message_id}")],
+                         _now_utc())
+        else:
+            context.application.create_task(_panbot_reply(chat, msg), update=update)
+
+
+async def _send_panbot_response(chat: Chat, msg: Message, response: str):
+    bot_message = await msg.reply_text(response, parse_mode=ParseMode.HTML)
+    bot_ts = bot_message.date
+    if bot_ts.tzinfo is None:
+        bot_ts = bot_ts.replace(tzinfo=timezone.utc)
+    bot_row = dict(
+        message_id=bot_message.message_id,
+        user_id=config.BOT_USER_ID,
+        username=None,
+        full_name="PanBot",
+        text=response,
+        reply_to_message_id=msg.message_id,
+        ts_utc=utc_ts(bot_ts.astimezone(timezone.utc)),
+    )
+    msg_ts = msg.date if msg.date.tzinfo else msg.date.replace(tzinfo=timezone.utc)
+    add_message(chat.id, **bot_row, tokens=count_tokens(response),
+                reply_to_ts_utc=utc_ts(msg_ts.astimezone(timezone.utc)))
+    panbot.save_message(chat.id, bot_row)
+
+
+async def _panbot_reply(chat: Chat, msg: Message):
+    try:
+        response = await panbot.process_reply(msg)
+        await _send_panbot_response(chat, msg, response)
+
+    except SarcasmLimitExceeded as e:
+        await msg.reply_text(str(e))
+
+    except Exception as e:
+        config.log.exception(f"Error in PanBot response: {e}")
+        await msg.reply_text(PANBOT_FAILED_TEXT)
 
-        except SarcasmLimitExceeded as e:
-            await msg.reply_text(str(e))
 
+async def run_panbot_reply_job(bot, payloads: list[dict]) -> list:
+    """Worker side of a PanBot reply: generate the response text."""
+    msg = Message.de_json(payloads[0]["message"], bot)
+    # The worker does not see the chat's messages arrive, so re-read the context from the DB
+    panbot.context_windows.invalidate(msg.chat.id)
+    try:
+        return [{"text": await panbot.process_reply(msg)}]
+    except SarcasmLimitExceeded as e:
+        return [{"text": str(e), "limit_exceeded": True}]
+
+
+async def deliver_panbot_reply(bot, payload: dict, result: dict | None, error: str | None):
+    msg = Message.de_json(payload["message"], bot)
+    if error is not None or result is None:
+        config.log.error(f"PanBot job failed for chat {msg.chat.id} msg {msg.message_id}: {error}")
+        await msg.reply_text(PANBOT_FAILED_TEXT)
+    elif result.get("limit_exceeded"):
+        await msg.reply_text(result["text"])
+    else:
+        await _send_panbot_response(msg.chat, msg, result["text"])
+
+
+async def _store_photos(chat: Chat, rows: list[dict]):
+    """Persist photo rows (a single photo or a whole album) and queue them for detection."""
+    try:
+        ensure_chat_record(chat)
+    except Exception as e:
+        config.log.exception(f"ensure_chat_record failed: {e}")
+
+    try:
+        upsert_photo_messages(rows)
+        config.log.info(
+            f"{len(rows)} photo(s) stored for deferred detection: chat {chat.id} "
+            f"msg {', '.join(str(r['message_id']) for r in rows)}"
+        )
+    except Exception as e:
+        config.log.exception(f"upsert_photo_messages failed: {e}")
+        return
+
+    if _use_job_queue():
+        try:
+            _enqueue_pet_jobs(rows)
         except Exception as e:
-            config.log.exception(f"Error in PanBot response: {e}")
-            await msg.reply_text(
-                "Щось пішло не так з моїм сарказмом... "
-                "Можливо, ваше питання було занадто складним для мого штучного інтелекту 🤖"
-            )
+            config.log.exception(f"Queueing pet detection jobs failed: {e}")
+    elif pet_pipeline is not None:
+        for job in jobs_from_rows(rows):
+            pet_pipeline.submit(job)
+
+
+async def _flush_album(key, items: list[tuple[Chat, dict]]):
+    await _store_photos(items[0][0], [row for _, row in items])
+
+
+album_buffer = AlbumBuffer(flush=_flush_album, delay=config.ALBUM_BUFFER_SECONDS)
 
 
 async def on_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Handler for any photo (image) message in chats where the bot is present.
     Now supports both photo and image document uploads!
+    Albums (media groups) are buffered and stored and detected as one unit.
     """
     if not update.message or not update.effective_chat:
         return
@@ -113,37 +536,40 @@ async def on_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat = update.effective_chat
     msg = update.message
 
-    config.log.info(f"Triggered on photo: chat {chat.id} msg {msg.message_id}")
-
-    try:
-        ensure_chat_record(chat)
-    except Exception as e:
-        config.log.exception(f"ensure_chat_record failed: {e}")
-
     ts = msg.date or datetime.now(timezone.utc)
 
     if msg.photo:
         largest = msg.photo[-1]
         file_id = largest.file_id
+        file_unique_id = largest.file_unique_id
+        thumb_file_id = msg.photo[0].file_id
+        sizes = [{"file_id": p.file_id, "width": p.width, "height": p.height} for p in msg.photo]
     elif msg.document and msg.document.mime_type and msg.document.mime_type.startswith("image/"):
         file_id = msg.document.file_id
+        file_unique_id = msg.document.file_unique_id
+        thumb_file_id = msg.document.thumbnail.file_id if msg.document.thumbnail else None
+        sizes = None
     else:
         config.log.warning(f"on_photo -- neither photo nor image document: message_id {msg.message_id}")
         return
 
-    ts_utc_int = utc_ts(ts)
-
-    try:
-        upsert_photo_message(
-            chat_id=chat.id,
-            message_id=msg.message_id,
-            ts_utc=ts_utc_int,
-            file_id=file_id,
-        )
-        config.log.info(f"Photo/document stored for deferred detection: chat {chat.id} msg {msg.message_id}")
-    except Exception as e:
-        config.log.exception("upsert_photo_message failed: %s", e)
+    row = {
+        "chat_id": chat.id,
+        "message_id": msg.message_id,
+        "ts_utc": utc_ts(ts),
+        "file_id": file_id,
+        "file_unique_id": file_unique_id,
+        "thumb_file_id": thumb_file_id,
+        "sizes": sizes,
+        "media_group_id": msg.media_group_id,
+    }
+
+    if msg.media_group_id:
+        album_buffer.add((chat.id, msg.media_group_id), (chat, row))
+        return
 
+    config.log.info(f"Triggered on photo: chat {chat.id} msg {msg.message_id}")
+    await _store_photos(chat, [row])
 
 
 async def cmd_chatid(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -216,20 +642,109 @@ async def cmd_summary_now(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
     # Perform the long-running summary generation
-    now_local = datetime.now(tz=config.KYIV)
+    tz = _chat_timezone(chat.id)
+    now_local = datetime.now(tz=tz)
     start_local = datetime.combine(
-        now_local.date(), dtime.min, tzinfo=config.KYIV
+        now_local.date(), dtime.min, tzinfo=tz
     )  # сьогодні від 00:00
-    text = await summarize_day(chat, start_local, now_local, context, toxicity_level)
+    empty_text = "<b>#Підсумки_дня — сьогодні</b>\n\nПоки що немає даних або нічого не згрупувалося."
+    if _use_job_queue():
+        # A worker writes the summary; job delivery edits the placeholder with it
+        enqueue_summary(chat, start_local, now_local, toxicity_level, empty_text,
+                        message_id=placeholder_message.message_id)
+        return
+
+    editor = ThrottledEditor(placeholder_message)
+    text = await summarize_day(
+        chat, start_local, now_local, context, toxicity_level, on_progress=editor.update
+    )
 
     # Prepare the final text
     if not text:
-        text = "<b>#Підсумки_дня — сьогодні</b>\n\nПоки що немає даних або нічого не згрупувалося."
+        text = empty_text
 
     # Edit the placeholder message with the final summary
-    await placeholder_message.edit_text(
-        text, parse_mode=ParseMode.HTML, disable_web_page_preview=True
+    await editor.finish(text)
+
+
+def enqueue_summary(chat: Chat, start_local: datetime, end_local: datetime, toxicity_level: int,
+                    empty_text: str, message_id: int | None = None, run_day: str | None = None) -> int:
+    """
+    Queue a summary for the workers; delivered by editing ``message_id``, or as a new message.
+    ``run_day`` marks a scheduled daily summary whose ``summary_runs`` row delivery completes.
+    """
+    payload = {
+        "chat": chat.to_dict(),
+        "start_ts": utc_ts(start_local.astimezone(timezone.utc)),
+        "end_ts": utc_ts(end_local.astimezone(timezone.utc)),
+        "tz": getattr(start_local.tzinfo, "key", config.TZ),
+        "toxicity_level": toxicity_level,
+        "empty_text": empty_text,
+        "message_id": message_id,
+        "run_day": run_day,
+    }
+    dedup_key = f"summary:{chat.id}:{run_day}" if run_day else None
+    return enqueue_jobs(JOB_SUMMARY, [(payload, dedup_key)], _now_utc())
+
+
+async def run_summary_job(bot, payloads: list[dict]) -> list:
+    """Worker side of a summary job."""
+    payload = payloads[0]
+    chat = Chat.de_json(payload["chat"], bot)
+    tz = ZoneInfo(payload.get("tz") or config.TZ)
+    start_local = datetime.fromtimestamp(payload["start_ts"], tz)
+    end_local = datetime.fromtimestamp(payload["end_ts"], tz)
+    text = await summarize_day(chat, start_local, end_local, None, payload["toxicity_level"])
+    return [{"text": text}]
+
+
+async def deliver_summary(bot, payload: dict, result: dict | None, error: str | None):
+    chat_id = payload["chat"]["id"]
+    run_day = payload.get("run_day")
+    if error is not None or result is None:
+        config.log.error(f"Summary job failed for chat {chat_id}: {error}")
+        if run_day:
+            # Scheduled summaries are retried by the scheduler's catch-up instead
+            finish_summary_run(chat_id, run_day, "failed", _now_utc(), error=error)
+            return
+        text = SUMMARY_FAILED_TEXT
+    else:
+        text = result.get("text") or payload["empty_text"]
+    if payload.get("message_id") is not None:
+        await bot.edit_message_text(text, chat_id=chat_id, message_id=payload["message_id"],
+                                    parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+        return
+    message = await bot.send_message(chat_id=chat_id, text=text, parse_mode=ParseMode.HTML,
+                                     disable_web_page_preview=True,
+                                     rate_limit_args={"priority": PRIORITY_BACKGROUND})
+    if run_day:
+        finish_summary_run(chat_id, run_day, "sent", _now_utc(), message_id=message.message_id)
+
+
+async def start_job_delivery(app: Application):
+    """post_init hook: deliver results of jobs run by ``src.worker`` (JOB_QUEUE_MODE=postgres)."""
+    global job_delivery
+    if not _use_job_queue():
+        return
+    job_delivery = ResultDelivery(
+        take=lambda kinds, limit: take_job_results(kinds, limit, _now_utc(), config.JOB_DELIVERY_LEASE_SECONDS),
+        deliverers={
+            JOB_SUMMARY: partial(deliver_summary, app.bot),
+            JOB_PANBOT_REPLY: partial(deliver_panbot_reply, app.bot),
+        },
+        delivered=lambda job_id: mark_job_delivered(job_id, _now_utc()),
+        retry=retry_job_delivery,
+        interval=config.JOB_POLL_INTERVAL_SECONDS,
+        max_attempts=config.JOB_DELIVERY_MAX_ATTEMPTS,
+        retry_delay=config.JOB_RETRY_DELAY_SECONDS,
+        clock=_now_utc,
     )
+    job_delivery.start()
+
+
+async def stop_job_delivery(app: Application):
+    if job_delivery is not None:
+        await job_delivery.stop()
 
 
 async def cmd_enable_summaries(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -272,6 +787,100 @@ async def cmd_disable_summaries(update: Update, context: ContextTypes.DEFAULT_TY
     )
 
 
+async def _is_chat_admin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    chat = update.effective_chat
+    if chat.type == Chat.PRIVATE:
+        return True
+    member = await context.bot.get_chat_member(chat.id, update.effective_user.id)
+    return member.status in (ChatMember.ADMINISTRATOR, ChatMember.OWNER)
+
+
+def _describe_schedule(schedule: ChatSchedule) -> str:
+    offset = spread_offset(schedule.chat_id, config.SUMMARY_SPREAD_MINUTES * 60)
+    return (f"🕰 Підсумок дня: <b>{schedule.at:%H:%M}</b> ({html.escape(schedule.tz.key)}), "
+            f"для цього чату зсув +{int(offset.total_seconds() // 60)} хв.")
+
+
+async def cmd_summary_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Command: /summary_schedule [HH:MM] [Area/City] | reset
+    Shows or (chat admins only) sets the chat's daily summary time and timezone.
+    """
+    chat = update.effective_chat
+    if not chat or not update.effective_user:
+        return
+    if chat.id not in config.ALLOWED_CHAT_IDS:
+        await update.effective_message.reply_text(
+            "❌ Цей чат не налаштовано для використання AI-підсумків.\n"
+            "Зверніться до адміністратора бота."
+        )
+        return
+
+    ensure_chat_record(chat)
+    current = get_chat_schedule(chat.id) or {"chat_id": chat.id}
+    if not context.args:
+        await update.effective_message.reply_html(_describe_schedule(ChatSchedule.from_row(current)))
+        return
+
+    if not await _is_chat_admin(update, context):
+        await update.effective_message.reply_text("❌ Змінювати розклад можуть лише адміністратори чату.")
+        return
+
+    tz_name, summary_time = current.get("tz"), current.get("summary_time")
+    try:
+        for arg in context.args:
+            if arg.lower() in ("reset", "default"):
+                tz_name, summary_time = None, None
+            elif ":" in arg and "/" not in arg:
+                summary_time = f"{parse_summary_time(arg):%H:%M}"
+            else:
+                tz_name = parse_timezone(arg).key
+    except ValueError:
+        await update.effective_message.reply_text(
+            "❌ Використовуйте: /summary_schedule 21:30 Europe/Kyiv (або reset для типових налаштувань)."
+        )
+        return
+
+    set_chat_schedule(chat.id, tz_name, summary_time)
+    schedule = ChatSchedule.from_row({"chat_id": chat.id, "tz": tz_name, "summary_time": summary_time})
+    await update.effective_message.reply_html("✅ " + _describe_schedule(schedule))
+
+
+async def cmd_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Command: /stats [days]
+    Most active users and an hourly heatmap for today (default) or the last ``days`` days,
+    read from the hourly activity aggregates.
+    """
+    chat = update.effective_chat
+    if not chat or chat.id not in config.ALLOWED_CHAT_IDS:
+        await update.effective_message.reply_text(
+            "❌ Цей чат не налаштовано для використання AI-підсумків.\n"
+            "Зверніться до адміністратора бота."
+        )
+        return
+
+    try:
+        days = int(context.args[0]) if context.args else 1
+    except ValueError:
+        days = 0
+    if not 1 <= days <= config.STATS_MAX_DAYS:
+        await update.effective_message.reply_text(f"❌ Використовуйте: /stats [1–{config.STATS_MAX_DAYS}] (кількість днів).")
+        return
+
+    tz = _chat_timezone(chat.id)
+    now = datetime.now(tz)
+    start_local, _ = local_midnight_bounds(now - timedelta(days=days - 1), tz)
+    start_utc = utc_ts(start_local)
+    rows = get_chat_activity(chat.id, start_utc - start_utc % 3600, utc_ts(now) + 1)
+    stats = compute_stats(rows, tz, config.STATS_TOP_USERS)
+    title = "📊 Статистика за сьогодні" if days == 1 else f"📊 Статистика за {days} дн. (з {start_local:%d.%m.%Y})"
+    await update.effective_message.reply_html(
+        render_stats(stats, title, weekly=days >= 7),
+        disable_web_page_preview=True,
+    )
+
+
 async def cmd_status_summaries(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat = update.effective_chat
 
@@ -297,15 +906,93 @@ async def cmd_status_summaries(update: Update, context: ContextTypes.DEFAULT_TYP
 
     await update.effective_message.reply_text(status_text)
 
+def _render_pets(chat: Chat, pets: list[dict], title: str = "Знайдені фото за сьогодні:") -> str:
+    lines: list[str] = []
+    for r in sorted(pets, key=lambda r: (r["ts_utc"], r["message_id"])):
+        desc = (r["caption"] or "").strip()
+        if not desc:
+            label = "кіт" if r["species"] == "cat" else "пес"
+            desc = f"{label} ({r['confidence']:.2f})"
+        lines.append(f"• {html.escape(desc)} — {message_link(chat, r['message_id'])}")
+    return title + "\n" + "\n".join(lines)
+
+
+def _page_title(cursor: PageCursor) -> str:
+    days = max(1, round((cursor.end_ts - cursor.start_ts) / 86400))
+    what = {"cat": "котів", "dog": "собак"}.get(cursor.species, "котів і собак")
+    return f"Фото {what} за {days} дн.:" if days > 1 else f"Фото {what} за сьогодні:"
+
+
+def _render_pet_page(chat: Chat, cursor: PageCursor) -> tuple[str, InlineKeyboardMarkup | None]:
+    """One page of the gallery (a single keyset query) with ◀️/▶️ buttons carrying the next cursors."""
+    rows = get_pet_page(chat.id, cursor.start_ts, cursor.end_ts, cursor.species,
+                        cursor.anchor, cursor.direction == "n", config.PETFINDER_PAGE_SIZE)
+    rows, has_prev, has_next = split_page(rows, cursor, config.PETFINDER_PAGE_SIZE)
+    if not rows:
+        return "Фото котів чи собак за цей період не знайдено.", None
+
+    buttons = []
+    if has_prev:
+        prev = PageCursor(cursor.start_ts, cursor.end_ts, cursor.species, "p",
+                          (rows[0]["ts_utc"], rows[0]["message_id"]))
+        buttons.append(InlineKeyboardButton("◀️", callback_data=prev.encode()))
+    if has_next:
+        nxt = PageCursor(cursor.start_ts, cursor.end_ts, cursor.species, "n",
+                         (rows[-1]["ts_utc"], rows[-1]["message_id"]))
+        buttons.append(InlineKeyboardButton("▶️", callback_data=nxt.encode()))
+    return _render_pets(chat, rows, _page_title(cursor)), InlineKeyboardMarkup([buttons]) if buttons else None
+
+
+async def on_petfinder_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Inline-keyboard callback: show another page of a /petfinder gallery."""
+    query = update.callback_query
+    if query is None or query.message is None or not update.effective_chat:
+        return
+    try:
+        cursor = PageCursor.decode(query.data or "")
+        text, markup = _render_pet_page(update.effective_chat, cursor)
+    except Exception as e:
+        config.log.exception(f"petfinder page failed: {e}")
+        await query.answer("Не вдалося завантажити сторінку.")
+        return
+    await query.answer()
+    try:
+        await query.edit_message_text(text, parse_mode=ParseMode.HTML, disable_web_page_preview=True,
+                                      reply_markup=markup)
+    except BadRequest as e:
+        config.log.warning(f"petfinder page edit failed: {e}")
+
+
 async def cmd_find_all_pets(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
-    Command: /petfinder
-    Fetch today's photos from DB, run detection on unseen ones, cache results, and return links.
-    Now sends a placeholder and uses LLM to generate short ironic captions for each detected pet.
+    Command: /petfinder [Nd] [кіт|пес] [regen]
+    Returns links to today's pet photos with their stored captions. Detection normally runs in
+    the background pipeline fed by on_photo; photos it has not reached are detected here
+    concurrently and the placeholder is updated as pets are found. "regen" explicitly
+    regenerates today's captions. With a range (e.g. "7d") the stored results of the last
+    N days are paged through inline-keyboard buttons instead.
     """
     if not update.effective_chat or not update.effective_user:
         return
     chat = update.effective_chat
+    query = parse_petfinder_args(context.args or [], config.PETFINDER_MAX_DAYS)
+
+    tz = _chat_timezone(chat.id)
+    if query.days is not None and not query.regen:
+        now_local = datetime.now(tz)
+        start_local, _ = local_midnight_bounds(now_local - timedelta(days=query.days - 1), tz)
+        _, end_local = local_midnight_bounds(now_local, tz)
+        cursor = PageCursor(utc_ts(start_local.astimezone(timezone.utc)), utc_ts(end_local.astimezone(timezone.utc)),
+                            query.species, "n", None)
+        try:
+            text, markup = _render_pet_page(chat, cursor)
+        except Exception as e:
+            config.log.exception(f"get_pet_page failed: {e}")
+            await update.message.reply_text("Сталася помилка при отриманні фотографій.")
+            return
+        await update.message.reply_text(text, parse_mode=ParseMode.HTML, disable_web_page_preview=True,
+                                        reply_markup=markup)
+        return
 
     placeholder_texts = [
         "⏳ Аналізую галерею: пес вже зголоднів від очікування, але тримається як чемпіон.",
@@ -337,8 +1024,8 @@ async def cmd_find_all_pets(update: Update, context: ContextTypes.DEFAULT_TYPE):
     ]
     placeholder_message = await update.message.reply_text(random.choice(placeholder_texts))
 
-    now_local = datetime.now(config.KYIV)
-    start_local, end_local = local_midnight_bounds(now_local)
+    now_local = datetime.now(tz)
+    start_local, end_local = local_midnight_bounds(now_local, tz)
     start_ts = utc_ts(start_local.astimezone(timezone.utc))
     end_ts = utc_ts(end_local.astimezone(timezone.utc))
 
@@ -356,74 +1043,104 @@ async def cmd_find_all_pets(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         detected = get_pet_messages_between(chat.id, start_ts, end_ts)
     except Exception as e:
-        config.log.exception(f"get_photo_messages_between failed: {e}")
-        detected = []
-
-    detected_by_id = {(r["chat_id"], r["message_id"]): r for r in detected}
-    results_lines: list[str] = []
-
-    for r in detected:
-        if r["species"] in ("cat", "dog"):
-            link = message_link(chat, r["message_id"])
-            desc = None
-            file_id = None
-            try:
-                file_id = r.get("file_id") if isinstance(r, dict) else None
-            except Exception as e:
-                config.log.exception(f"Failure: {e}")
-                pass
-
-            if file_id:
-                try:
-                    _, _, caption = await detect_and_caption_by_file_id(context, file_id, sarcasm_level=5)
-                    desc = (caption or "").strip() or None
-                except Exception as e:
-                    config.log.exception(f'detect_and_caption failed for cached {r["chat_id"]}: {r["message_id"]}: {e}')
-
-            if not desc:
-                label = "кіт" if r["species"] == "cat" else "пес"
-                desc = f"{label} ({r['confidence']:.2f})"
-
-            results_lines.append(f"• {desc} — {link}")
+        config.log.exception(f"get_pet_messages_between failed: {e}")
+        await placeholder_message.edit_text("Сталася помилка при отриманні фотографій.")
+        return
 
-    for p in photos:
-        key = (p["chat_id"], p["message_id"])
-        if key in detected_by_id:
-            continue  # already processed
+    if query.regen and (pet_pipeline is not None or _use_job_queue()):
+        rows = [r for r in detected if r["file_id"]]
+        if _use_job_queue():
+            queued = _enqueue_pet_jobs(rows, caption_only=True)
+        else:
+            queued = pet_pipeline.recover(rows, caption_only=True)
+        await placeholder_message.edit_text(f"🔄 Оновлюю підписи для {queued} фото, спробуйте /petfinder трохи пізніше.")
+        return
 
+    # Photos the background pipeline has not reached yet (e.g. dropped under backpressure)
+    # are detected here concurrently; those already queued are left to the pipeline and
+    # those it gave up on are not retried. Albums become one job each.
+    undetected = jobs_from_rows([
+        p for p in photos
+        if p["detected_at_utc"] is None and p["file_id"]
+        and p["detection_attempts"] < config.PET_DETECTION_MAX_ATTEMPTS
+    ])
+    if _use_job_queue():
+        active = get_active_job_keys([_pet_job_key(j) for j in undetected])
+        queued_keys = {(j.chat_id, j.message_id) for j in undetected if _pet_job_key(j) in active}
+    elif pet_pipeline is not None:
+        queued_keys = {(j.chat_id, j.message_id) for j in undetected if pet_pipeline.is_queued(j.chat_id, j.message_id)}
+    else:
+        queued_keys = set()
+    queued = [j for j in undetected if (j.chat_id, j.message_id) in queued_keys]
+    jobs = [j for j in undetected if (j.chat_id, j.message_id) not in queued_keys]
+
+    wanted = (query.species,) if query.species else ("cat", "dog")
+    pets = [r for r in detected if r["species"] in wanted]
+    editor = ThrottledEditor(placeholder_message)
+
+    async def on_result(job: PhotoJob, species: str, conf: float, caption: str):
+        if species in wanted and conf >= PET_CONFIDENCE_THRESHOLD:
+            pets.append({"message_id": job.message_id, "ts_utc": job.ts_utc, "species": species,
+                         "confidence": conf, "caption": caption})
+            await editor.update(_render_pets(chat, pets))
+
+    async def detect(job: PhotoJob):
+        return await _detect_pet(context.bot, job)
+
+    async def detect_batch(batch: list[PhotoJob]):
+        return await _detect_pets(context.bot, batch)
+
+    failed: list[PhotoJob] = []
+    if jobs:
+        results, failed = await detect_concurrently(
+            jobs, detect,
+            limit=config.PETFINDER_CONCURRENCY,
+            timeout=config.PET_DETECTION_TIMEOUT_SECONDS,
+            on_result=on_result,
+            detect_batch=detect_batch,
+            batch_size=PET_DETECTION_BATCH_SIZE,
+        )
+        now_utc = utc_ts(datetime.now(timezone.utc))
         try:
-            species, conf, caption = await detect_and_caption_by_file_id(context, p["file_id"], sarcasm_level=5)
+            upsert_pet_photos([
+                {"chat_id": job.chat_id, "message_id": job.message_id, "ts_utc": job.ts_utc,
+                 "species": species, "confidence": conf, "file_id": member[0] if member else job.file_id,
+                 "created_at_utc": now_utc, "caption": caption, "sarcasm_level": PETFINDER_SARCASM_LEVEL,
+                 "model": PET_VISION_MODEL}
+                for job, species, conf, caption, *member in results
+                if species in ("cat", "dog") and conf >= PET_CONFIDENCE_THRESHOLD
+            ])
+            mark_photos_detected(chat.id, [mid for job, *_ in results for mid in job.message_ids], start_ts, now_utc)
         except Exception as e:
-            config.log.exception(f"photo detection failed for {key}: {e}")
-            continue
-
-        if species in ("cat", "dog") and conf >= PET_CONFIDENCE_THRESHOLD:
-            created_at_utc = utc_ts(datetime.now(timezone.utc))
+            config.log.exception(f"Storing pet detections failed: {e}")
+        # Leave retries of failed photos to the background pipeline
+        if failed and _use_job_queue():
+            failed_ids = {mid for job in failed for mid in job.message_ids}
             try:
-                upsert_pet_photo(
-                    chat_id=p["chat_id"],
-                    message_id=p["message_id"],
-                    ts_utc=p["ts_utc"],
-                    species=species,
-                    confidence=conf,
-                    file_id=p["file_id"],
-                    created_at_utc=created_at_utc,
-                )
+                _enqueue_pet_jobs([p for p in photos if p["message_id"] in failed_ids])
             except Exception as e:
-                config.log.exception(f"upsert_pet_photo failed: {e}")
-
-            desc = (caption or "").strip()
-            if not desc:
-                label = "кіт" if species == "cat" else "пес"
-                desc = f"{label} ({conf:.2f})"
+                config.log.exception(f"Queueing pet detection jobs failed: {e}")
+        elif failed and pet_pipeline is not None:
+            for job in failed:
+                pet_pipeline.submit(job)
 
-            link = message_link(chat, p["message_id"])
-            results_lines.append(f"• {desc} — {link}")
+    pending = sum(len(j.message_ids) for j in queued + failed)
+    pending_note = f"\n\n⏳ Ще {pending} фото в обробці, спробуйте трохи пізніше." if pending else ""
 
-    if not results_lines:
-        await placeholder_message.edit_text("За сьогодні фото котів чи собак не знайдено.")
+    if not pets:
+        await editor.finish("За сьогодні фото котів чи собак не знайдено." + pending_note)
         return
 
-    text = "Знайдені фото за сьогодні:\n" + "\n".join(results_lines)
-    await placeholder_message.edit_text(text, disable_web_page_preview=True)
+    if len(pets) <= config.PETFINDER_PAGE_SIZE:
+        await editor.finish(_render_pets(chat, pets) + pending_note)
+        return
 
+    # Too many for one message: switch to the paged gallery for today
+    cursor = PageCursor(start_ts, end_ts, query.species, "n", None)
+    try:
+        text, markup = _render_pet_page(chat, cursor)
+        await placeholder_message.edit_text(text + pending_note, parse_mode=ParseMode.HTML,
+                                            disable_web_page_preview=True, reply_markup=markup)
+    except Exception as e:
+        config.log.exception(f"get_pet_page failed: {e}")
+        await editor.finish(_render_pets(chat, pets[:config.PETFINDER_PAGE_SIZE]) + pending_note)
@@ -0,0 +1,232 @@
+"""
+Durable job queue that moves the expensive work (summaries, PanBot replies, pet
+detection) out of the bot process.
+
+With ``JOB_QUEUE_MODE=postgres`` the bot only enqueues rows in the ``jobs`` table and
+delivers finished results; any number of ``python -m src.worker`` processes, on one
+machine or many, claim jobs with ``FOR UPDATE SKIP LOCKED`` so no job runs twice at
+once. Failed jobs are retried with exponential backoff, and jobs of a worker that
+died are re-queued once their lease expires.
+
+``Worker`` and ``ResultDelivery`` only see the storage callables they are given;
+``src.tools.db`` provides the Postgres implementations.
+"""
+import asyncio
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+
+import src.tools.config as config
+from src.tools import metrics
+
+JOB_SUMMARY = "summary"
+JOB_PANBOT_REPLY = "panbot_reply"
+JOB_PET_DETECTION = "pet_detection"
+
+# Runs a batch of payloads; returns a result dict (or None) or an exception per payload, in order
+RunFn = Callable[[list[dict]], Awaitable[list]]
+ClaimFn = Callable[[list[str], int], list[dict]]
+CompleteFn = Callable[[int, dict | None, bool], None]
+FailFn = Callable[[int, str, int | None, bool], None]
+# Delivers one finished job in the bot process: (payload, result, error)
+DeliverFn = Callable[[dict, dict | None, str | None], Awaitable[None]]
+TakeFn = Callable[[list[str], int], list[dict]]
+DeliveredFn = Callable[[int], None]
+RetryDeliveryFn = Callable[[int, int], None]
+
+
+def _now() -> int:
+    return int(time.time())
+
+
+@dataclass(frozen=True, slots=True)
+class JobKind:
+    run: RunFn
+    batch_size: int = 1
+    deliver: bool = True  # the bot process picks the result up and sends it
+    on_failure: Callable[[dict], None] | None = None  # called with the payload after every failed attempt
+
+
+class Worker:
+    """
+    Claims due jobs and runs them in ``concurrency`` slots. A slot claims one job and,
+    for kinds with ``batch_size > 1``, tops the batch up with more jobs of the same kind.
+    """
+
+    def __init__(self, kinds: dict[str, JobKind], claim: ClaimFn, complete: CompleteFn, fail: FailFn, *,
+                 concurrency: int, poll_interval: float, max_attempts: int, retry_delay: float,
+                 timeout: float, housekeeping: Callable[[], None] | None = None,
+                 housekeeping_interval: float = 60, clock: Callable[[], int] = _now):
+        self.kinds = kinds
+        self.claim = claim
+        self.complete = complete
+        self.fail = fail
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.timeout = timeout
+        self.housekeeping = housekeeping
+        self.housekeeping_interval = housekeeping_interval
+        self.clock = clock
+        self._stopping = asyncio.Event()
+
+    def stop(self):
+        """Stop claiming; jobs already running are finished."""
+        self._stopping.set()
+
+    async def run(self):
+        slots = [asyncio.create_task(self._slot()) for _ in range(self.concurrency)]
+        if self.housekeeping is not None:
+            slots.append(asyncio.create_task(self._housekeep()))
+        await asyncio.gather(*slots)
+
+    async def _idle(self, seconds: float):
+        try:
+            await asyncio.wait_for(self._stopping.wait(), timeout=seconds)
+        except TimeoutError:
+            pass
+
+    async def _housekeep(self):
+        while not self._stopping.is_set():
+            try:
+                self.housekeeping()
+            except Exception as e:
+                config.log.exception(f"Job housekeeping failed: {e}")
+            await self._idle(self.housekeeping_interval)
+
+    async def _slot(self):
+        while not self._stopping.is_set():
+            try:
+                jobs = self._claim_batch()
+            except Exception as e:
+                config.log.exception(f"Claiming jobs failed: {e}")
+                jobs = []
+            if not jobs:
+                await self._idle(self.poll_interval)
+                continue
+            await self.run_batch(jobs)
+
+    def _claim_batch(self) -> list[dict]:
+        jobs = self.claim(list(self.kinds), 1)
+        if not jobs:
+            return []
+        kind = self.kinds[jobs[0]["kind"]]
+        if kind.batch_size > 1:
+            jobs += self.claim([jobs[0]["kind"]], kind.batch_size - 1)
+        now = self.clock()
+        for job in jobs:
+            metrics.observe("job_wait_seconds", max(0, now - job["created_at_utc"]))
+        return jobs
+
+    async def run_batch(self, jobs: list[dict]):
+        """Run claimed jobs of one kind and record each outcome."""
+        name = jobs[0]["kind"]
+        kind = self.kinds[name]
+        started = time.perf_counter()
+        try:
+            outcomes = await asyncio.wait_for(kind.run([job["payload"] for job in jobs]), timeout=self.timeout)
+        except Exception as e:
+            outcomes = [e] * len(jobs)
+        metrics.observe(f"job_{name}_seconds", time.perf_counter() - started)
+
+        for job, outcome in zip(jobs, outcomes):
+            try:
+                if isinstance(outcome, BaseException):
+                    self._failed(job, kind, outcome)
+                else:
+                    self.complete(job["id"], outcome, kind.deliver)
+                    metrics.incr("jobs_completed")
+            except Exception as e:
+                config.log.exception(f"Recording the outcome of job {job['id']} failed: {e}")
+
+    def _failed(self, job: dict, kind: JobKind, error: BaseException):
+        message = f"{type(error).__name__}: {error}"
+        if kind.on_failure is not None:
+            try:
+                kind.on_failure(job["payload"])
+            except Exception as e:
+                config.log.exception(f"Recording the failure of job {job['id']} failed: {e}")
+        if job["attempts"] >= self.max_attempts:
+            config.log.error(f"Job {job['id']} ({job['kind']}) failed after {job['attempts']} attempts: {message}")
+            metrics.incr("jobs_failed")
+            self.fail(job["id"], message, None, kind.deliver)
+            return
+        retry_at = self.clock() + int(self.retry_delay * 2 ** (job["attempts"] - 1))
+        config.log.warning(f"Job {job['id']} ({job['kind']}) attempt {job['attempts']} failed, retrying: {message}")
+        metrics.incr("jobs_retried")
+        self.fail(job["id"], message, retry_at, kind.deliver)
+
+
+class ResultDelivery:
+    """
+    Bot-side loop that hands finished jobs to the deliverer of their kind. A result counts as
+    delivered only once its deliverer returns; failed deliveries are retried with backoff and
+    given up after ``max_attempts``.
+    """
+
+    def __init__(self, take: TakeFn, deliverers: dict[str, DeliverFn], delivered: DeliveredFn,
+                 retry: RetryDeliveryFn, *, interval: float, max_attempts: int, retry_delay: float,
+                 batch_size: int = 20, clock: Callable[[], int] = _now):
+        self.take = take
+        self.deliverers = deliverers
+        self.delivered = delivered
+        self.retry = retry
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.batch_size = batch_size
+        self.clock = clock
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def deliver_once(self) -> int:
+        rows = self.take(list(self.deliverers), self.batch_size)
+        for row in rows:
+            try:
+                await self.deliverers[row["kind"]](row["payload"], row["result"], row["error"])
+            except Exception as e:
+                self._failed(row, e)
+                continue
+            try:
+                self.delivered(row["id"])
+                metrics.incr("jobs_delivered")
+            except Exception as e:
+                config.log.exception(f"Recording the delivery of job {row['id']} failed: {e}")
+        return len(rows)
+
+    def _failed(self, row: dict, error: Exception):
+        attempts = row["delivery_attempts"]
+        try:
+            if attempts >= self.max_attempts:
+                config.log.error(f"Delivering job {row['id']} ({row['kind']}) failed after {attempts} attempts, "
+                                 f"giving up: {error}")
+                metrics.incr("jobs_delivery_failed")
+                self.delivered(row["id"])
+                return
+            retry_at = self.clock() + int(self.retry_delay * 2 ** (attempts - 1))
+            config.log.warning(f"Delivering job {row['id']} ({row['kind']}) failed (attempt {attempts}), "
+                               f"retrying: {error}")
+            metrics.incr("jobs_delivery_retried")
+            self.retry(row["id"], retry_at)
+        except Exception as e:
+            config.log.exception(f"Recording the delivery failure of job {row['id']} failed: {e}")
+
+    async def _run(self):
+        while True:
+            try:
+                delivered = await self.deliver_once()
+            except Exception as e:
+                config.log.exception(f"Taking job results failed: {e}")
+                delivered = 0
+            if delivered < self.batch_size:
+                await asyncio.sleep(self.interval)
@@ -0,0 +1,102 @@
+"""
+Minimal in-process metrics registry: counters, gauges and latency summaries.
+
+Everything lives in module-level dicts, so any module can record a metric
+without wiring, and ``snapshot()`` / ``render_text()`` expose the current values.
+"""
+import math
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+_SAMPLE_WINDOW = 512
+
+_lock = threading.Lock()
+_counters: dict[str, float] = defaultdict(float)
+_gauges: dict[str, float] = {}
+_samples: dict[str, deque] = defaultdict(lambda: deque(maxlen=_SAMPLE_WINDOW))
+_totals: dict[str, tuple[int, float]] = defaultdict(lambda: (0, 0.0))
+
+
+def incr(name: str, value: float = 1.0) -> None:
+    with _lock:
+        _counters[name] += value
+
+
+def set_gauge(name: str, value: float) -> None:
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name: str, value: float) -> None:
+    """Record one observation (e.g. a latency in seconds) for a summary metric."""
+    with _lock:
+        _samples[name].append(value)
+        count, total = _totals[name]
+        _totals[name] = (count + 1, total + value)
+
+
+@contextmanager
+def timed(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started)
+
+
+def _quantile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))
+    return ordered[idx]
+
+
+def snapshot() -> dict:
+    with _lock:
+        summaries = {}
+        for name, values in _samples.items():
+            if not values:
+                continue
+            count, total = _totals[name]
+            vals = list(values)
+            summaries[name] = {
+                "count": count,
+                "sum": total,
+                "p50": _quantile(vals, 0.5),
+                "p95": _quantile(vals, 0.95),
+                "max": max(vals),
+            }
+        return {
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "summaries": summaries,
+        }
+
+
+def render_text() -> str:
+    """Render the snapshot in Prometheus text exposition format."""
+    snap = snapshot()
+    lines = []
+    for name, value in sorted(snap["counters"].items()):
+        lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name} {value}")
+    for name, value in sorted(snap["gauges"].items()):
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+    for name, s in sorted(snap["summaries"].items()):
+        lines.append(f"# TYPE {name} summary")
+        lines.append(f'{name}{{quantile="0.5"}} {s["p50"]}')
+        lines.append(f'{name}{{quantile="0.95"}} {s["p95"]}')
+        lines.append(f"{name}_sum {s['sum']}")
+        lines.append(f"{name}_count {s['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def reset() -> None:
+    """Clear all metrics (for tests)."""
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _samples.clear()
+        _totals.clear()
@@ -0,0 +1,77 @@
+"""
+Maintenance of the monthly partitions of ``messages`` and ``photo_messages``.
+
+Partitions are created ``PARTITION_MONTHS_AHEAD`` months in advance. With
+``MESSAGE_RETENTION_MONTHS`` set, months older than the retention are detached, written
+to ``ARCHIVE_DIR/<partition>.csv.gz`` and only then dropped, so an archive that failed
+to write is retried on the next run from the detached table.
+"""
+import asyncio
+import gzip
+import os
+from datetime import datetime, timedelta, timezone
+
+from telegram.ext import Application, ContextTypes
+
+import src.tools.config as config
+from src.tools.db import (
+    advisory_lock,
+    copy_partition_to,
+    detach_partition,
+    drop_partition,
+    ensure_partitions,
+    get_expired_partitions,
+)
+from src.tools.utils import month_start, utc_ts
+
+PARTITION_LOCK_KEY = 0x50415254  # "PART"
+
+
+def archive_partition(table: str, partition: str, attached: bool) -> str:
+    """Detach (if needed), archive and drop one partition; returns the archive path."""
+    if attached:
+        detach_partition(table, partition)
+    os.makedirs(config.ARCHIVE_DIR, exist_ok=True)
+    path = os.path.join(config.ARCHIVE_DIR, f"{partition}.csv.gz")
+    tmp_path = f"{path}.tmp"
+    with gzip.open(tmp_path, "wb") as out:
+        size = copy_partition_to(partition, out)
+    os.replace(tmp_path, path)
+    drop_partition(partition)
+    config.log.info(f"Archived {partition} ({size} bytes of CSV) to {path}")
+    return path
+
+
+def maintain_partitions(now: datetime) -> list[str]:
+    """Create upcoming partitions and archive expired ones; returns the archive paths written."""
+    with advisory_lock(PARTITION_LOCK_KEY) as leader:
+        if not leader:
+            config.log.debug("Another instance is maintaining the partitions")
+            return []
+        created = ensure_partitions(utc_ts(now), config.PARTITION_MONTHS_AHEAD)
+        if created:
+            config.log.info(f"Created partitions: {', '.join(created)}")
+        if config.MESSAGE_RETENTION_MONTHS <= 0:
+            return []
+        cutoff = month_start(now.astimezone(timezone.utc).date(), -config.MESSAGE_RETENTION_MONTHS)
+        archived = []
+        for p in get_expired_partitions(cutoff):
+            try:
+                archived.append(archive_partition(p["table"], p["partition"], p["attached"]))
+            except Exception as e:
+                config.log.exception(f"Archiving {p['partition']} failed: {e}")
+        return archived
+
+
+async def partition_maintenance_job(context: ContextTypes.DEFAULT_TYPE):
+    await asyncio.to_thread(maintain_partitions, datetime.now(timezone.utc))
+
+
+def schedule_partition_maintenance(app: Application):
+    app.job_queue.run_repeating(
+        partition_maintenance_job,
+        interval=timedelta(hours=config.PARTITION_MAINTENANCE_HOURS),
+        first=timedelta(minutes=1),
+        name="partition_maintenance",
+        job_kwargs={"max_instances": 1, "coalesce": True},
+    )
@@ -1,59 +1,138 @@
-from datetime import datetime, time as dtime
+"""
+Daily summaries.
+
+Every chat has its own summary time and timezone (``chats.summary_time`` / ``chats.tz``),
+shifted by a stable per-chat offset so the nightly load is spread over
+``SUMMARY_SPREAD_MINUTES``. A tick every ``SUMMARY_TICK_SECONDS`` runs whatever is due.
+Every run is recorded per (chat, day) in ``summary_runs``, so a summary is delivered
+once even with several bot instances, and days missed while the machine was stopped
+are caught up. A Postgres advisory lock lets only one instance run the summaries at a time.
+"""
+from datetime import date, datetime, timedelta, timezone, time as dtime
 from telegram.constants import ParseMode
 from telegram.ext import ContextTypes, Application
 
 import src.tools.config as config
-from src.tools.db import get_enabled_chat_ids
+from src.tools.db import (
+    get_enabled_chat_schedules,
+    advisory_lock,
+    claim_summary_run,
+    finish_summary_run,
+    get_chats_with_summary_runs,
+    get_sent_summary_runs,
+)
+from src.tools.handlers import enqueue_summary
+from src.tools.schedules import ChatSchedule
+from src.tools.sendqueue import PRIORITY_BACKGROUND
 from src.summarizer.summarizer import summarize_day
-from src.tools.utils import local_midnight_bounds
+from src.tools.utils import local_midnight_bounds, utc_ts
+
+SCHEDULER_LOCK_KEY = 0x53554D4D  # "SUMM"
+# Chats without any recorded run only get summaries that became due this recently
+FRESH_WINDOW = timedelta(hours=1)
+
+
+def _now_utc() -> int:
+    return utc_ts(datetime.now(timezone.utc))
+
+
+def summary_day_bounds(schedule: ChatSchedule, day: date) -> tuple[datetime, datetime]:
+    return local_midnight_bounds(datetime.combine(day, dtime(12), tzinfo=schedule.tz), schedule.tz)
 
 
 async def send_daily_summary_to_chat(app: Application,
                                      chat_id: int,
                                      start_local: datetime,
-                                     end_local: datetime):
-    try:
-        chat = await app.bot.get_chat(chat_id)
-    except Exception as e:
-        config.log.exception("Cannot get chat %s: %s", chat_id, e)
-        return
+                                     end_local: datetime) -> int | None:
+    """Summarize and send; returns the sent message id, or None when the summary was handed to a worker."""
+    chat = await app.bot.get_chat(chat_id)
+    empty_text = f"<b>#Підсумки_дня — {start_local.date():%d.%m.%Y}</b>\n\nНемає повідомлень або не вдалося сформувати підсумок."
+    if config.JOB_QUEUE_MODE == "postgres":
+        enqueue_summary(chat, start_local, end_local, 9, empty_text, run_day=start_local.date().isoformat())
+        return None
     text = await summarize_day(chat, start_local, end_local, None, toxicity_level=9)
     if not text:
-        text = f"<b>#Підсумки_дня — {start_local.date():%d.%m.%Y}</b>\n\nНемає повідомлень або не вдалося сформувати підсумок."
-    await app.bot.send_message(
+        text = empty_text
+    message = await app.bot.send_message(
         chat_id=chat.id,
         text=text,
         parse_mode=ParseMode.HTML,
         disable_web_page_preview=True,
+        rate_limit_args={"priority": PRIORITY_BACKGROUND},
     )
+    return message.message_id
+
 
+async def run_summary_for_day(app: Application, schedule: ChatSchedule, day: date) -> bool:
+    """Deliver one (chat, day) summary unless it was already sent; returns whether this call ran it."""
+    chat_id = schedule.chat_id
+    now = _now_utc()
+    if not claim_summary_run(chat_id, day.isoformat(), now, now - config.SUMMARY_RUN_LEASE_SECONDS,
+                             config.SUMMARY_RETRY_DELAY_SECONDS, config.SUMMARY_MAX_ATTEMPTS):
+        return False
+    start_local, end_local = summary_day_bounds(schedule, day)
+    try:
+        message_id = await send_daily_summary_to_chat(app, chat_id, start_local, end_local)
+    except Exception as e:
+        config.log.exception(f"Daily summary for chat {chat_id} on {day} failed: {e}")
+        finish_summary_run(chat_id, day.isoformat(), "failed", _now_utc(), error=f"{type(e).__name__}: {e}")
+        return True
+    status = "queued" if message_id is None else "sent"
+    finish_summary_run(chat_id, day.isoformat(), status, _now_utc(), message_id=message_id)
+    return True
 
-async def send_all_summaries_job(context: ContextTypes.DEFAULT_TYPE):
-    app = context.application
-    chat_ids = get_enabled_chat_ids()
 
-    # Filter chat_ids to only include those that are configured for AI providers
-    configured_chat_ids = [cid for cid in chat_ids if cid in config.ALLOWED_CHAT_IDS]
+def pending_summaries(schedules: list[ChatSchedule], now: datetime, catchup_days: int,
+                      spread_seconds: int) -> list[tuple[ChatSchedule, date]]:
+    """Due (chat, day) summaries in the order they became due."""
+    due = [(s, day) for s in schedules for day in s.due_days(now, catchup_days, spread_seconds)]
+    return sorted(due, key=lambda item: item[0].due_at(item[1], spread_seconds))
 
-    if not configured_chat_ids:
-        config.log.info("No enabled and configured chats to summarize.")
-        return
 
-    now_local = datetime.now(tz=config.KYIV)
-    start_local, end_local = local_midnight_bounds(now_local)
-    for cid in configured_chat_ids:
-        await send_daily_summary_to_chat(app, cid, start_local, end_local)
+async def run_due_summaries(app: Application, now: datetime) -> int:
+    """Run every due summary not delivered yet; a no-op on instances that are not the leader."""
+    schedules = [ChatSchedule.from_row(r) for r in get_enabled_chat_schedules()
+                 if r["chat_id"] in config.ALLOWED_CHAT_IDS]
+    spread = config.SUMMARY_SPREAD_MINUTES * 60
+    due = pending_summaries(schedules, now, config.SUMMARY_CATCHUP_DAYS, spread)
+    if not due:
+        return 0
+    sent = get_sent_summary_runs(min(day for _, day in due).isoformat())
+    due = [(s, day) for s, day in due if (s.chat_id, day.isoformat()) not in sent]
+    if not due:
+        return 0
 
-    config.log.info(f"Daily summaries sent to {len(configured_chat_ids)} chats")
+    with advisory_lock(SCHEDULER_LOCK_KEY) as leader:
+        if not leader:
+            config.log.debug("Another instance is running the daily summaries")
+            return 0
+        # Only chats the scheduler already served are caught up, so enabling a chat or
+        # deploying this for the first time does not post a backlog of old summaries
+        known = get_chats_with_summary_runs()
+        ran = 0
+        for schedule, day in due:
+            if schedule.chat_id not in known and now - schedule.due_at(day, spread) > FRESH_WINDOW:
+                continue
+            ran += await run_summary_for_day(app, schedule, day)
+    if ran:
+        config.log.info(f"Daily summaries sent: {ran}")
+    return ran
+
+
+async def summaries_tick_job(context: ContextTypes.DEFAULT_TYPE):
+    await run_due_summaries(context.application, datetime.now(timezone.utc))
 
 
 def schedule_daily(app: Application):
-    hour = 23
-    minute = 59
-    app.job_queue.run_daily(
-        send_all_summaries_job,
-        time=dtime(hour, minute,
-                   tzinfo=config.KYIV),
-        name="daily_summary_all",
+    # The first tick shortly after startup doubles as the catch-up of missed days
+    app.job_queue.run_repeating(
+        summaries_tick_job,
+        interval=timedelta(seconds=config.SUMMARY_TICK_SECONDS),
+        first=timedelta(seconds=30),
+        name="daily_summaries",
+        job_kwargs={"max_instances": 1, "coalesce": True},
+    )
+    config.log.info(
+        f"Daily summaries scheduled at {config.SUMMARY_TIME} {config.TZ} by default, "
+        f"spread over {config.SUMMARY_SPREAD_MINUTES} min"
     )
-    config.log.info(f"Daily job scheduled for {hour}:{minute}, {config.TZ}")
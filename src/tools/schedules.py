@@ -0,0 +1,69 @@
+"""
+Per-chat daily summary schedules.
+
+A chat's summary of local day D is due at ``summary_time`` on D in the chat's timezone
+plus a stable per-chat offset within the spread window, so chats sharing the default
+23:59 do not all hit the LLM and Telegram in the same minute.
+"""
+import re
+import zlib
+from dataclasses import dataclass
+from datetime import date, datetime, time as dtime, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+import src.tools.config as config
+
+_TIME_RE = re.compile(r"^([01]?\d|2[0-3]):([0-5]\d)$")
+
+
+def parse_summary_time(value: str) -> dtime:
+    m = _TIME_RE.match(value.strip())
+    if m is None:
+        raise ValueError(f"Invalid time {value!r}, expected HH:MM")
+    return dtime(int(m.group(1)), int(m.group(2)))
+
+
+def parse_timezone(value: str) -> ZoneInfo:
+    try:
+        return ZoneInfo(value.strip())
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown timezone {value!r}, expected e.g. Europe/Kyiv") from None
+
+
+def spread_offset(chat_id: int, spread_seconds: int) -> timedelta:
+    """Stable offset of a chat within the spread window (the same in every process)."""
+    if spread_seconds <= 0:
+        return timedelta(0)
+    return timedelta(seconds=zlib.crc32(str(chat_id).encode()) % spread_seconds)
+
+
+@dataclass(frozen=True, slots=True)
+class ChatSchedule:
+    chat_id: int
+    tz: ZoneInfo
+    at: dtime
+
+    @classmethod
+    def from_row(cls, row: dict) -> "ChatSchedule":
+        """Build from a ``chats`` row; missing or invalid values fall back to the configured defaults."""
+        try:
+            tz = parse_timezone(row["tz"]) if row.get("tz") else config.KYIV
+        except ValueError:
+            config.log.warning(f"Chat {row['chat_id']} has an invalid timezone {row['tz']!r}, using {config.TZ}")
+            tz = config.KYIV
+        try:
+            at = parse_summary_time(row.get("summary_time") or config.SUMMARY_TIME)
+        except ValueError:
+            config.log.warning(f"Chat {row['chat_id']} has an invalid summary time, using {config.SUMMARY_TIME}")
+            at = parse_summary_time(config.SUMMARY_TIME)
+        return cls(row["chat_id"], tz, at)
+
+    def due_at(self, day: date, spread_seconds: int) -> datetime:
+        return datetime.combine(day, self.at, tzinfo=self.tz) + spread_offset(self.chat_id, spread_seconds)
+
+    def due_days(self, now: datetime, catchup_days: int, spread_seconds: int) -> list[date]:
+        """Local days whose summary is due by ``now``, oldest first, at most ``catchup_days`` back from the latest."""
+        today = now.astimezone(self.tz).date()
+        candidates = [today - timedelta(days=n) for n in range(catchup_days + 1, -1, -1)]
+        due = [d for d in candidates if self.due_at(d, spread_seconds) <= now]
+        return due[-(catchup_days + 1):]
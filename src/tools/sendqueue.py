@@ -0,0 +1,231 @@
+"""
+Rate-limit-aware outbound queue for every Bot API send.
+
+Plugged into the Application as its PTB rate limiter, so ``reply_text``,
+``edit_text`` and the scheduler's ``send_message`` all pass through it:
+
+* token buckets for the global limit and per chat (1 msg/s in private chats,
+  N msg/min in groups);
+* interactive requests go first, nightly summaries pass
+  ``rate_limit_args={"priority": PRIORITY_BACKGROUND}``;
+* an edit of a message whose previous edit is still queued replaces it (both
+  callers get the result of the newest edit);
+* ``RetryAfter`` pauses dispatching for the advertised time and re-queues the request.
+
+Exports ``send_queue_depth``, ``send_queue_wait_seconds``, ``send_retry_after``
+and ``send_edits_coalesced`` metrics.
+"""
+import asyncio
+import itertools
+import time
+from collections.abc import Callable, Coroutine
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Any
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+import src.tools.config as config
+from src.tools import metrics
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+_RATE_LIMITED_EXTRA = {"copyMessage", "copyMessages", "forwardMessage", "forwardMessages"}
+
+
+def is_rate_limited(endpoint: str) -> bool:
+    return endpoint.startswith(("send", "edit")) or endpoint in _RATE_LIMITED_EXTRA
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def ready_at(self, now: float) -> float:
+        self._refill(now)
+        return now if self.tokens >= 1 else now + (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+@dataclass(eq=False)
+class _Pending:
+    priority: int
+    seq: int
+    chat_id: Any
+    edit_key: tuple | None
+    enqueued_at: float
+    result: asyncio.Future  # shared by the request and any edits coalesced into it
+    granted: asyncio.Future = field(default_factory=lambda: asyncio.get_running_loop().create_future())
+
+
+class OutboundRateLimiter(BaseRateLimiter[dict]):
+    def __init__(self, global_per_second: float, chat_per_second: float, group_per_minute: float,
+                 max_retries: int = 3, clock: Callable[[], float] = time.monotonic):
+        self.global_per_second = global_per_second
+        self.chat_per_second = chat_per_second
+        self.group_per_minute = group_per_minute
+        self.max_retries = max_retries
+        self.clock = clock
+        self._queue: list[_Pending] = []
+        self._edits: dict[tuple, _Pending] = {}
+        self._seq = itertools.count()
+        self._global: TokenBucket | None = None
+        self._chats: dict[Any, TokenBucket] = {}
+        self._paused_until = 0.0
+        self._wakeup: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+
+    async def initialize(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._global = TokenBucket(self.global_per_second, self.global_per_second, self.clock())
+        self._task = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def _chat_bucket(self, chat_id: Any, now: float) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 1000:
+                self._chats = {k: b for k, b in self._chats.items() if not b.is_full(now)}
+            if isinstance(chat_id, int) and chat_id < 0:
+                bucket = TokenBucket(self.group_per_minute / 60, 3, now)
+            else:
+                bucket = TokenBucket(self.chat_per_second, 3, now)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _enqueue(self, priority: int, chat_id: Any, edit_key: tuple | None, result: asyncio.Future) -> _Pending:
+        pending = _Pending(priority, next(self._seq), chat_id, edit_key, self.clock(), result=result)
+        if edit_key is not None:
+            previous = self._edits.get(edit_key)
+            if previous is not None and not previous.granted.done():
+                # Newer text wins; it inherits the older edit's place in the queue
+                self._queue.remove(previous)
+                pending.priority = min(pending.priority, previous.priority)
+                pending.seq = previous.seq
+                previous.granted.set_result(pending)
+            self._edits[edit_key] = pending
+        self._queue.append(pending)
+        metrics.set_gauge("send_queue_depth", len(self._queue))
+        self._wakeup.set()
+        return pending
+
+    def _next_ready(self, now: float) -> tuple[_Pending | None, float | None]:
+        """The best request that may be sent now, else how long to wait."""
+        if not self._queue:
+            return None, None
+        if now < self._paused_until:
+            return None, self._paused_until - now
+        global_ready = self._global.ready_at(now)
+        if global_ready > now:
+            return None, global_ready - now
+        earliest = None
+        for pending in sorted(self._queue, key=lambda p: (p.priority, p.seq)):
+            ready = self._chat_bucket(pending.chat_id, now).ready_at(now) if pending.chat_id is not None else now
+            if ready <= now:
+                return pending, None
+            earliest = ready if earliest is None else min(earliest, ready)
+        return None, earliest - now
+
+    async def _dispatch(self):
+        while True:
+            now = self.clock()
+            pending, wait = self._next_ready(now)
+            if pending is not None:
+                self._queue.remove(pending)
+                self._global.take(now)
+                if pending.chat_id is not None:
+                    self._chat_bucket(pending.chat_id, now).take(now)
+                if pending.edit_key is not None and self._edits.get(pending.edit_key) is pending:
+                    del self._edits[pending.edit_key]
+                metrics.set_gauge("send_queue_depth", len(self._queue))
+                metrics.observe("send_queue_wait_seconds", now - pending.enqueued_at)
+                pending.granted.set_result(None)
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except TimeoutError:
+                pass
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, bool | dict[str, Any] | list[dict[str, Any]]]],
+        args: Any,
+        kwargs: dict[str, Any],
+        endpoint: str,
+        data: dict[str, Any],
+        rate_limit_args: dict | None,
+    ) -> bool | dict[str, Any] | list[dict[str, Any]]:
+        limited = is_rate_limited(endpoint) and self._task is not None
+        priority = (rate_limit_args or {}).get("priority", PRIORITY_INTERACTIVE)
+        chat_id = data.get("chat_id")
+        edit_key = None
+        if endpoint.startswith("edit") and chat_id is not None and data.get("message_id") is not None:
+            edit_key = (endpoint, chat_id, data["message_id"])
+
+        # Shared across RetryAfter re-queues, so callers coalesced into this request keep waiting on it
+        result_future = asyncio.get_running_loop().create_future()
+        attempt = 0
+        while True:
+            pending = None
+            if limited:
+                pending = self._enqueue(priority, chat_id, edit_key, result_future)
+                superseded_by = await pending.granted
+                if superseded_by is not None:
+                    metrics.incr("send_edits_coalesced")
+                    try:
+                        result = await asyncio.shield(superseded_by.result)
+                    except Exception as e:
+                        self._fail(result_future, e)
+                        raise
+                    # Relay to whoever was coalesced into this request before it was superseded
+                    result_future.set_result(result)
+                    return result
+            try:
+                result = await callback(*args, **kwargs)
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                metrics.incr("send_retry_after")
+                self._paused_until = max(self._paused_until, self.clock() + float(retry_after))
+                attempt += 1
+                if attempt > self.max_retries:
+                    self._fail(result_future, e)
+                    raise
+                config.log.warning(f"Telegram flood control on {endpoint}, retrying in {retry_after}s")
+                if not limited:
+                    await asyncio.sleep(float(retry_after))
+                continue
+            except Exception as e:
+                self._fail(result_future, e)
+                raise
+            result_future.set_result(result)
+            return result
+
+    @staticmethod
+    def _fail(result: asyncio.Future, error: BaseException):
+        if not result.done():
+            result.set_exception(error)
+            result.exception()  # mark retrieved: nobody may be waiting on it
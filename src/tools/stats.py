@@ -0,0 +1,151 @@
+"""
+Chat activity statistics for /stats.
+
+Everything is computed from the hourly ``chat_activity`` aggregates maintained at ingest,
+so the work depends on the length of the period and the number of active users, never on
+the size of the message history. Hours are bucketed in UTC and shifted to the chat's
+timezone (exact for whole-hour offsets). NumPy is used when installed, like in the pet
+prefilter; otherwise the same aggregation runs in plain Python.
+"""
+import html
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - depends on the deployment
+    np = None
+
+import src.tools.config as config
+from src.tools.utils import user_link
+
+METRICS = ("messages", "chars", "tokens", "replies")
+WEEKDAYS = ("Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Нд")
+_BLOCKS = " ▁▂▃▄▅▆▇█"
+
+
+@dataclass(slots=True)
+class UserActivity:
+    user_id: int
+    username: str | None
+    full_name: str | None
+    messages: int
+    chars: int
+    tokens: int
+    replies: int
+
+
+@dataclass(slots=True)
+class ActivityStats:
+    totals: dict[str, int]
+    top: list[UserActivity]
+    hourly: list[int]          # messages per local hour, 0..23
+    weekly: list[list[int]]    # messages per local weekday (Monday first) and hour
+
+    @property
+    def busiest_hour(self) -> int | None:
+        return max(range(24), key=self.hourly.__getitem__) if any(self.hourly) else None
+
+
+def _local_slots(hours_utc, tz: ZoneInfo) -> dict[int, int]:
+    """weekday * 24 + hour in ``tz`` of every distinct UTC hour."""
+    slots = {}
+    for hour in set(hours_utc):
+        local = datetime.fromtimestamp(hour, timezone.utc).astimezone(tz)
+        slots[hour] = local.weekday() * 24 + local.hour
+    return slots
+
+
+def _latest_names(rows: list[dict]) -> dict[int, tuple[str | None, str | None]]:
+    names = {}
+    for r in sorted(rows, key=lambda r: r["hour_utc"]):
+        names[r["user_id"]] = (r["username"], r["full_name"])
+    return names
+
+
+def _compute_numpy(rows: list[dict], slots: dict[int, int], top_n: int):
+    user_ids, inverse = np.unique(np.fromiter((r["user_id"] for r in rows), dtype=np.int64, count=len(rows)),
+                                  return_inverse=True)
+    sums = {m: np.bincount(inverse, weights=np.fromiter((r[m] for r in rows), dtype=np.float64, count=len(rows)),
+                           minlength=len(user_ids)).astype(np.int64)
+            for m in METRICS}
+    # Most messages first, ties broken by characters written
+    order = np.lexsort((-sums["chars"], -sums["messages"]))[:top_n]
+    top = [(int(user_ids[i]), {m: int(sums[m][i]) for m in METRICS}) for i in order]
+    slot_index = np.fromiter((slots[r["hour_utc"]] for r in rows), dtype=np.int64, count=len(rows))
+    weekly = np.bincount(slot_index, weights=np.fromiter((r["messages"] for r in rows), dtype=np.float64,
+                                                          count=len(rows)), minlength=7 * 24)
+    weekly = weekly.astype(np.int64).reshape(7, 24)
+    totals = {m: int(sums[m].sum()) for m in METRICS}
+    return totals, top, weekly.sum(axis=0).tolist(), weekly.tolist()
+
+
+def _compute_python(rows: list[dict], slots: dict[int, int], top_n: int):
+    per_user = defaultdict(lambda: dict.fromkeys(METRICS, 0))
+    weekly = [[0] * 24 for _ in range(7)]
+    for r in rows:
+        sums = per_user[r["user_id"]]
+        for m in METRICS:
+            sums[m] += r[m]
+        day, hour = divmod(slots[r["hour_utc"]], 24)
+        weekly[day][hour] += r["messages"]
+    ranked = sorted(per_user.items(), key=lambda item: (-item[1]["messages"], -item[1]["chars"], item[0]))
+    totals = {m: sum(s[m] for s in per_user.values()) for m in METRICS}
+    hourly = [sum(day[h] for day in weekly) for h in range(24)]
+    return totals, ranked[:top_n], hourly, weekly
+
+
+def compute_stats(rows: list[dict], tz: ZoneInfo, top_n: int) -> ActivityStats:
+    """
+    Totals, the ``top_n`` most active users and local-time heatmaps of ``chat_activity`` rows.
+    PanBot's own replies are not chat activity and are left out.
+    """
+    rows = [r for r in rows if r["user_id"] != config.BOT_USER_ID]
+    if not rows:
+        return ActivityStats(dict.fromkeys(METRICS, 0), [], [0] * 24, [[0] * 24 for _ in range(7)])
+    slots = _local_slots((r["hour_utc"] for r in rows), tz)
+    compute = _compute_numpy if np is not None else _compute_python
+    totals, top, hourly, weekly = compute(rows, slots, top_n)
+    names = _latest_names(rows)
+    users = [UserActivity(user_id, *names[user_id], **sums) for user_id, sums in top]
+    return ActivityStats(totals, users, hourly, weekly)
+
+
+def heatmap_line(values: list[int], peak: int | None = None) -> str:
+    """One block character per value, scaled to ``peak`` (the largest value by default)."""
+    peak = max(values, default=0) if peak is None else peak
+    if peak <= 0:
+        return _BLOCKS[0] * len(values)
+    return "".join(_BLOCKS[0 if v <= 0 else max(1, round(v / peak * (len(_BLOCKS) - 1)))] for v in values)
+
+
+def _user_label(u: UserActivity) -> str:
+    if u.user_id <= 0:
+        return html.escape(u.full_name or "Анонім")
+    return user_link(u.user_id, u.username, u.full_name)
+
+
+def render_stats(stats: ActivityStats, title: str, weekly: bool = False) -> str:
+    t = stats.totals
+    if not t["messages"]:
+        return f"<b>{html.escape(title)}</b>\n\nПовідомлень немає."
+    lines = [
+        f"<b>{html.escape(title)}</b>",
+        "",
+        f"Повідомлень: {t['messages']}, відповідей: {t['replies']}, "
+        f"символів: {t['chars']}, токенів: ~{t['tokens']}",
+        "",
+        "<b>Найбалакучіші:</b>",
+    ]
+    for i, u in enumerate(stats.top, start=1):
+        lines.append(f"{i}. {_user_label(u)} — {u.messages} повід., {u.chars} симв.")
+    lines += ["", "<b>Активність по годинах</b> (00–23):", f"<pre>{heatmap_line(stats.hourly)}</pre>"]
+    if weekly:
+        peak = max((max(day) for day in stats.weekly), default=0)
+        grid = "\n".join(f"{name} {heatmap_line(day, peak)}" for name, day in zip(WEEKDAYS, stats.weekly))
+        lines.append(f"<pre>{grid}</pre>")
+    if stats.busiest_hour is not None:
+        lines.append(f"Найактивніша година: {stats.busiest_hour:02d}:00")
+    return "\n".join(lines)
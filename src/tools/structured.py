@@ -0,0 +1,360 @@
+"""
+Typed structs for every JSON answer we ask the LLMs for, plus a single validated
+decoder with targeted repair.
+
+The same struct definitions produce the provider-native schemas
+(OpenAI ``json_schema`` and Gemini ``response_schema``), so the shape we request
+and the shape we validate never drift apart.
+"""
+import dataclasses
+import re
+import types
+import typing
+from dataclasses import dataclass, field
+from typing import Any, Literal, TypeVar, Union
+
+import orjson as json
+
+T = TypeVar("T")
+
+_MISSING = dataclasses.MISSING
+_FENCE_RE = re.compile(r"^```[a-zA-Z]*\s*|\s*```$")
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+
+
+class StructuredOutputError(ValueError):
+    """Raised when an LLM response cannot be decoded into the expected struct."""
+    pass
+
+
+@dataclass(slots=True)
+class Topic:
+    short_title: str
+    first_message_id: int | None = None
+    initiator_user_id: int | None = None
+    summary: str = ""
+
+
+@dataclass(slots=True)
+class TopicsReply:
+    topics: list[Topic] = field(default_factory=list)
+
+
+@dataclass(slots=True)
+class PanBotReply:
+    response: str
+
+
+@dataclass(slots=True)
+class PetDetection:
+    species: Literal["cat", "dog", "none"] = "none"
+    confidence: float = 0.0
+    caption: str = ""
+
+    def __post_init__(self):
+        if not 0.0 <= self.confidence <= 1.0:
+            self.confidence = 0.0
+        self.caption = self.caption.strip()
+
+
+@dataclass(slots=True)
+class IndexedPetDetection:
+    # No defaults for the verdict: a broken item is dropped and its image re-checked on its own
+    index: int
+    species: Literal["cat", "dog", "none"]
+    confidence: float
+    caption: str = ""
+
+    def __post_init__(self):
+        if not 0.0 <= self.confidence <= 1.0:
+            self.confidence = 0.0
+        self.caption = self.caption.strip()
+
+
+@dataclass(slots=True)
+class PetBatchReply:
+    results: list[IndexedPetDetection] = field(default_factory=list)
+
+
+# ---------------------------------------------------------------------------
+# Decoding
+# ---------------------------------------------------------------------------
+
+def _extract_object(raw: str) -> list[str]:
+    """
+    Return candidate texts for the first top-level JSON object in ``raw``. Unlike a
+    greedy regex this respects string literals; for a truncated response it closes
+    the dangling brackets, or cuts back to the last complete element.
+    """
+    start = raw.find("{")
+    if start < 0:
+        return []
+
+    stack: list[str] = []
+    last_comma: tuple[int, list[str]] | None = None
+    in_string = False
+    escaped = False
+    for i in range(start, len(raw)):
+        ch = raw[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch == ",":
+            last_comma = (i, list(stack))
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+            if not stack:
+                return [raw[start:i + 1]]
+
+    tail = raw[start:].rstrip().rstrip(",")
+    if in_string:
+        tail += '"'
+    candidates = [tail + "".join(reversed(stack))]
+    if last_comma is not None:
+        cut, cut_stack = last_comma
+        candidates.append(raw[start:cut] + "".join(reversed(cut_stack)))
+    return candidates
+
+
+def load_json(raw: str | bytes | None) -> Any:
+    """Parse LLM output as JSON, repairing fences, chatter, trailing commas and truncation."""
+    if isinstance(raw, bytes):
+        raw = raw.decode("utf-8", errors="replace")
+    text = (raw or "").strip()
+    if not text:
+        raise StructuredOutputError("Empty response")
+
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+
+    text = _FENCE_RE.sub("", text)
+    candidates = _extract_object(text)
+    if not candidates:
+        raise StructuredOutputError(f"No JSON object in response: {text[:200]!r}")
+
+    for candidate in candidates:
+        for attempt in (candidate, _TRAILING_COMMA_RE.sub(r"\1", candidate)):
+            try:
+                return json.loads(attempt)
+            except json.JSONDecodeError:
+                continue
+    raise StructuredOutputError(f"Unrepairable JSON response: {text[:200]!r}")
+
+
+def _is_optional(tp) -> tuple[bool, Any]:
+    origin = typing.get_origin(tp)
+    if origin in (Union, types.UnionType):
+        args = [a for a in typing.get_args(tp) if a is not type(None)]
+        if len(args) == 1 and len(typing.get_args(tp)) == 2:
+            return True, args[0]
+    return False, tp
+
+
+def _convert(value: Any, tp) -> Any:
+    """Convert ``value`` to ``tp``, coercing the near-misses LLMs commonly produce."""
+    optional, tp = _is_optional(tp)
+    if value is None:
+        if optional:
+            return None
+        raise StructuredOutputError("null value")
+
+    origin = typing.get_origin(tp)
+    if dataclasses.is_dataclass(tp):
+        if not isinstance(value, dict):
+            raise StructuredOutputError(f"expected object for {tp.__name__}")
+        return _build(tp, value)
+    if origin is list:
+        (item_tp,) = typing.get_args(tp)
+        if not isinstance(value, list):
+            value = [value]
+        items = []
+        for item in value:
+            # Targeted repair: drop the broken element, keep the rest
+            try:
+                items.append(_convert(item, item_tp))
+            except StructuredOutputError:
+                continue
+        return items
+    if origin is Literal:
+        allowed = typing.get_args(tp)
+        norm = str(value).strip().lower()
+        if norm not in allowed:
+            raise StructuredOutputError(f"{value!r} not in {allowed}")
+        return norm
+    if tp is str:
+        if isinstance(value, (dict, list)):
+            raise StructuredOutputError("expected string")
+        return str(value)
+    if tp is int:
+        if isinstance(value, bool):
+            raise StructuredOutputError("expected integer")
+        if isinstance(value, int):
+            return value
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+        if isinstance(value, str) and re.fullmatch(r"\s*-?\d+\s*", value):
+            return int(value)
+        raise StructuredOutputError(f"expected integer, got {value!r}")
+    if tp is float:
+        if isinstance(value, bool):
+            raise StructuredOutputError("expected number")
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            raise StructuredOutputError(f"expected number, got {value!r}") from None
+    return value
+
+
+def _build(cls: type[T], data: dict) -> T:
+    hints = typing.get_type_hints(cls)
+    kwargs = {}
+    for f in dataclasses.fields(cls):
+        has_default = f.default is not _MISSING or f.default_factory is not _MISSING
+        if f.name not in data:
+            if has_default:
+                continue
+            raise StructuredOutputError(f"{cls.__name__}.{f.name} is missing")
+        try:
+            kwargs[f.name] = _convert(data[f.name], hints[f.name])
+        except StructuredOutputError:
+            if not has_default:
+                raise
+            # Fall back to the field default instead of discarding the whole answer
+    return cls(**kwargs)
+
+
+def decode(raw: str | bytes | None, cls: type[T]) -> T:
+    """Decode and validate an LLM response into ``cls``; raises StructuredOutputError."""
+    data = load_json(raw)
+    if not isinstance(data, dict):
+        raise StructuredOutputError(f"Expected JSON object, got {type(data).__name__}")
+    return _build(cls, data)
+
+
+class StreamItemParser:
+    """
+    Incremental parser for streamed responses shaped like ``{"<key>": [{...}, {...}]}``.
+
+    Feed text chunks as they arrive; every element of the top-level array is
+    decoded into ``item_cls`` as soon as its closing brace is seen.
+    """
+
+    def __init__(self, item_cls: type[T]):
+        self.item_cls = item_cls
+        self.text = ""
+        self.items: list[T] = []
+        self._pos = 0
+        self._stack: list[str] = []
+        self._in_string = False
+        self._escaped = False
+        self._item_start: int | None = None
+
+    def feed(self, chunk: str) -> list[T]:
+        """Consume a chunk and return the items completed by it."""
+        self.text += chunk
+        completed = []
+        text = self.text
+        for i in range(self._pos, len(text)):
+            ch = text[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+            if ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                if ch == "{" and self._stack == ["}", "]"]:
+                    self._item_start = i
+                self._stack.append("}" if ch == "{" else "]")
+            elif ch in "}]" and self._stack:
+                self._stack.pop()
+                if ch == "}" and self._stack == ["}", "]"] and self._item_start is not None:
+                    item = self._decode_item(text[self._item_start:i + 1])
+                    self._item_start = None
+                    if item is not None:
+                        self.items.append(item)
+                        completed.append(item)
+        self._pos = len(text)
+        return completed
+
+    def _decode_item(self, fragment: str):
+        try:
+            return _convert(json.loads(fragment), self.item_cls)
+        except (json.JSONDecodeError, StructuredOutputError):
+            return None
+
+    def finish(self, cls: type) -> Any:
+        """Validate the whole streamed text into ``cls`` once the stream has ended."""
+        return decode(self.text, cls)
+
+
+# ---------------------------------------------------------------------------
+# Provider-native schemas
+# ---------------------------------------------------------------------------
+
+def _json_schema(tp, *, strict: bool) -> dict:
+    optional, tp = _is_optional(tp)
+    origin = typing.get_origin(tp)
+
+    if dataclasses.is_dataclass(tp):
+        hints = typing.get_type_hints(tp)
+        names = [f.name for f in dataclasses.fields(tp)]
+        schema = {
+            "type": "object",
+            "properties": {n: _json_schema(hints[n], strict=strict) for n in names},
+            "required": names,
+        }
+        if strict:
+            schema["additionalProperties"] = False
+    elif origin is list:
+        (item_tp,) = typing.get_args(tp)
+        schema = {"type": "array", "items": _json_schema(item_tp, strict=strict)}
+    elif origin is Literal:
+        schema = {"type": "string", "enum": list(typing.get_args(tp))}
+        if not strict:
+            schema["format"] = "enum"
+    else:
+        schema = {"type": {str: "string", int: "integer", float: "number", bool: "boolean"}[tp]}
+
+    if optional:
+        if strict:
+            schema["type"] = [schema["type"], "null"]
+        else:
+            schema["nullable"] = True
+    return schema
+
+
+def openai_response_format(cls: type) -> dict:
+    """``response_format`` for OpenAI chat completions with strict JSON-schema output."""
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": cls.__name__,
+            "strict": True,
+            "schema": _json_schema(cls, strict=True),
+        },
+    }
+
+
+def gemini_generation_config(cls: type) -> dict:
+    """``generation_config`` for Gemini with a native ``response_schema``."""
+    return {
+        "response_mime_type": "application/json",
+        "response_schema": _json_schema(cls, strict=False),
+    }
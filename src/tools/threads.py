@@ -0,0 +1,59 @@
+"""
+Reply threads resolved at ingest.
+
+Every stored message carries the id of its thread root (the first message of its reply
+chain, itself if it is not a reply) and its depth below the root, so a whole thread is a
+single indexed query. The parent of a new message is almost always recent, so its position
+comes from a bounded LRU and only falls back to the database on a miss.
+"""
+from collections import OrderedDict
+from collections.abc import Callable
+
+# (thread_root_id, thread_depth)
+ThreadPosition = tuple[int, int]
+
+
+class ThreadResolver:
+    """
+    Thread position of new messages from their parent's. ``loader(chat_id, message_id, ts_utc)``
+    returns a stored message's position, or None if the message was never stored; replies
+    to such messages start a thread rooted at the unknown parent. ``ts_utc`` is the parent's
+    timestamp when known (it selects the partition), None otherwise.
+    """
+
+    def __init__(self, loader: Callable[[int, int, int | None], ThreadPosition | None], max_entries: int):
+        self.loader = loader
+        self.max_entries = max_entries
+        self._positions: OrderedDict[tuple[int, int], ThreadPosition] = OrderedDict()
+
+    def __len__(self):
+        return len(self._positions)
+
+    def remember(self, chat_id: int, message_id: int, position: ThreadPosition):
+        key = (chat_id, message_id)
+        self._positions[key] = position
+        self._positions.move_to_end(key)
+        while len(self._positions) > self.max_entries:
+            self._positions.popitem(last=False)
+
+    def position(self, chat_id: int, message_id: int, ts_utc: int | None = None) -> ThreadPosition | None:
+        key = (chat_id, message_id)
+        position = self._positions.get(key)
+        if position is not None:
+            self._positions.move_to_end(key)
+            return position
+        position = self.loader(chat_id, message_id, ts_utc)
+        if position is not None:
+            self.remember(chat_id, message_id, position)
+        return position
+
+    def resolve(self, chat_id: int, message_id: int, reply_to_message_id: int | None,
+                reply_to_ts_utc: int | None = None) -> ThreadPosition:
+        """Position of a new message; it is remembered as the likely parent of the next replies."""
+        if reply_to_message_id is None:
+            position = (message_id, 0)
+        else:
+            parent = self.position(chat_id, reply_to_message_id, reply_to_ts_utc)
+            position = (parent[0], parent[1] + 1) if parent is not None else (reply_to_message_id, 1)
+        self.remember(chat_id, message_id, position)
+        return position
@@ -1,5 +1,6 @@
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from html import escape
+from zoneinfo import ZoneInfo
 from telegram import Chat
 
 import src.tools.config as config
@@ -9,15 +10,23 @@ def utc_ts(dt: datetime) -> int:
     return int(dt.timestamp())
 
 
-def local_midnight_bounds(day_local: datetime):
-    day = day_local.astimezone(config.KYIV).date()
-    start_local = datetime.combine(day, datetime.min.time(), tzinfo=config.KYIV)
+def local_midnight_bounds(day_local: datetime, tz: ZoneInfo | None = None):
+    """Midnight-to-midnight bounds of the day ``day_local`` falls on in ``tz`` (default ``config.KYIV``)."""
+    tz = tz or config.KYIV
+    day = day_local.astimezone(tz).date()
+    start_local = datetime.combine(day, datetime.min.time(), tzinfo=tz)
     end_local = datetime.combine(
-        day + timedelta(days=1), datetime.min.time(), tzinfo=config.KYIV
+        day + timedelta(days=1), datetime.min.time(), tzinfo=tz
     )
     return start_local, end_local
 
 
+def month_start(day: date, months: int = 0) -> date:
+    """First day of the month of ``day`` shifted by ``months`` (may be negative)."""
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
 def message_link(chat: Chat, message_id: int) -> str:
     if chat.username:
         return f"https://t.me/{chat.username}/{message_id}"
@@ -0,0 +1,97 @@
+"""
+Webhook ingestion on the Fly ``http_service`` port.
+
+A small Tornado app (Tornado already ships as a dependency) receives Telegram
+updates, validates the ``X-Telegram-Bot-Api-Secret-Token`` header against the
+required ``WEBHOOK_SECRET``, puts the update on the PTB ``update_queue`` and
+acknowledges with 200 right away; the Application processes it in the background. ``/healthz`` and ``/metrics`` are
+served from the same port.
+"""
+import asyncio
+import hmac
+import json
+import signal
+
+import tornado.web
+from telegram import Bot, Update
+from telegram.ext import Application
+
+import src.tools.config as config
+from src.tools import metrics
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class TelegramHandler(tornado.web.RequestHandler):
+    def initialize(self, bot: Bot, update_queue: asyncio.Queue, secret: str):
+        self.bot = bot
+        self.update_queue = update_queue
+        self.secret = secret
+
+    async def post(self):
+        token = self.request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(token, self.secret):
+            metrics.incr("webhook_rejected")
+            raise tornado.web.HTTPError(403)
+        try:
+            update = Update.de_json(json.loads(self.request.body), self.bot)
+        except Exception as e:
+            config.log.warning(f"Malformed webhook payload: {e}")
+            metrics.incr("webhook_malformed")
+            raise tornado.web.HTTPError(400)
+        # Only enqueue: handlers run in the Application, Telegram gets its 200 immediately
+        self.update_queue.put_nowait(update)
+        metrics.incr("webhook_updates")
+        self.set_status(200)
+
+    def log_exception(self, typ, value, tb):
+        if not isinstance(value, tornado.web.HTTPError):
+            super().log_exception(typ, value, tb)
+
+
+class HealthHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.write("ok")
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4")
+        self.write(metrics.render_text())
+
+
+def make_app(bot: Bot, update_queue: asyncio.Queue, secret: str, path: str = "/telegram") -> tornado.web.Application:
+    if not secret:
+        raise ValueError("Webhook secret must not be empty")
+    return tornado.web.Application([
+        (path, TelegramHandler, {"bot": bot, "update_queue": update_queue, "secret": secret}),
+        (r"/healthz", HealthHandler),
+        (r"/metrics", MetricsHandler),
+    ])
+
+
+async def run_webhook(app: Application):
+    """Serve updates via webhook until SIGINT/SIGTERM; mirrors what ``run_polling`` does around the server."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    async with app:
+        if app.post_init:
+            await app.post_init(app)
+        await app.bot.set_webhook(
+            url=config.WEBHOOK_URL.rstrip("/") + config.WEBHOOK_PATH,
+            secret_token=config.WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        await app.start()
+        server = make_app(app.bot, app.update_queue, config.WEBHOOK_SECRET, config.WEBHOOK_PATH).listen(config.PORT)
+        config.log.info(f"Webhook server listening on :{config.PORT}{config.WEBHOOK_PATH}")
+        try:
+            await stop.wait()
+        finally:
+            server.stop()
+            await app.stop()
+            if app.post_shutdown:
+                await app.post_shutdown(app)
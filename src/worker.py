@@ -0,0 +1,84 @@
+"""
+Job worker: ``python -m src.worker``.
+
+Runs the jobs the bot enqueues with ``JOB_QUEUE_MODE=postgres``: summaries, PanBot
+replies and pet detection. Start as many processes or machines as the load needs;
+they coordinate only through the ``jobs`` table. The worker never sends messages,
+its Bot instance is used for file downloads only.
+"""
+import asyncio
+import os
+import signal
+import socket
+from datetime import datetime, timezone
+from functools import partial
+
+from telegram import Bot
+
+import src.tools.config as config
+from src.petfinder.pets import PET_DETECTION_BATCH_SIZE
+from src.tools.db import (
+    init_db,
+    claim_jobs,
+    complete_job,
+    fail_job,
+    requeue_stale_jobs,
+    purge_finished_jobs,
+)
+from src.tools.handlers import (
+    record_pet_detection_job_failure,
+    run_panbot_reply_job,
+    run_pet_detection_jobs,
+    run_summary_job,
+)
+from src.tools.jobqueue import JOB_PANBOT_REPLY, JOB_PET_DETECTION, JOB_SUMMARY, JobKind, Worker
+from src.tools.utils import utc_ts
+
+
+def _now() -> int:
+    return utc_ts(datetime.now(timezone.utc))
+
+
+def _housekeeping():
+    now = _now()
+    requeued = requeue_stale_jobs(now - config.JOB_LEASE_SECONDS)
+    purged = purge_finished_jobs(now - config.JOB_RETENTION_DAYS * 24 * 60 * 60)
+    if requeued or purged:
+        config.log.info(f"Jobs housekeeping: {requeued} stale re-queued, {purged} purged")
+
+
+def build_worker(bot: Bot, worker_id: str) -> Worker:
+    return Worker(
+        kinds={
+            JOB_SUMMARY: JobKind(partial(run_summary_job, bot)),
+            JOB_PANBOT_REPLY: JobKind(partial(run_panbot_reply_job, bot)),
+            JOB_PET_DETECTION: JobKind(partial(run_pet_detection_jobs, bot), batch_size=PET_DETECTION_BATCH_SIZE,
+                                       deliver=False, on_failure=record_pet_detection_job_failure),
+        },
+        claim=lambda kinds, limit: claim_jobs(kinds, worker_id, limit, _now()),
+        complete=lambda job_id, result, deliver: complete_job(job_id, result, _now(), deliver),
+        fail=lambda job_id, error, retry_at, deliver: fail_job(job_id, error, _now(), retry_at, deliver),
+        housekeeping=_housekeeping,
+        concurrency=config.JOB_WORKER_CONCURRENCY,
+        poll_interval=config.JOB_POLL_INTERVAL_SECONDS,
+        max_attempts=config.JOB_MAX_ATTEMPTS,
+        retry_delay=config.JOB_RETRY_DELAY_SECONDS,
+        timeout=config.JOB_TIMEOUT_SECONDS,
+    )
+
+
+async def run():
+    init_db()
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    async with Bot(config.TELEGRAM_BOT_TOKEN) as bot:
+        worker = build_worker(bot, worker_id)
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, worker.stop)
+        config.log.info(f"Worker {worker_id} started ({config.JOB_WORKER_CONCURRENCY} slots)")
+        await worker.run()
+        config.log.info(f"Worker {worker_id} stopped")
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
@@ -0,0 +1,99 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timezone
+
+import pytest
+from telegram import Chat, Message, Update
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "test-token")
+os.environ.setdefault("GEMINI_API_KEY", "test-gemini-key")
+os.environ.setdefault("OPENAI_API_KEY", "test-openai-key")
+
+from src.tools.concurrency import PerChatUpdateProcessor  # noqa: E402
+
+
+def make_update(update_id, chat_id):
+    chat = Chat(id=chat_id, type=Chat.GROUP)
+    msg = Message(message_id=update_id, date=datetime.now(timezone.utc), chat=chat, text="привіт")
+    return Update(update_id=update_id, message=msg)
+
+
+@pytest.mark.asyncio
+async def test_slow_chat_does_not_delay_other_chat():
+    processor = PerChatUpdateProcessor(max_concurrent_updates=8)
+    finished = {}
+    started = time.monotonic()
+
+    async def handle(name, delay):
+        await asyncio.sleep(delay)
+        finished[name] = time.monotonic() - started
+
+    async with processor:
+        await asyncio.gather(
+            processor.process_update(make_update(1, -100), handle("A", 0.5)),
+            processor.process_update(make_update(2, -200), handle("B", 0.01)),
+        )
+
+    assert finished["B"] < 0.2
+    assert finished["A"] >= 0.5
+
+
+@pytest.mark.asyncio
+async def test_queued_updates_of_one_chat_do_not_hold_global_slots():
+    processor = PerChatUpdateProcessor(max_concurrent_updates=4)
+    finished = {}
+    started = time.monotonic()
+
+    async def handle(name, delay):
+        await asyncio.sleep(delay)
+        finished[name] = time.monotonic() - started
+
+    async with processor:
+        await asyncio.gather(
+            processor.process_update(make_update(1, -100), handle("A1", 0.5)),
+            *(processor.process_update(make_update(i, -100), handle(f"A{i}", 0)) for i in range(2, 6)),
+            processor.process_update(make_update(6, -200), handle("B", 0.01)),
+        )
+
+    assert finished["B"] < 0.2
+    assert all(finished[f"A{i}"] >= 0.5 for i in range(2, 6))
+
+
+@pytest.mark.asyncio
+async def test_updates_of_one_chat_run_in_order():
+    processor = PerChatUpdateProcessor(max_concurrent_updates=8)
+    events = []
+
+    async def handle(name, delay):
+        events.append(f"start {name}")
+        await asyncio.sleep(delay)
+        events.append(f"end {name}")
+
+    async with processor:
+        await asyncio.gather(
+            processor.process_update(make_update(1, -100), handle("first", 0.05)),
+            processor.process_update(make_update(2, -100), handle("second", 0)),
+        )
+
+    assert events == ["start first", "end first", "start second", "end second"]
+    assert processor._locks == {}
+
+
+@pytest.mark.asyncio
+async def test_global_limit_is_respected():
+    processor = PerChatUpdateProcessor(max_concurrent_updates=2)
+    running = 0
+    peak = 0
+
+    async def handle():
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.02)
+        running -= 1
+
+    async with processor:
+        await asyncio.gather(*(processor.process_update(make_update(i, -i), handle()) for i in range(1, 6)))
+
+    assert peak == 2
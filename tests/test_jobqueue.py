@@ -0,0 +1,264 @@
+import asyncio
+import os
+import uuid
+
+import pytest
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "test-token")
+os.environ.setdefault("GEMINI_API_KEY", "test-gemini-key")
+os.environ.setdefault("OPENAI_API_KEY", "test-openai-key")
+
+from src.tools.jobqueue import JobKind, ResultDelivery, Worker  # noqa: E402
+
+
+class FakeJobs:
+    """In-memory stand-in for the jobs table with the same claim/complete/fail semantics."""
+
+    def __init__(self):
+        self.rows: dict[int, dict] = {}
+        self.now = 1000
+
+    def add(self, kind, payload):
+        job_id = len(self.rows) + 1
+        self.rows[job_id] = {"id": job_id, "kind": kind, "payload": payload, "status": "queued", "attempts": 0,
+                             "run_after": self.now, "created_at_utc": self.now, "result": None, "error": None,
+                             "delivered": False, "delivery_attempts": 0, "deliver_after": None}
+        return job_id
+
+    def claim(self, kinds, limit):
+        due = [r for r in self.rows.values()
+               if r["status"] == "queued" and r["kind"] in kinds and r["run_after"] <= self.now][:limit]
+        for r in due:
+            r["status"] = "running"
+            r["attempts"] += 1
+        return [dict(r) for r in due]
+
+    def complete(self, job_id, result, deliver):
+        self.rows[job_id].update(status="done", result=result, delivered=not deliver)
+
+    def fail(self, job_id, error, retry_at, deliver):
+        if retry_at is None:
+            self.rows[job_id].update(status="failed", error=error, delivered=not deliver)
+        else:
+            self.rows[job_id].update(status="queued", error=error, run_after=retry_at)
+
+    def take(self, kinds, limit, lease=60):
+        rows = [r for r in self.rows.values()
+                if r["status"] in ("done", "failed") and not r["delivered"] and r["kind"] in kinds
+                and (r["deliver_after"] is None or r["deliver_after"] <= self.now)][:limit]
+        for r in rows:
+            r["deliver_after"] = self.now + lease
+            r["delivery_attempts"] += 1
+        return [dict(r) for r in rows]
+
+    def mark_delivered(self, job_id):
+        self.rows[job_id].update(delivered=True, deliver_after=None)
+
+    def retry_delivery(self, job_id, retry_at):
+        self.rows[job_id]["deliver_after"] = retry_at
+
+
+def make_delivery(store, deliverers, **kwargs):
+    options = dict(interval=0.01, max_attempts=3, retry_delay=10, clock=lambda: store.now)
+    options.update(kwargs)
+    return ResultDelivery(store.take, deliverers, store.mark_delivered, store.retry_delivery, **options)
+
+
+def make_worker(store, kinds, **kwargs):
+    options = dict(concurrency=2, poll_interval=0.01, max_attempts=3, retry_delay=10, timeout=5,
+                   clock=lambda: store.now)
+    options.update(kwargs)
+    return Worker(kinds, store.claim, store.complete, store.fail, **options)
+
+
+async def run_until(worker, condition, timeout=2.0):
+    task = asyncio.create_task(worker.run())
+    try:
+        async with asyncio.timeout(timeout):
+            while not condition():
+                await asyncio.sleep(0.01)
+    finally:
+        worker.stop()
+        await task
+
+
+@pytest.mark.asyncio
+async def test_worker_runs_jobs_and_batches_by_kind():
+    store = FakeJobs()
+    batches = []
+
+    async def detect(payloads):
+        batches.append([p["n"] for p in payloads])
+        return [None] * len(payloads)
+
+    for n in range(5):
+        store.add("pet_detection", {"n": n})
+    worker = make_worker(store, {"pet_detection": JobKind(detect, batch_size=3, deliver=False)}, concurrency=1)
+    await run_until(worker, lambda: all(r["status"] == "done" for r in store.rows.values()))
+
+    assert batches == [[0, 1, 2], [3, 4]]
+    assert all(r["delivered"] for r in store.rows.values())
+
+
+@pytest.mark.asyncio
+async def test_failed_job_is_retried_with_backoff_then_given_up():
+    store = FakeJobs()
+    calls = []
+
+    async def flaky(payloads):
+        calls.append(store.now)
+        raise RuntimeError("provider down")
+
+    job_id = store.add("summary", {})
+    worker = make_worker(store, {"summary": JobKind(flaky)}, max_attempts=2)
+
+    await run_until(worker, lambda: store.rows[job_id]["status"] == "queued" and calls)
+    assert store.rows[job_id]["run_after"] == 1010
+    assert "provider down" in store.rows[job_id]["error"]
+
+    store.now = 1010
+    worker = make_worker(store, {"summary": JobKind(flaky)}, max_attempts=2)
+    await run_until(worker, lambda: store.rows[job_id]["status"] == "failed")
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_one_failing_payload_does_not_fail_the_batch():
+    store = FakeJobs()
+
+    async def detect(payloads):
+        return [ValueError("bad photo") if p["n"] == 1 else {"ok": p["n"]} for p in payloads]
+
+    for n in range(3):
+        store.add("pet_detection", {"n": n})
+    worker = make_worker(store, {"pet_detection": JobKind(detect, batch_size=3)}, concurrency=1)
+    await run_until(worker, lambda: store.rows[1]["status"] == "done" and store.rows[2]["attempts"] == 1)
+
+    assert store.rows[3]["result"] == {"ok": 2}
+    assert store.rows[2]["status"] == "queued"
+
+
+@pytest.mark.asyncio
+async def test_failure_hook_sees_every_failed_attempt_including_timeouts():
+    store = FakeJobs()
+    failures = []
+
+    async def detect(payloads):
+        if any(p["n"] == 2 for p in payloads):
+            await asyncio.sleep(1)
+        return [ValueError("bad photo") if p["n"] == 1 else None for p in payloads]
+
+    for n in range(3):
+        store.add("pet_detection", {"n": n})
+    kind = JobKind(detect, deliver=False, on_failure=lambda payload: failures.append(payload["n"]))
+    worker = make_worker(store, {"pet_detection": kind}, concurrency=3, max_attempts=1, timeout=0.1)
+    await run_until(worker, lambda: all(r["status"] in ("done", "failed") for r in store.rows.values()))
+
+    assert sorted(failures) == [1, 2]
+    assert store.rows[1]["status"] == "done"
+
+
+@pytest.mark.asyncio
+async def test_result_delivery_hands_results_to_their_deliverer():
+    store = FakeJobs()
+    delivered = []
+
+    async def deliver(payload, result, error):
+        delivered.append((payload["chat_id"], result, error))
+
+    done = store.add("summary", {"chat_id": 1})
+    failed = store.add("summary", {"chat_id": 2})
+    store.add("pet_detection", {"chat_id": 3})
+    store.complete(done, {"text": "summary"}, True)
+    store.fail(failed, "RuntimeError: boom", None, True)
+
+    delivery = make_delivery(store, {"summary": deliver})
+    assert await delivery.deliver_once() == 2
+    assert await delivery.deliver_once() == 0
+    assert delivered == [(1, {"text": "summary"}, None), (2, None, "RuntimeError: boom")]
+    assert store.rows[done]["delivered"] and store.rows[failed]["delivered"]
+
+
+@pytest.mark.asyncio
+async def test_failed_delivery_is_retried_with_backoff_then_given_up():
+    store = FakeJobs()
+    calls = []
+
+    async def deliver(payload, result, error):
+        calls.append(store.now)
+        raise RuntimeError("telegram is down")
+
+    job_id = store.add("summary", {"chat_id": 1})
+    store.complete(job_id, {"text": "summary"}, True)
+    delivery = make_delivery(store, {"summary": deliver}, max_attempts=2)
+
+    assert await delivery.deliver_once() == 1
+    assert not store.rows[job_id]["delivered"] and store.rows[job_id]["deliver_after"] == 1010
+    assert await delivery.deliver_once() == 0
+
+    store.now = 1010
+    assert await delivery.deliver_once() == 1
+    assert store.rows[job_id]["delivered"]
+    assert calls == [1000, 1010]
+
+
+# End to end against a real Postgres: set DATABASE_URL to a scratch database to run these
+needs_db = pytest.mark.skipif(not os.getenv("DATABASE_URL"), reason="DATABASE_URL not set")
+
+
+@pytest.fixture
+def jobs_db():
+    from src.tools import db
+    db.init_db()
+    kind = f"test-{uuid.uuid4().hex[:8]}"
+    yield db, kind
+    with db.db() as conn:
+        conn.execute("DELETE FROM jobs WHERE kind=%s", (kind,))
+
+
+@needs_db
+def test_enqueue_skips_pending_duplicates(jobs_db):
+    db, kind = jobs_db
+    assert db.enqueue_jobs(kind, [({"n": 1}, f"{kind}:1"), ({"n": 2}, f"{kind}:1"), ({"n": 3}, None)], 100) == 2
+    assert db.get_active_job_keys([f"{kind}:1", f"{kind}:2"]) == {f"{kind}:1"}
+
+
+@needs_db
+def test_concurrent_claims_never_share_a_job(jobs_db):
+    db, kind = jobs_db
+    db.enqueue_jobs(kind, [({"n": n}, None) for n in range(20)], 100)
+
+    first = db.claim_jobs([kind], "worker-a", 8, 100)
+    second = db.claim_jobs([kind], "worker-b", 20, 100)
+    assert len(first) == 8 and len(second) == 12
+    assert not {r["id"] for r in first} & {r["id"] for r in second}
+    assert db.claim_jobs([kind], "worker-c", 5, 100) == []
+
+
+@needs_db
+def test_job_lifecycle_end_to_end(jobs_db):
+    db, kind = jobs_db
+    db.enqueue_jobs(kind, [({"chat_id": 1}, None)], 100)
+
+    [job] = db.claim_jobs([kind], "worker-a", 1, 100)
+    db.fail_job(job["id"], "RuntimeError: flaky", 100, retry_at=200)
+    assert db.claim_jobs([kind], "worker-a", 1, 150) == []
+
+    [job] = db.claim_jobs([kind], "worker-a", 1, 200)
+    assert job["attempts"] == 2
+    # The worker dies; its lease runs out and another worker picks the job up
+    assert db.requeue_stale_jobs(300) == 1
+    [job] = db.claim_jobs([kind], "worker-b", 1, 300)
+    db.complete_job(job["id"], {"text": "done"}, 310)
+
+    [row] = db.take_job_results([kind], 10, 320, lease_seconds=60)
+    assert row["status"] == "done" and row["result"] == {"text": "done"}
+    assert db.take_job_results([kind], 10, 330, lease_seconds=60) == []
+    # The delivery failed and is retried later; nothing is purged before it is delivered
+    db.retry_job_delivery(row["id"], 400)
+    assert db.purge_finished_jobs(400) == 0
+    [row] = db.take_job_results([kind], 10, 400, lease_seconds=60)
+    assert row["delivery_attempts"] == 2
+    db.mark_job_delivered(row["id"], 410)
+    assert db.take_job_results([kind], 10, 500, lease_seconds=60) == []
+    assert db.purge_finished_jobs(400) == 1
@@ -0,0 +1,96 @@
+import os
+from datetime import datetime, timezone
+
+import pytest
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "test-token")
+os.environ.setdefault("GEMINI_API_KEY", "test-gemini-key")
+os.environ.setdefault("OPENAI_API_KEY", "test-openai-key")
+
+from src.tools import db  # noqa: E402
+
+
+def test_migration_versions_are_sequential():
+    versions = [version for version, _, _ in db.MIGRATIONS]
+    assert versions == list(range(1, len(versions) + 1))
+    assert all(description for _, description, _ in db.MIGRATIONS)
+
+
+needs_db = pytest.mark.skipif(not os.getenv("DATABASE_URL"), reason="DATABASE_URL not set")
+
+CHAT_ID = -999_000_003
+
+
+@pytest.fixture
+def conn():
+    db.init_db()
+    now = int(datetime.now(timezone.utc).timestamp())
+    for i in range(200):
+        user_id = db.config.BOT_USER_ID if i % 10 == 0 else 1000 + i % 7
+        db.add_message(CHAT_ID, i + 1, user_id, "u", "U", "" if i % 5 == 0 else f"message {i}", None, now - 3600 + i)
+    with db.db() as c:
+        c.execute("ANALYZE messages")
+        # Tiny test tables are cheaper to scan sequentially, make the planner show its index choice
+        c.execute("SET enable_seqscan = off")
+        yield c
+        c.execute("DELETE FROM messages WHERE chat_id=%s", (CHAT_ID,))
+
+
+def _plan(conn, query, params) -> str:
+    return "\n".join(r["QUERY PLAN"] for r in conn.execute(f"EXPLAIN {query}", params).fetchall())
+
+
+def _partition_indexes(conn, index: str) -> set[str]:
+    rows = conn.execute(
+        "SELECT inhrelid::regclass::text AS name FROM pg_inherits WHERE inhparent = to_regclass(%s)", (index,)
+    ).fetchall()
+    return {r["name"] for r in rows}
+
+
+@needs_db
+def test_migrations_are_recorded_once(conn):
+    with db.db() as c:
+        c.autocommit = True
+        assert db.migrate(c) == []
+    versions = [r["version"] for r in conn.execute("SELECT version FROM schema_migrations ORDER BY version").fetchall()]
+    assert versions == [version for version, _, _ in db.MIGRATIONS]
+
+
+@needs_db
+def test_is_bot_message_uses_the_bot_rows_index(conn):
+    ts = {r["message_id"]: r["ts_utc"] for r in conn.execute(
+        "SELECT message_id, ts_utc FROM messages WHERE chat_id=%s AND message_id IN (11, 12)", (CHAT_ID,)
+    ).fetchall()}
+    plan = _plan(conn, db.IS_BOT_MESSAGE_SQL, (CHAT_ID, 11, ts[11]))
+    # The message's timestamp prunes the lookup to a single partition
+    assert sum(name in plan for name in _partition_indexes(conn, "idx_messages_bot")) == 1
+    assert db.is_bot_message(CHAT_ID, 11, ts[11])
+    assert not db.is_bot_message(CHAT_ID, 12, ts[12])
+
+
+@needs_db
+def test_hot_scans_use_the_text_index(conn):
+    now = int(datetime.now(timezone.utc).timestamp())
+    text_indexes = _partition_indexes(conn, "idx_messages_chat_ts_text")
+
+    assert any(name in _plan(conn, db.RECENT_MESSAGES_SQL, (CHAT_ID, now - 12 * 3600, 100)) for name in text_indexes)
+    assert any(name in _plan(conn, db.DAY_MESSAGES_SQL, (CHAT_ID, now - 86400, now)) for name in text_indexes)
+    assert all(r["text"] for r in db.get_day_messages(CHAT_ID, now - 86400, now + 1))
+
+
+@needs_db
+def test_similar_photo_lookup_uses_the_band_indexes(conn):
+    base = 0x0123_4567_89AB_CDEF
+    near = base ^ 0b1011 ^ (1 << 40)  # 4 bits away, two bands differ
+    far = base ^ 0x7FFF_0000_FFFF_FFFF  # shares one band but is too far
+    try:
+        for message_id, value, species in ((1, near, "cat"), (2, far, "dog")):
+            db.save_photo_hash(CHAT_ID, message_id, None, value, species, 0.9, "", 1)
+        conn.execute("ANALYZE photo_hashes")
+        params = (base, *db.band_probes(base, 6), base, 6)
+        plan = _plan(conn, db.SIMILAR_PHOTO_HASH_SQL, params)
+        assert any(f"idx_photo_hashes_band{i}" in plan for i in range(4))
+        assert db.find_similar_photo_hash(base, 6)["species"] == "cat"
+        assert db.find_similar_photo_hash(base, 3) is None
+    finally:
+        conn.execute("DELETE FROM photo_hashes WHERE chat_id=%s", (CHAT_ID,))
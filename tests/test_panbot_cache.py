@@ -0,0 +1,59 @@
+from src.panbot.cache import ResponseCache, hamming, normalize_text, simhash
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_cache(max_entries=10, ttl_seconds=60, max_distance=5):
+    clock = FakeClock()
+    return ResponseCache(max_entries, ttl_seconds, max_distance, clock=clock), clock
+
+
+def test_normalize_text():
+    assert normalize_text("  Ботяндра,   що думаєш?!🤔 ") == "ботяндра що думаєш"
+
+
+def test_simhash_is_close_for_near_duplicates():
+    a = simhash(normalize_text("ботяндра що думаєш про каву"))
+    b = simhash(normalize_text("ботяндра що думаєш про каву?"))
+    c = simhash(normalize_text("коли вже буде світло в києві"))
+    assert hamming(a, b) == 0
+    assert hamming(a, c) > 5
+
+
+def test_exact_hit_after_normalisation():
+    cache, _ = make_cache()
+    cache.put(1, "ctx", "Ботяндра, що думаєш?", "нічого")
+    assert cache.get(1, "ctx", "ботяндра що думаєш") == "нічого"
+
+
+def test_near_duplicate_hit_in_same_context_only():
+    cache, _ = make_cache(max_distance=8)
+    cache.put(1, "ctx", "ботяндра що ти думаєш про погоду сьогодні", "дощ")
+    assert cache.get(1, "ctx", "ботяндра що ти думаєш про погоду сьогодні ну") == "дощ"
+    assert cache.get(1, "other", "ботяндра що ти думаєш про погоду сьогодні") is None
+    assert cache.get(2, "ctx", "ботяндра що ти думаєш про погоду сьогодні") is None
+
+
+def test_entries_expire_after_ttl():
+    cache, clock = make_cache(ttl_seconds=60)
+    cache.put(1, "ctx", "привіт", "бувай")
+    clock.now = 61
+    assert cache.get(1, "ctx", "привіт") is None
+    assert len(cache) == 0
+
+
+def test_lru_eviction():
+    cache, _ = make_cache(max_entries=2)
+    cache.put(1, "a", "перше питання", "1")
+    cache.put(1, "b", "друге питання", "2")
+    assert cache.get(1, "a", "перше питання") == "1"  # refresh "a"
+    cache.put(1, "c", "третє питання", "3")
+    assert cache.get(1, "b", "друге питання") is None
+    assert cache.get(1, "a", "перше питання") == "1"
+    assert len(cache) == 2
@@ -0,0 +1,150 @@
+from src.panbot.context import ChatWindow, ContextRecord, ContextWindows, context_digest
+
+
+def count_tokens(text: str) -> int:
+    return len(text.split())
+
+
+def make_row(message_id, ts_utc, text, full_name="Олег", reply_to_message_id=None):
+    return dict(
+        message_id=message_id,
+        user_id=1,
+        username=None,
+        full_name=full_name,
+        text=text,
+        reply_to_message_id=reply_to_message_id,
+        ts_utc=ts_utc,
+    )
+
+
+def make_windows(loader=None, max_age_seconds=3600, max_tokens=100):
+    calls = []
+
+    def _loader(chat_id, since_ts):
+        calls.append((chat_id, since_ts))
+        return loader(chat_id, since_ts) if loader else []
+
+    return ContextWindows(count_tokens, _loader, max_age_seconds, max_tokens), calls
+
+
+def test_render_excludes_current_message_and_future():
+    windows, _ = make_windows()
+    windows.add(1, make_row(1, 100, "перше"))
+    windows.add(1, make_row(2, 110, "друге"))
+    windows.add(1, make_row(3, 120, "поточне"))
+
+    prompt = windows.get(1, 120).render(120, exclude_message_id=3)
+    assert prompt == "Олег: перше\nОлег: друге"
+
+
+def test_window_is_bounded_by_age_and_tokens():
+    window = ChatWindow(max_age_seconds=50, max_tokens=4)
+    for mid, ts in enumerate([0, 10, 60, 70], start=1):
+        window.append(ContextRecord(mid, ts, "A", "x", tokens=2))
+
+    assert [r.message_id for r in window.records] == [3, 4]
+    assert window.total_tokens == 4
+
+
+def test_render_keeps_newest_lines_within_budget():
+    window = ChatWindow(max_age_seconds=1000, max_tokens=100)
+    for mid in range(1, 6):
+        window.append(ContextRecord(mid, mid, "A", f"m{mid}", tokens=2))
+
+    assert window.render(100, max_tokens=4) == "A: m4\nA: m5"
+
+
+def test_hydrates_lazily_once_and_merges_live_messages():
+    db_rows = [make_row(1, 100, "з бази"), make_row(2, 105, "теж з бази")]
+    windows, calls = make_windows(loader=lambda chat_id, since: db_rows)
+
+    # Arrived after restart, before the first reply
+    windows.add(7, make_row(2, 105, "теж з бази"))
+    windows.add(7, make_row(3, 110, "нове"))
+
+    window = windows.get(7, 200)
+    windows.get(7, 201)
+
+    assert calls == [(7, 200 - 3600)]
+    assert [r.message_id for r in window.records] == [1, 2, 3]
+
+
+def test_empty_messages_are_skipped_and_long_ones_truncated():
+    windows, _ = make_windows(max_tokens=1000)
+    windows.add(1, make_row(1, 100, "   "))
+    windows.add(1, make_row(2, 101, "я" * 500, full_name=None))
+
+    records = list(windows.get(1, 102).records)
+    assert len(records) == 1
+    assert records[0].name == "Учасник"
+    assert len(records[0].text) == 200
+
+
+def test_build_context_walks_reply_chain_and_adds_short_tail():
+    windows, _ = make_windows(max_tokens=1000)
+    windows.add(1, make_row(1, 100, "питання про каву"))
+    windows.add(1, make_row(2, 101, "флуд один"))
+    windows.add(1, make_row(3, 102, "відповідь про каву", reply_to_message_id=1))
+    windows.add(1, make_row(4, 103, "флуд два"))
+    windows.add(1, make_row(5, 104, "флуд три"))
+    windows.add(1, make_row(6, 105, "ботяндра а ти що скажеш", reply_to_message_id=3))
+
+    context = windows.build_context(
+        1, message_id=6, reply_to_message_id=3, now_ts=105,
+        thread_max_tokens=100, tail_max_tokens=6,
+    )
+
+    assert context == (
+        "Гілка розмови:\nОлег: питання про каву\nОлег: відповідь про каву"
+        "\n\nОстанні повідомлення чату:\nОлег: флуд два\nОлег: флуд три"
+    )
+
+
+def test_build_context_loads_chain_beyond_window_from_db():
+    chain_calls = []
+
+    def chain_loader(chat_id, message_id, max_depth):
+        chain_calls.append((chat_id, message_id, max_depth))
+        return [make_row(1, 10, "дуже старе")]
+
+    windows = ContextWindows(count_tokens, lambda c, s: [], 3600, 1000, chain_loader=chain_loader)
+    windows.add(1, make_row(2, 5000, "відповідь", reply_to_message_id=1))
+
+    context = windows.build_context(
+        1, message_id=3, reply_to_message_id=2, now_ts=5001,
+        thread_max_tokens=100, tail_max_tokens=0, max_depth=10,
+    )
+
+    assert chain_calls == [(1, 1, 9)]
+    assert context == "Гілка розмови:\nОлег: дуже старе\nОлег: відповідь"
+
+
+def test_thread_section_respects_token_cap_keeping_nearest_messages():
+    windows, _ = make_windows(max_tokens=1000)
+    windows.add(1, make_row(1, 100, "a b c d"))
+    windows.add(1, make_row(2, 101, "e", reply_to_message_id=1))
+
+    context = windows.build_context(
+        1, message_id=3, reply_to_message_id=2, now_ts=102,
+        thread_max_tokens=3, tail_max_tokens=0,
+    )
+    assert context == "Гілка розмови:\nОлег: e"
+
+
+def test_context_digest_changes_with_the_selected_records():
+    windows, _ = make_windows(max_tokens=1000)
+    windows.add(1, make_row(1, 100, "питання"))
+    windows.add(1, make_row(2, 101, "ботяндра що скажеш", reply_to_message_id=1))
+
+    def digest(message_id, now_ts):
+        thread, tail = windows.select(
+            1, message_id=message_id, reply_to_message_id=1, now_ts=now_ts,
+            thread_max_tokens=100, tail_max_tokens=100,
+        )
+        return context_digest(thread + tail)
+
+    first = digest(2, 101)
+    assert digest(2, 101) == first
+
+    windows.add(1, make_row(3, 102, "новий флуд"))
+    assert digest(4, 103) != first
@@ -0,0 +1,58 @@
+import pytest
+
+from src.panbot.context import ChatWindow, ContextRecord
+from src.panbot.memory import ChatMemory
+
+
+def make_window(n):
+    window = ChatWindow(max_age_seconds=10_000, max_tokens=10_000)
+    for mid in range(1, n + 1):
+        window.append(ContextRecord(mid, 100 + mid, "Оля", f"повідомлення {mid}", tokens=10))
+    return window
+
+
+def make_memory(stored=None, condense_after_tokens=30):
+    saved = []
+    calls = []
+
+    async def condense(chat_id, previous, lines):
+        calls.append((chat_id, previous, lines))
+        return f"пам'ять {len(lines)}"
+
+    memory = ChatMemory(
+        condense=condense,
+        loader=lambda chat_id: stored,
+        saver=lambda *args: saved.append(args),
+        verbatim_tokens=20,
+        condense_after_tokens=condense_after_tokens,
+    )
+    return memory, calls, saved
+
+
+def test_pending_excludes_verbatim_tail_and_covered_records():
+    memory, _, _ = make_memory(stored={"summary": "стара", "covered_until_ts": 102})
+    pending = memory.pending(1, make_window(6), now_ts=106)
+    # 101-102 are already covered, 105-106 are the verbatim tail
+    assert [r.message_id for r in pending] == [3, 4]
+
+
+@pytest.mark.asyncio
+async def test_condenses_only_after_threshold():
+    memory, calls, saved = make_memory(condense_after_tokens=50)
+    assert await memory.maybe_condense(1, make_window(6), now_ts=106) is False
+    assert calls == []
+
+
+@pytest.mark.asyncio
+async def test_condense_folds_pending_into_summary_and_persists():
+    memory, calls, saved = make_memory(stored={"summary": "стара", "covered_until_ts": 0})
+    window = make_window(6)
+
+    assert await memory.maybe_condense(1, window, now_ts=106) is True
+    assert calls == [(1, "стара", [f"Оля: повідомлення {i}" for i in range(1, 5)])]
+    assert saved == [(1, "пам'ять 4", 104)]
+    assert memory.get(1).summary == "пам'ять 4"
+
+    # Nothing new outside the tail: no second model call
+    assert await memory.maybe_condense(1, window, now_ts=106) is False
+    assert len(calls) == 1
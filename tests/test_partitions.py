@@ -0,0 +1,125 @@
+import gzip
+import os
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
+
+import pytest
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "test-token")
+os.environ.setdefault("GEMINI_API_KEY", "test-gemini-key")
+os.environ.setdefault("OPENAI_API_KEY", "test-openai-key")
+
+import src.tools.partitions as partitions  # noqa: E402
+from src.tools import db  # noqa: E402
+from src.tools.utils import month_start  # noqa: E402
+
+
+def test_month_start():
+    assert month_start(date(2025, 3, 17)) == date(2025, 3, 1)
+    assert month_start(date(2025, 12, 31), 1) == date(2026, 1, 1)
+    assert month_start(date(2025, 1, 5), -13) == date(2023, 12, 1)
+
+
+def test_partition_name_and_bounds():
+    assert db.partition_name("messages", date(2025, 3, 1)) == "messages_p2025_03"
+    start, end = db.partition_bounds(date(2025, 12, 9))
+    assert start == int(datetime(2025, 12, 1, tzinfo=timezone.utc).timestamp())
+    assert end == int(datetime(2026, 1, 1, tzinfo=timezone.utc).timestamp())
+
+
+@pytest.fixture
+def fake_partitions(monkeypatch, tmp_path):
+    state = {"leader": True, "calls": [], "expired": [], "fail_copy": set()}
+
+    @contextmanager
+    def advisory_lock(key):
+        yield state["leader"]
+
+    def ensure(now_utc, months_ahead):
+        state["calls"].append(("ensure", months_ahead))
+        return []
+
+    def copy_to(partition, out):
+        if partition in state["fail_copy"]:
+            raise RuntimeError("disk full")
+        out.write(b"chat_id,message_id\n1,2\n")
+        return 20
+
+    monkeypatch.setattr(partitions, "advisory_lock", advisory_lock)
+    monkeypatch.setattr(partitions, "ensure_partitions", ensure)
+    monkeypatch.setattr(partitions, "get_expired_partitions", lambda before: state["calls"].append(("expired", before)) or state["expired"])
+    monkeypatch.setattr(partitions, "detach_partition", lambda t, p: state["calls"].append(("detach", p)))
+    monkeypatch.setattr(partitions, "copy_partition_to", copy_to)
+    monkeypatch.setattr(partitions, "drop_partition", lambda p: state["calls"].append(("drop", p)))
+    monkeypatch.setattr(partitions.config, "ARCHIVE_DIR", str(tmp_path))
+    monkeypatch.setattr(partitions.config, "MESSAGE_RETENTION_MONTHS", 6)
+    return state
+
+
+def test_expired_partitions_are_archived_before_they_are_dropped(fake_partitions, tmp_path):
+    fake_partitions["expired"] = [
+        {"table": "messages", "partition": "messages_p2024_01", "month": date(2024, 1, 1), "attached": True},
+        {"table": "photo_messages", "partition": "photo_messages_p2024_01", "month": date(2024, 1, 1), "attached": False},
+    ]
+
+    paths = partitions.maintain_partitions(datetime(2024, 8, 15, tzinfo=timezone.utc))
+
+    assert ("expired", date(2024, 2, 1)) in fake_partitions["calls"]
+    assert [c for c in fake_partitions["calls"] if c[0] in ("detach", "drop")] == [
+        ("detach", "messages_p2024_01"), ("drop", "messages_p2024_01"), ("drop", "photo_messages_p2024_01"),
+    ]
+    assert [os.path.basename(p) for p in paths] == ["messages_p2024_01.csv.gz", "photo_messages_p2024_01.csv.gz"]
+    with gzip.open(tmp_path / "messages_p2024_01.csv.gz") as f:
+        assert f.read() == b"chat_id,message_id\n1,2\n"
+
+
+def test_failed_archive_keeps_the_partition(fake_partitions, tmp_path):
+    fake_partitions["fail_copy"] = {"messages_p2024_01"}
+    fake_partitions["expired"] = [
+        {"table": "messages", "partition": "messages_p2024_01", "month": date(2024, 1, 1), "attached": True},
+    ]
+
+    assert partitions.maintain_partitions(datetime(2024, 8, 15, tzinfo=timezone.utc)) == []
+    assert ("drop", "messages_p2024_01") not in fake_partitions["calls"]
+    assert not (tmp_path / "messages_p2024_01.csv.gz").exists()
+
+
+def test_no_retention_only_creates_partitions(fake_partitions, monkeypatch):
+    monkeypatch.setattr(partitions.config, "MESSAGE_RETENTION_MONTHS", 0)
+
+    assert partitions.maintain_partitions(datetime(2024, 8, 15, tzinfo=timezone.utc)) == []
+    assert [c[0] for c in fake_partitions["calls"]] == ["ensure"]
+
+
+def test_non_leader_does_nothing(fake_partitions):
+    fake_partitions["leader"] = False
+
+    assert partitions.maintain_partitions(datetime(2024, 8, 15, tzinfo=timezone.utc)) == []
+    assert fake_partitions["calls"] == []
+
+
+needs_db = pytest.mark.skipif(not os.getenv("DATABASE_URL"), reason="DATABASE_URL not set")
+
+
+@needs_db
+def test_rows_land_in_monthly_partitions_and_hot_queries_prune():
+    db.init_db()
+    chat_id = -999_000_002
+    ts = int(datetime.now(timezone.utc).timestamp())
+    try:
+        db.add_message(chat_id, 1, 1, "u", "U", "hi", None, ts)
+        db.add_message(chat_id, 1, 1, "u", "U", "hi", None, ts)
+        with db.db() as conn:
+            rows = conn.execute(
+                "SELECT tableoid::regclass::text AS part FROM messages WHERE chat_id=%s", (chat_id,)
+            ).fetchall()
+            assert [r["part"] for r in rows] == [db.partition_name("messages", datetime.now(timezone.utc).date())]
+            start, _ = db.partition_bounds(datetime.now(timezone.utc).date())
+            plan = "\n".join(r["QUERY PLAN"] for r in conn.execute(
+                "EXPLAIN SELECT * FROM messages WHERE chat_id=%s AND ts_utc >= %s", (chat_id, start)
+            ).fetchall())
+            old = db.partition_name("messages", month_start(datetime.now(timezone.utc).date(), -1))
+            assert old not in plan
+    finally:
+        with db.db() as conn:
+            conn.execute("DELETE FROM messages WHERE chat_id=%s", (chat_id,))
@@ -0,0 +1,62 @@
+import asyncio
+import os
+
+import pytest
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "test-token")
+os.environ.setdefault("GEMINI_API_KEY", "test-gemini-key")
+os.environ.setdefault("OPENAI_API_KEY", "test-openai-key")
+
+from src.petfinder.albums import AlbumBuffer  # noqa: E402
+from src.petfinder.pipeline import jobs_from_rows  # noqa: E402
+
+
+def row(mid, group=None, ts=None):
+    return {"chat_id": 1, "message_id": mid, "ts_utc": ts or 100 + mid, "file_id": f"f{mid}",
+            "media_group_id": group}
+
+
+def make_buffer(delay=0.05, max_items=10):
+    flushed = []
+
+    async def flush(key, items):
+        flushed.append((key, items))
+
+    return AlbumBuffer(flush, delay=delay, max_items=max_items), flushed
+
+
+@pytest.mark.asyncio
+async def test_album_is_flushed_once_after_quiet_period():
+    buffer, flushed = make_buffer()
+    for mid in range(1, 4):
+        buffer.add((1, "g"), mid)
+        await asyncio.sleep(0.01)
+    assert flushed == []
+    await asyncio.sleep(0.1)
+    assert flushed == [((1, "g"), [1, 2, 3])]
+    assert len(buffer) == 0
+
+
+@pytest.mark.asyncio
+async def test_full_album_is_flushed_immediately_and_drain_flushes_rest():
+    buffer, flushed = make_buffer(delay=10, max_items=2)
+    buffer.add((1, "a"), 1)
+    buffer.add((1, "a"), 2)
+    buffer.add((1, "b"), 3)
+    await asyncio.sleep(0)
+    assert flushed == [((1, "a"), [1, 2])]
+    await buffer.drain()
+    assert flushed[-1] == ((1, "b"), [3])
+
+
+def test_jobs_from_rows_groups_albums():
+    jobs = jobs_from_rows([row(1), row(3, "g", ts=90), row(2, "g"), row(4)])
+    assert [j.message_id for j in jobs] == [1, 3, 4]
+    album = jobs[1]
+    assert album.message_ids == [3, 2]  # ordered by timestamp, representative first
+    assert jobs[0].album == () and jobs[0].message_ids == [1]
+
+
+def test_caption_jobs_are_never_grouped():
+    jobs = jobs_from_rows([row(1, "g"), row(2, "g")], caption_only=True)
+    assert [j.message_id for j in jobs] == [1, 2]
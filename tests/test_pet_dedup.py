@@ -0,0 +1,88 @@
+import os
+
+import pytest
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "test-token")
+os.environ.setdefault("GEMINI_API_KEY", "test-gemini-key")
+os.environ.setdefault("OPENAI_API_KEY", "test-openai-key")
+
+np = pytest.importorskip("numpy")
+
+from src.petfinder.dedup import BAND_BITS, BANDS, PhotoDeduper, band_probes, dhash, to_signed64  # noqa: E402
+
+
+def gradient(h=90, w=120, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 255, size=(h, w)).astype(np.uint8)
+
+
+def test_dhash_is_stable_under_small_changes():
+    img = gradient()
+    noisy = np.clip(img.astype(int) + 3, 0, 255)
+    other = gradient(seed=1)
+    assert (dhash(img) ^ dhash(noisy)).bit_count() <= 4
+    assert (dhash(img) ^ dhash(other)).bit_count() > 10
+
+
+def test_dhash_handles_tiny_images():
+    assert 0 <= dhash(np.arange(12).reshape(3, 4)) < 1 << 64
+
+
+def test_to_signed64_roundtrip():
+    assert to_signed64((1 << 64) - 1) == -1
+    assert to_signed64(5) == 5
+
+
+@pytest.mark.parametrize("max_distance", [0, 3, 6, 9])
+def test_band_probes_find_every_hash_within_distance(max_distance):
+    rng = np.random.default_rng(max_distance)
+    mask = (1 << BAND_BITS) - 1
+    for _ in range(200):
+        value = to_signed64(int(rng.integers(0, 1 << 63)) * 2 + int(rng.integers(0, 2)))
+        flipped = 0
+        for bit in rng.choice(64, size=int(rng.integers(0, max_distance + 1)), replace=False):
+            flipped |= 1 << int(bit)
+        near = to_signed64((value & (1 << 64) - 1) ^ flipped)
+        probes = band_probes(value, max_distance)
+        assert any((near >> (band * BAND_BITS)) & mask in probes[band] for band in range(BANDS))
+
+
+def test_band_probes_stay_small_for_the_default_distance():
+    assert [len(p) for p in band_probes(-1, 6)] == [1 + BAND_BITS] * BANDS
+
+
+def make_deduper(exact=None, similar=None):
+    saved = []
+    deduper = PhotoDeduper(
+        find_exact=lambda uid: exact.get(uid) if exact else None,
+        find_similar=lambda h, d: similar,
+        save=lambda *args: saved.append(args),
+        max_distance=6,
+    )
+    return deduper, saved
+
+
+@pytest.mark.asyncio
+async def test_exact_duplicate_skips_vision_call():
+    calls = []
+
+    async def vision():
+        calls.append(1)
+        return "cat", 0.9, "новий"
+
+    stored = {"species": "dog", "confidence": 0.8, "caption": "старий"}
+    deduper, saved = make_deduper(exact={"uid": stored})
+    assert await deduper.detect(1, 10, "uid", vision) == ("dog", 0.8, "старий")
+    assert calls == [] and saved == []
+    assert deduper.hits == 1
+
+
+@pytest.mark.asyncio
+async def test_miss_calls_vision_and_indexes_result():
+    async def vision():
+        return "cat", 0.9, "кіт"
+
+    deduper, saved = make_deduper()
+    assert await deduper.detect(1, 10, "uid", vision) == ("cat", 0.9, "кіт")
+    assert saved == [(1, 10, "uid", None, "cat", 0.9, "кіт")]
+    assert deduper.misses == 1
@@ -0,0 +1,28 @@
+from src.petfinder.gallery import PageCursor, PetfinderQuery, parse_args, split_page
+
+
+def test_parse_args():
+    assert parse_args([], max_days=90) == PetfinderQuery()
+    assert parse_args(["7d", "кіт"], max_days=90) == PetfinderQuery(days=7, species="cat")
+    assert parse_args(["Dogs", "365d"], max_days=90) == PetfinderQuery(days=90, species="dog")
+    assert parse_args(["regen"], max_days=90).regen
+
+
+def test_cursor_roundtrip_fits_callback_data():
+    cursor = PageCursor(1760000000, 1760604800, "dog", "p", (1760300000, 12345678))
+    data = cursor.encode()
+    assert len(data.encode()) <= 64
+    assert PageCursor.decode(data) == cursor
+    first = PageCursor(1, 2, None, "n", None)
+    assert PageCursor.decode(first.encode()) == first
+
+
+def test_split_page_forward_and_backward():
+    rows = list(range(6))  # limit + 1 rows in ascending order
+    start = PageCursor(0, 1, None, "n", None)
+    assert split_page(rows, start, 5) == ([0, 1, 2, 3, 4], False, True)
+    middle = PageCursor(0, 1, None, "n", (10, 1))
+    assert split_page(rows[:3], middle, 5) == ([0, 1, 2], True, False)
+    back = PageCursor(0, 1, None, "p", (10, 1))
+    assert split_page(rows, back, 5) == ([1, 2, 3, 4, 5], True, True)
+    assert split_page(rows[:2], back, 5) == ([0, 1], False, True)
@@ -0,0 +1,101 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "test-token")
+os.environ.setdefault("GEMINI_API_KEY", "test-gemini-key")
+os.environ.setdefault("OPENAI_API_KEY", "test-openai-key")
+
+from src.petfinder import pets  # noqa: E402
+
+SIZES = [
+    {"file_id": "s", "width": 90, "height": 68},
+    {"file_id": "m", "width": 320, "height": 240},
+    {"file_id": "x", "width": 800, "height": 600},
+    {"file_id": "y", "width": 1280, "height": 960},
+]
+
+
+class FakeBot:
+    async def get_file(self, file_id):
+        return SimpleNamespace(file_path=f"https://files/{file_id}")
+
+
+def test_pick_low_res_size():
+    assert pets.pick_low_res_size(SIZES, min_side=512)["file_id"] == "x"
+    assert pets.pick_low_res_size(SIZES[:2], min_side=512)["file_id"] == "m"
+    assert pets.pick_low_res_size([]) is None
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("low_res_answer, expected_calls", [
+    (("cat", 0.95, "кіт"), [("https://files/x", "low")]),
+    (("none", 0.0, ""), [("https://files/x", "low")]),
+    (("dog", 0.62, "пес"), [("https://files/x", "low"), ("https://files/y", "high")]),
+])
+async def test_escalates_only_near_threshold(monkeypatch, low_res_answer, expected_calls):
+    calls = []
+
+    async def fake_detect(url, sarcasm_level=7, detail="auto"):
+        calls.append((url, detail))
+        return low_res_answer if detail == "low" else ("dog", 0.9, "великий пес")
+
+    monkeypatch.setattr(pets, "detect_and_caption_from_url", fake_detect)
+    monkeypatch.setattr(pets, "PET_CONFIDENCE_THRESHOLD", 0.6)
+    await pets.detect_and_caption_with_bot(FakeBot(), "y", sizes=SIZES)
+    assert calls == expected_calls
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("low_res_answer, expected_calls", [
+    (("cat", 0.95, "кіт"), [("https://files/m", "low")]),
+    (("dog", 0.62, "пес"), [("https://files/m", "low"), ("https://files/m", "high")]),
+])
+async def test_small_photo_is_sent_with_low_detail_first(monkeypatch, low_res_answer, expected_calls):
+    calls = []
+
+    async def fake_detect(url, sarcasm_level=7, detail="auto"):
+        calls.append((url, detail))
+        return low_res_answer if detail == "low" else ("dog", 0.9, "пес")
+
+    monkeypatch.setattr(pets, "detect_and_caption_from_url", fake_detect)
+    monkeypatch.setattr(pets, "PET_CONFIDENCE_THRESHOLD", 0.6)
+    await pets.detect_and_caption_with_bot(FakeBot(), "m", sizes=SIZES[:2])
+    assert calls == expected_calls
+
+
+@pytest.mark.asyncio
+async def test_without_sizes_uses_original_file(monkeypatch):
+    calls = []
+
+    async def fake_detect(url, sarcasm_level=7, detail="auto"):
+        calls.append((url, detail))
+        return "cat", 0.9, ""
+
+    monkeypatch.setattr(pets, "detect_and_caption_from_url", fake_detect)
+    await pets.detect_and_caption_with_bot(FakeBot(), "doc")
+    assert calls == [("https://files/doc", "auto")]
+
+
+@pytest.mark.asyncio
+async def test_batch_falls_back_to_single_calls_for_missing_entries(monkeypatch):
+    single = []
+
+    async def fake_batch(urls, sarcasm_level=7, detail="low"):
+        assert urls == ["https://files/x", "https://files/x", "https://files/doc"]
+        return [("cat", 0.95, "кіт"), None, ("dog", 0.6, "пес?")]
+
+    async def fake_detect(url, sarcasm_level=7, detail="auto"):
+        single.append((url, detail))
+        return "dog", 0.9, "точно пес"
+
+    monkeypatch.setattr(pets, "detect_and_caption_batch_from_urls", fake_batch)
+    monkeypatch.setattr(pets, "detect_and_caption_from_url", fake_detect)
+    monkeypatch.setattr(pets, "PET_CONFIDENCE_THRESHOLD", 0.6)
+    results = await pets.detect_and_caption_batch_with_bot(FakeBot(), [("y", SIZES), ("y", SIZES), ("doc", None)])
+
+    assert results[0] == ("cat", 0.95, "кіт")
+    assert results[1] == ("dog", 0.9, "точно пес")  # missing entry: single-image call
+    assert results[2] == ("dog", 0.9, "точно пес")  # near threshold: full-size re-check
+    assert sorted(single) == [("https://files/doc", "high"), ("https://files/x", "low")]
@@ -0,0 +1,178 @@
+import asyncio
+import os
+
+import pytest
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "test-token")
+os.environ.setdefault("GEMINI_API_KEY", "test-gemini-key")
+os.environ.setdefault("OPENAI_API_KEY", "test-openai-key")
+
+from src.petfinder.pipeline import DetectionPipeline, PhotoJob, detect_concurrently  # noqa: E402
+
+
+def make_pipeline(detect, max_queue=10, max_attempts=3, workers=2):
+    stored = []
+    failures = {}
+
+    def store(job, species, conf, caption, *member):
+        stored.append((job.message_id, species, conf, caption, *member))
+
+    def record_failure(job):
+        failures[job.message_id] = failures.get(job.message_id, 0) + 1
+        return failures[job.message_id]
+
+    pipeline = DetectionPipeline(
+        detect, store, record_failure,
+        workers=workers, max_queue=max_queue, max_attempts=max_attempts,
+        retry_delay=0.01, timeout=1.0,
+    )
+    return pipeline, stored, failures
+
+
+def job(mid):
+    return PhotoJob(chat_id=1, message_id=mid, ts_utc=100 + mid, file_id=f"f{mid}")
+
+
+@pytest.mark.asyncio
+async def test_workers_process_queued_photos():
+    async def detect(j):
+        return "cat", 0.9, f"кіт {j.message_id}"
+
+    pipeline, stored, _ = make_pipeline(detect)
+    pipeline.start()
+    for mid in range(1, 4):
+        assert pipeline.submit(job(mid))
+    await pipeline.queue.join()
+    await pipeline.stop()
+
+    assert sorted(stored) == [(i, "cat", 0.9, f"кіт {i}") for i in range(1, 4)]
+
+
+@pytest.mark.asyncio
+async def test_submit_applies_backpressure_when_queue_is_full():
+    async def detect(j):
+        return "none", 0.0, ""
+
+    pipeline, _, _ = make_pipeline(detect, max_queue=2)
+    assert pipeline.submit(job(1))
+    assert pipeline.submit(job(1))  # duplicate of an in-flight photo is ignored
+    assert pipeline.submit(job(2))
+    assert not pipeline.submit(job(3))
+    assert pipeline.recover([{"chat_id": 1, "message_id": 4, "ts_utc": 0, "file_id": "x"}]) == 0
+
+
+@pytest.mark.asyncio
+async def test_transient_failures_are_retried_then_given_up():
+    calls = []
+
+    async def detect(j):
+        calls.append(j.message_id)
+        if j.message_id == 1 and calls.count(1) < 2:
+            raise RuntimeError("vision API hiccup")
+        if j.message_id == 2:
+            raise RuntimeError("always broken")
+        return "dog", 0.8, ""
+
+    pipeline, stored, failures = make_pipeline(detect, max_attempts=2, workers=1)
+    pipeline.start()
+    pipeline.submit(job(1))
+    pipeline.submit(job(2))
+    for _ in range(50):
+        await asyncio.sleep(0.01)
+        if calls.count(2) == 2 and stored:
+            break
+    await pipeline.stop()
+
+    assert stored == [(1, "dog", 0.8, "")]
+    assert failures == {1: 1, 2: 2}
+    assert calls.count(2) == 2
+
+
+@pytest.mark.asyncio
+async def test_recover_caption_only_marks_jobs():
+    seen = []
+
+    async def detect(j):
+        seen.append(j.caption_only)
+        return "cat", 0.9, "новий підпис"
+
+    pipeline, stored, _ = make_pipeline(detect)
+    pipeline.start()
+    rows = [{"chat_id": 1, "message_id": 5, "ts_utc": 0, "file_id": "x"}]
+    assert pipeline.recover(rows, caption_only=True) == 1
+    await pipeline.queue.join()
+    await pipeline.stop()
+
+    assert seen == [True]
+    assert stored == [(5, "cat", 0.9, "новий підпис")]
+
+
+@pytest.mark.asyncio
+async def test_detect_concurrently_bounds_concurrency_and_orders_results():
+    running = 0
+    peak = 0
+    arrived = []
+
+    async def detect(j):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01 * (6 - j.message_id))  # later photos finish first
+        running -= 1
+        if j.message_id == 3:
+            await asyncio.sleep(1)  # exceeds the per-photo timeout
+        return "cat", 0.9, ""
+
+    async def on_result(j, species, conf, caption):
+        arrived.append(j.message_id)
+
+    jobs = [job(mid) for mid in range(1, 6)]
+    results, failed = await detect_concurrently(jobs, detect, limit=2, timeout=0.2, on_result=on_result)
+
+    assert peak == 2
+    assert [r[0].message_id for r in results] == [1, 2, 4, 5]
+    assert [j.message_id for j in failed] == [3]
+    assert sorted(arrived) == [1, 2, 4, 5]
+
+
+@pytest.mark.asyncio
+async def test_album_verdict_keeps_the_member_file_id():
+    album = PhotoJob(1, 1, 101, "f1", album=(job(1), job(2)))
+
+    async def detect(j):
+        return "dog", 0.9, "пес", "f2"
+
+    results, failed = await detect_concurrently([album], detect, limit=1, timeout=1.0)
+    assert results == [(album, "dog", 0.9, "пес", "f2")] and not failed
+
+    pipeline, stored, _ = make_pipeline(detect)
+    pipeline.start()
+    pipeline.submit(album)
+    await pipeline.queue.join()
+    await pipeline.stop()
+    assert stored == [(1, "dog", 0.9, "пес", "f2")]
+
+
+@pytest.mark.asyncio
+async def test_workers_take_queued_photos_in_batches():
+    batches = []
+
+    async def detect(j):
+        batches.append([j.message_id])
+        return "dog", 0.7, ""
+
+    async def detect_batch(jobs):
+        batches.append([j.message_id for j in jobs])
+        return [RuntimeError("unparsable") if j.message_id == 2 else ("cat", 0.9, "") for j in jobs]
+
+    pipeline, stored, failures = make_pipeline(detect, workers=1)
+    pipeline.detect_batch, pipeline.batch_size = detect_batch, 3
+    for mid in range(1, 5):
+        pipeline.submit(job(mid))
+    pipeline.start()
+    await pipeline.queue.join()
+    await pipeline.stop()
+
+    assert batches == [[1, 2, 3], [4]]  # a lone photo takes the single-image path
+    assert sorted(m for m, *_ in stored) == [1, 3, 4]
+    assert failures == {2: 1}
@@ -0,0 +1,76 @@
+import os
+
+import pytest
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "test-token")
+os.environ.setdefault("GEMINI_API_KEY", "test-gemini-key")
+os.environ.setdefault("OPENAI_API_KEY", "test-openai-key")
+
+np = pytest.importorskip("numpy")
+
+from src.petfinder import detectors  # noqa: E402
+from src.petfinder.detectors import NumpyPrefilter, parse_classes, resize  # noqa: E402
+
+
+@pytest.fixture
+def stub_model(tmp_path):
+    """Stub "classifier": bright images are pets, dark ones are not."""
+    path = tmp_path / "stub.npz"
+    size = (4, 4)
+    weights = np.full(size[0] * size[1] * 3, 1.0, dtype=np.float32)
+    np.savez(path, weights=weights, bias=np.float32(-24.0), size=np.array(size))
+    return str(path)
+
+
+def test_parse_classes():
+    assert parse_classes("1, 3-5,") == [1, 3, 4, 5]
+
+
+def test_resize_keeps_channels():
+    assert resize(np.zeros((90, 60, 3), dtype=np.uint8), 4, 4).shape == (4, 4, 3)
+
+
+def test_numpy_prefilter_loads_lazily_and_scores(stub_model):
+    prefilter = NumpyPrefilter(stub_model)
+    assert prefilter._model is None
+    bright = np.full((90, 90, 3), 255, dtype=np.uint8)
+    dark = np.zeros((90, 90, 3), dtype=np.uint8)
+    assert prefilter.pet_probability(bright) > 0.99
+    assert prefilter.pet_probability(dark) < 0.01
+
+
+@pytest.mark.asyncio
+async def test_rejects_only_confident_non_pets(stub_model, monkeypatch):
+    prefilter = NumpyPrefilter(stub_model)
+    images = {b"dark": np.zeros((90, 90, 3), dtype=np.uint8), b"bright": np.full((90, 90, 3), 255, dtype=np.uint8)}
+    monkeypatch.setattr(detectors, "decode_rgb", lambda data: images.get(data))
+
+    def fetch(data):
+        async def fetch_image():
+            return data
+        return fetch_image
+
+    assert await detectors.rejects(prefilter, fetch(b"dark"), threshold=0.1)
+    assert not await detectors.rejects(prefilter, fetch(b"bright"), threshold=0.1)
+    assert not await detectors.rejects(prefilter, fetch(b"undecodable"), threshold=0.1)
+    assert not await detectors.rejects(None, fetch(b"dark"), threshold=0.1)
+
+
+def test_benchmark_runs_on_stub_model(stub_model, capsys):
+    from src.petfinder.benchmark import main
+
+    main(["--backend", "numpy", "--model", stub_model, "-n", "5"])
+    assert "numpy: n=5" in capsys.readouterr().out
+
+
+def test_prefilter_with_missing_modules_is_disabled_with_a_warning(monkeypatch):
+    warnings = []
+    monkeypatch.setattr(detectors.config, "PET_PREFILTER_BACKEND", "onnx")
+    monkeypatch.setattr(detectors.config.log, "warning", warnings.append)
+    monkeypatch.setattr(detectors, "missing_modules", lambda backend: ["onnxruntime"])
+    monkeypatch.setattr(detectors, "_prefilter", None)
+    monkeypatch.setattr(detectors, "_prefilter_unavailable", False)
+
+    assert detectors.get_prefilter() is None
+    assert detectors.get_prefilter() is None
+    assert len(warnings) == 1 and "onnxruntime" in warnings[0]
@@ -1,72 +1,203 @@
-import pytest
-from unittest.mock import AsyncMock, MagicMock, patch
+import os
+from contextlib import contextmanager
+from datetime import date, datetime, time as dtime, timedelta, timezone
+from unittest.mock import AsyncMock, MagicMock
 from zoneinfo import ZoneInfo
-from datetime import time as dtime
 
-import src.scheduler as scheduler
+import pytest
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "test-token")
+os.environ.setdefault("GEMINI_API_KEY", "test-gemini-key")
+os.environ.setdefault("OPENAI_API_KEY", "test-openai-key")
+
+import src.tools.scheduler as scheduler  # noqa: E402
+from src.tools.schedules import ChatSchedule  # noqa: E402
+
+KYIV = ZoneInfo("Europe/Kyiv")
+
+
+def row(chat_id, tz=None, summary_time=None):
+    return {"chat_id": chat_id, "tz": tz, "summary_time": summary_time}
+
+
+@pytest.fixture
+def fake_runs(monkeypatch):
+    """summary_runs kept in a dict, and an advisory lock that is always ours unless ``leader`` is False."""
+    state = {"runs": {}, "attempts": {}, "finished": {}, "leader": True, "known": set(),
+             "chats": [row(123), row(456)], "now": 1_000_000}
+
+    @contextmanager
+    def advisory_lock(key):
+        yield state["leader"]
+
+    def claim(chat_id, day, now, stale_before, retry_delay, max_attempts):
+        key = (chat_id, day)
+        if key in state["runs"]:
+            attempts = state["attempts"][key]
+            retry_at = state["finished"].get(key, now) + retry_delay * 2 ** (attempts - 1)
+            if state["runs"][key] != "failed" or attempts >= max_attempts or now < retry_at:
+                return False
+        state["runs"][key] = "running"
+        state["attempts"][key] = state["attempts"].get(key, 0) + 1
+        return True
+
+    def finish(chat_id, day, status, now, message_id=None, error=None):
+        state["runs"][(chat_id, day)] = status
+        state["finished"][(chat_id, day)] = now
+
+    def sent_runs(since_day):
+        return {key for key, status in state["runs"].items() if status == "sent" and key[1] >= since_day}
+
+    monkeypatch.setattr(scheduler, "advisory_lock", advisory_lock)
+    monkeypatch.setattr(scheduler, "claim_summary_run", claim)
+    monkeypatch.setattr(scheduler, "finish_summary_run", finish)
+    monkeypatch.setattr(scheduler, "get_sent_summary_runs", sent_runs)
+    monkeypatch.setattr(scheduler, "get_chats_with_summary_runs", lambda: state["known"])
+    monkeypatch.setattr(scheduler, "get_enabled_chat_schedules", lambda: state["chats"])
+    monkeypatch.setattr(scheduler, "_now_utc", lambda: state["now"])
+    monkeypatch.setattr(scheduler.config, "ALLOWED_CHAT_IDS", {456, 789})
+    monkeypatch.setattr(scheduler.config, "SUMMARY_SPREAD_MINUTES", 0)
+    monkeypatch.setattr(scheduler.config, "SUMMARY_RETRY_DELAY_SECONDS", 0)
+    return state
+
 
 @pytest.mark.asyncio
-@patch("src.scheduler.send_daily_summary_to_chat", new_callable=AsyncMock)
-@patch("src.scheduler.config")
-@patch("src.scheduler.get_enabled_chat_ids")
-async def test_send_all_summaries_job_sends_only_configured_chats(
-    mock_get_enabled_chat_ids,
-    mock_config,
-    mock_send_daily_summary_to_chat
-):
-    # Setup: 2 enabled, only 1 allowed
-    mock_get_enabled_chat_ids.return_value = [123, 456]
-    mock_config.ALLOWED_CHAT_IDS = [456]
-    mock_config.log = MagicMock()
+async def test_sends_only_configured_chats_once_per_day(monkeypatch, fake_runs):
+    send = AsyncMock(return_value=42)
+    monkeypatch.setattr(scheduler, "send_daily_summary_to_chat", send)
+    now = datetime(2025, 3, 10, 23, 59, 30, tzinfo=KYIV)
 
-    app = MagicMock()
-    context = MagicMock()
-    context.application = app
+    assert await scheduler.run_due_summaries(MagicMock(), now) == 1
+    assert await scheduler.run_due_summaries(MagicMock(), now) == 0
 
-    await scheduler.send_all_summaries_job(context)
+    send.assert_awaited_once()
+    assert send.await_args.args[1] == 456
+    assert fake_runs["runs"] == {(456, "2025-03-10"): "sent"}
 
-    # Only allowed chat is sent
-    mock_send_daily_summary_to_chat.assert_awaited_once_with(app, 456)
-    mock_config.log.info.assert_called_with("Daily summaries sent to %d chats", 1)
 
 @pytest.mark.asyncio
-@patch("src.scheduler.send_daily_summary_to_chat", new_callable=AsyncMock)
-@patch("src.scheduler.config")
-@patch("src.scheduler.get_enabled_chat_ids")
-async def test_send_all_summaries_no_configured_chats(
-    mock_get_enabled_chat_ids,
-    mock_config,
-    mock_send_daily_summary_to_chat
-):
-    mock_get_enabled_chat_ids.return_value = [222]
-    mock_config.ALLOWED_CHAT_IDS = []
-    mock_config.log = MagicMock()
+async def test_uses_each_chat_timezone_and_time(monkeypatch, fake_runs):
+    fake_runs["chats"] = [row(456, "Asia/Tokyo", "21:00")]
+    send = AsyncMock(return_value=42)
+    monkeypatch.setattr(scheduler, "send_daily_summary_to_chat", send)
 
-    app = MagicMock()
-    context = MagicMock()
-    context.application = app
+    # 20:30 in Tokyo: not due yet
+    assert await scheduler.run_due_summaries(MagicMock(), datetime(2025, 3, 10, 11, 30, tzinfo=timezone.utc)) == 0
+    # 21:05 in Tokyo, still the afternoon in Kyiv
+    assert await scheduler.run_due_summaries(MagicMock(), datetime(2025, 3, 10, 12, 5, tzinfo=timezone.utc)) == 1
 
-    await scheduler.send_all_summaries_job(context)
+    _, chat_id, start_local, end_local = send.await_args.args
+    assert chat_id == 456
+    assert start_local == datetime(2025, 3, 10, tzinfo=ZoneInfo("Asia/Tokyo"))
+    assert end_local - start_local == timedelta(days=1)
 
-    mock_send_daily_summary_to_chat.assert_not_awaited()
-    mock_config.log.info.assert_called_with("No enabled and configured chats to summarize.")
 
+@pytest.mark.asyncio
+async def test_non_leader_does_nothing(monkeypatch, fake_runs):
+    fake_runs["leader"] = False
+    send = AsyncMock(return_value=42)
+    monkeypatch.setattr(scheduler, "send_daily_summary_to_chat", send)
 
-def test_schedule_daily_adds_job(monkeypatch):
-    app = MagicMock()
-    job_queue = MagicMock()
-    app.job_queue = job_queue
+    assert await scheduler.run_due_summaries(MagicMock(), datetime(2025, 3, 10, 23, 59, 30, tzinfo=KYIV)) == 0
+    send.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_catch_up_retries_failed_days_of_known_chats(monkeypatch, fake_runs):
+    fake_runs["known"] = {456}
+    monkeypatch.setattr(scheduler.config, "ALLOWED_CHAT_IDS", {456, 123})
+    monkeypatch.setattr(scheduler.config, "SUMMARY_CATCHUP_DAYS", 0)
+    send = AsyncMock(side_effect=[RuntimeError("telegram down"), 42, 43])
+    monkeypatch.setattr(scheduler, "send_daily_summary_to_chat", send)
+    # 2025-03-09 was missed, 2025-03-10 is not due yet
+    now = datetime(2025, 3, 10, 12, 0, tzinfo=KYIV)
 
-    fake_config = MagicMock()
-    monkeypatch.setattr(scheduler, "config", fake_config)
-    fake_config.KYIV = ZoneInfo("Europe/Kyiv")
-    fake_config.TZ = "Europe/Kyiv"
-    fake_config.log = MagicMock()
+    await scheduler.run_due_summaries(MagicMock(), now)
+    assert fake_runs["runs"] == {(456, "2025-03-09"): "failed"}
+
+    await scheduler.run_due_summaries(MagicMock(), now)
+    assert fake_runs["runs"] == {(456, "2025-03-09"): "sent"}
+    # Chat 123 has no history, so it is not sent a backlog of old days
+    assert [c.args[1] for c in send.await_args_list] == [456, 456]
+
+
+@pytest.mark.asyncio
+async def test_failed_summary_is_retried_with_backoff_and_given_up(monkeypatch, fake_runs):
+    monkeypatch.setattr(scheduler.config, "SUMMARY_RETRY_DELAY_SECONDS", 600)
+    monkeypatch.setattr(scheduler.config, "SUMMARY_MAX_ATTEMPTS", 3)
+    send = AsyncMock(side_effect=RuntimeError("bot was kicked"))
+    monkeypatch.setattr(scheduler, "send_daily_summary_to_chat", send)
+    now = datetime(2025, 3, 10, 23, 59, 30, tzinfo=KYIV)
+
+    async def tick(after_seconds):
+        fake_runs["now"] += after_seconds
+        await scheduler.run_due_summaries(MagicMock(), now)
+
+    await tick(0)
+    await tick(60)      # next minute: still backing off
+    assert send.await_count == 1
+    await tick(600)     # first retry after the delay
+    await tick(600)     # the delay has doubled
+    assert send.await_count == 2
+    await tick(600)
+    assert send.await_count == 3
+    await tick(100_000)  # out of attempts
+    assert send.await_count == 3
+
+
+@pytest.mark.asyncio
+async def test_no_configured_chats(monkeypatch, fake_runs):
+    monkeypatch.setattr(scheduler.config, "ALLOWED_CHAT_IDS", set())
+    send = AsyncMock()
+    monkeypatch.setattr(scheduler, "send_daily_summary_to_chat", send)
+
+    assert await scheduler.run_due_summaries(MagicMock(), datetime(2025, 3, 10, 23, 59, 30, tzinfo=KYIV)) == 0
+    send.assert_not_awaited()
+
+
+def test_pending_summaries_are_ordered_by_due_time():
+    kyiv = ChatSchedule(1, KYIV, dtime(23, 59))
+    tokyo = ChatSchedule(2, ZoneInfo("Asia/Tokyo"), dtime(23, 59))
+    now = datetime(2025, 3, 11, 0, 30, tzinfo=KYIV)
+
+    due = scheduler.pending_summaries([kyiv, tokyo], now, 0, 0)
+
+    assert [(s.chat_id, d) for s, d in due] == [(2, date(2025, 3, 10)), (1, date(2025, 3, 10))]
+
+
+def test_schedule_daily_adds_a_repeating_tick():
+    app = MagicMock()
 
     scheduler.schedule_daily(app)
 
-    job_queue.run_daily.assert_called_once()
-    call = job_queue.run_daily.call_args
-    assert call.kwargs["name"] == "daily_summary_all"
-    assert isinstance(call.kwargs["time"], dtime)
-    fake_config.log.info.assert_called_with("Daily job scheduled for 23:59 %s", "Europe/Kyiv")
+    app.job_queue.run_daily.assert_not_called()
+    call = app.job_queue.run_repeating.call_args
+    assert call.kwargs["name"] == "daily_summaries"
+    assert call.kwargs["job_kwargs"] == {"max_instances": 1, "coalesce": True}
+
+
+needs_db = pytest.mark.skipif(not os.getenv("DATABASE_URL"), reason="DATABASE_URL not set")
+
+
+@needs_db
+def test_summary_run_is_claimed_once():
+    from src.tools import db
+    db.init_db()
+    chat_id, day = -999_000_001, "2001-01-01"
+    try:
+        assert db.claim_summary_run(chat_id, day, 100, 0, 60, 3)
+        assert not db.claim_summary_run(chat_id, day, 101, 0, 60, 3)
+        db.finish_summary_run(chat_id, day, "failed", 102, error="boom")
+        assert not db.claim_summary_run(chat_id, day, 103, 0, 60, 3)  # backing off
+        assert db.claim_summary_run(chat_id, day, 162, 0, 60, 3)
+        db.finish_summary_run(chat_id, day, "failed", 163, error="boom")
+        assert not db.claim_summary_run(chat_id, day, 200, 0, 60, 3)  # the delay doubled
+        assert db.claim_summary_run(chat_id, day, 283, 0, 60, 3)
+        db.finish_summary_run(chat_id, day, "failed", 284, error="boom")
+        assert not db.claim_summary_run(chat_id, day, 100_000, 0, 60, 3)  # out of attempts
+        assert db.claim_summary_run(chat_id, "2001-01-02", 100, 0, 60, 3)
+        db.finish_summary_run(chat_id, "2001-01-02", "sent", 104, message_id=1)
+        assert not db.claim_summary_run(chat_id, "2001-01-02", 10_000, 9_000, 0, 3)
+    finally:
+        with db.db() as conn:
+            conn.execute("DELETE FROM summary_runs WHERE chat_id=%s", (chat_id,))
@@ -0,0 +1,58 @@
+import os
+from datetime import date, datetime, time as dtime, timedelta
+from zoneinfo import ZoneInfo
+
+import pytest
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "test-token")
+os.environ.setdefault("GEMINI_API_KEY", "test-gemini-key")
+os.environ.setdefault("OPENAI_API_KEY", "test-openai-key")
+
+from src.tools import config  # noqa: E402
+from src.tools.schedules import ChatSchedule, parse_summary_time, parse_timezone, spread_offset  # noqa: E402
+
+KYIV = ZoneInfo("Europe/Kyiv")
+
+
+def test_parse_summary_time():
+    assert parse_summary_time("23:59") == dtime(23, 59)
+    assert parse_summary_time(" 7:05 ") == dtime(7, 5)
+    for bad in ("24:00", "12:60", "noon", "1230"):
+        with pytest.raises(ValueError):
+            parse_summary_time(bad)
+
+
+def test_parse_timezone():
+    assert parse_timezone("Asia/Tokyo") == ZoneInfo("Asia/Tokyo")
+    for bad in ("Mars/Olympus", "../etc/passwd"):
+        with pytest.raises(ValueError):
+            parse_timezone(bad)
+
+
+def test_spread_offset_is_stable_and_within_window():
+    offsets = {spread_offset(chat_id, 1800) for chat_id in range(-1001000, -1000900)}
+    assert all(timedelta(0) <= o < timedelta(minutes=30) for o in offsets)
+    assert len(offsets) > 50
+    assert spread_offset(-100123, 1800) == spread_offset(-100123, 1800)
+    assert spread_offset(-100123, 0) == timedelta(0)
+
+
+def test_from_row_falls_back_to_defaults():
+    schedule = ChatSchedule.from_row({"chat_id": 1, "tz": "Nowhere/City", "summary_time": "25:00"})
+    assert schedule.tz == config.KYIV
+    assert schedule.at == parse_summary_time(config.SUMMARY_TIME)
+
+    schedule = ChatSchedule.from_row({"chat_id": 1, "tz": "Asia/Tokyo", "summary_time": "21:30"})
+    assert (schedule.tz, schedule.at) == (ZoneInfo("Asia/Tokyo"), dtime(21, 30))
+
+
+def test_due_days_with_spread_past_midnight():
+    schedule = ChatSchedule(42, KYIV, dtime(23, 59))
+    spread = 3600
+    due = schedule.due_at(date(2025, 3, 10), spread)
+    assert datetime(2025, 3, 10, 23, 59, tzinfo=KYIV) <= due < datetime(2025, 3, 11, 0, 59, tzinfo=KYIV)
+
+    # Right before the chat's slot only the previous day is due, right after it both are
+    assert schedule.due_days(due - timedelta(seconds=1), 1, spread) == [date(2025, 3, 9)]
+    assert schedule.due_days(due, 1, spread) == [date(2025, 3, 9), date(2025, 3, 10)]
+    assert schedule.due_days(due, 0, spread) == [date(2025, 3, 10)]
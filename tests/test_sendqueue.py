@@ -0,0 +1,118 @@
+import asyncio
+import os
+
+import pytest
+import pytest_asyncio
+from telegram.error import RetryAfter
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "test-token")
+os.environ.setdefault("GEMINI_API_KEY", "test-gemini-key")
+os.environ.setdefault("OPENAI_API_KEY", "test-openai-key")
+
+from src.tools.sendqueue import PRIORITY_BACKGROUND, OutboundRateLimiter, TokenBucket  # noqa: E402
+
+
+@pytest_asyncio.fixture
+async def limiter():
+    limiter = OutboundRateLimiter(global_per_second=1000, chat_per_second=1000, group_per_minute=60_000)
+    await limiter.initialize()
+    yield limiter
+    await limiter.shutdown()
+
+
+def send(limiter, calls, chat_id, text, priority=None, endpoint="sendMessage", message_id=None):
+    data = {"chat_id": chat_id, "text": text}
+    if message_id is not None:
+        data["message_id"] = message_id
+
+    async def callback():
+        calls.append(text)
+        return {"text": text}
+
+    args = {"priority": priority} if priority is not None else None
+    return limiter.process_request(callback, (), {}, endpoint, data, args)
+
+
+def test_token_bucket_refills_at_rate():
+    bucket = TokenBucket(rate=2, capacity=1, now=0)
+    assert bucket.ready_at(0) == 0
+    bucket.take(0)
+    assert bucket.ready_at(0) == 0.5
+    assert bucket.ready_at(0.5) == 0.5
+
+
+@pytest.mark.asyncio
+async def test_interactive_requests_go_before_background(limiter):
+    calls = []
+    # Hold the chat bucket so everything below queues up first
+    limiter._chat_bucket(1, limiter.clock()).tokens = -0.05
+    tasks = [
+        asyncio.create_task(send(limiter, calls, 1, "summary", PRIORITY_BACKGROUND)),
+        asyncio.create_task(send(limiter, calls, 1, "reply")),
+    ]
+    await asyncio.gather(*tasks)
+    assert calls == ["reply", "summary"]
+
+
+@pytest.mark.asyncio
+async def test_per_chat_limit_spaces_sends():
+    limiter = OutboundRateLimiter(global_per_second=1000, chat_per_second=20, group_per_minute=60)
+    await limiter.initialize()
+    try:
+        calls = []
+        limiter._chat_bucket(1, limiter.clock()).tokens = 1
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await asyncio.gather(*(send(limiter, calls, 1, f"m{i}") for i in range(3)))
+        # First send is free, the next two wait 1/20 s each
+        assert loop.time() - started >= 0.09
+        assert calls == ["m0", "m1", "m2"]
+    finally:
+        await limiter.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_rapid_edits_are_coalesced(limiter):
+    calls = []
+    limiter._chat_bucket(1, limiter.clock()).tokens = -0.05
+    results = await asyncio.gather(*(
+        send(limiter, calls, 1, f"v{i}", endpoint="editMessageText", message_id=7) for i in range(3)
+    ))
+    assert calls == ["v2"]
+    assert results == [{"text": "v2"}] * 3
+
+
+@pytest.mark.asyncio
+async def test_retry_after_is_honoured(limiter):
+    attempts = []
+
+    async def callback():
+        attempts.append(asyncio.get_running_loop().time())
+        if len(attempts) == 1:
+            raise RetryAfter(0.1)
+        return True
+
+    assert await limiter.process_request(callback, (), {}, "sendMessage", {"chat_id": 1}, None) is True
+    assert len(attempts) == 2
+    assert attempts[1] - attempts[0] >= 0.09
+
+
+@pytest.mark.asyncio
+async def test_retry_after_gives_up_after_max_retries(limiter):
+    limiter.max_retries = 1
+
+    async def callback():
+        raise RetryAfter(0.01)
+
+    with pytest.raises(RetryAfter):
+        await limiter.process_request(callback, (), {}, "sendMessage", {"chat_id": 1}, None)
+
+
+@pytest.mark.asyncio
+async def test_unlimited_endpoints_bypass_queue(limiter):
+    limiter._paused_until = limiter.clock() + 60
+
+    async def callback():
+        return {"id": 1}
+
+    assert await limiter.process_request(callback, (), {}, "getChat", {"chat_id": 1}, None) == {"id": 1}
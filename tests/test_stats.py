@@ -0,0 +1,115 @@
+import os
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "test-token")
+os.environ.setdefault("GEMINI_API_KEY", "test-gemini-key")
+os.environ.setdefault("OPENAI_API_KEY", "test-openai-key")
+
+import src.tools.stats as stats  # noqa: E402
+
+UTC = timezone.utc
+# Monday 2025-03-10
+HOUR_09 = int(datetime(2025, 3, 10, 9, tzinfo=UTC).timestamp())
+HOUR_10 = HOUR_09 + 3600
+
+
+def row(hour_utc, user_id, messages, chars, tokens=0, replies=0, username=None, full_name=None):
+    return {"hour_utc": hour_utc, "user_id": user_id, "username": username, "full_name": full_name,
+            "messages": messages, "chars": chars, "tokens": tokens, "replies": replies}
+
+
+ROWS = [
+    row(HOUR_09, 1, 5, 100, 30, 1, full_name="Old Name"),
+    row(HOUR_10, 1, 3, 50, 10, 2, username="olena", full_name="Олена"),
+    row(HOUR_09, 2, 8, 120, 40, 0, full_name="Петро"),
+    row(HOUR_10, 3, 8, 300, 90, 4, full_name="Іван"),
+]
+
+
+@pytest.fixture(params=["numpy", "python"])
+def backend(request, monkeypatch):
+    if request.param == "python":
+        monkeypatch.setattr(stats, "np", None)
+    elif stats.np is None:
+        pytest.skip("NumPy is not installed")
+    return request.param
+
+
+def test_ranking_and_totals(backend):
+    result = stats.compute_stats(ROWS, UTC, top_n=2)
+
+    assert result.totals == {"messages": 24, "chars": 570, "tokens": 170, "replies": 7}
+    # Ties on messages are broken by characters
+    assert [(u.user_id, u.messages, u.chars) for u in result.top] == [(3, 8, 300), (1, 8, 150)]
+    # The latest name of a user is shown
+    assert (result.top[1].username, result.top[1].full_name) == ("olena", "Олена")
+
+
+def test_panbot_replies_are_not_counted(backend):
+    bot_row = row(HOUR_10, stats.config.BOT_USER_ID, 50, 5000, 900, 50, full_name="PanBot")
+    result = stats.compute_stats(ROWS + [bot_row], UTC, top_n=10)
+
+    assert result.totals == {"messages": 24, "chars": 570, "tokens": 170, "replies": 7}
+    assert stats.config.BOT_USER_ID not in [u.user_id for u in result.top]
+    assert sum(result.hourly) == 24
+
+
+def test_heatmaps_use_the_chat_timezone(backend):
+    result = stats.compute_stats(ROWS, ZoneInfo("Europe/Kyiv"), top_n=10)
+
+    # 09:00 UTC is 11:00 in Kyiv in March
+    assert result.hourly[11] == 13 and result.hourly[12] == 11
+    assert sum(result.hourly) == 24
+    assert result.weekly[0][11] == 13
+    assert result.busiest_hour == 11
+
+
+def test_no_activity():
+    result = stats.compute_stats([], UTC, top_n=10)
+
+    assert result.totals["messages"] == 0 and result.busiest_hour is None
+    assert "Повідомлень немає" in stats.render_stats(result, "📊")
+
+
+def test_heatmap_line():
+    assert stats.heatmap_line([0, 1, 4, 8]) == " ▁▄█"
+    assert stats.heatmap_line([0, 0]) == "  "
+    assert stats.heatmap_line([2], peak=8) == "▂"
+
+
+def test_render_stats():
+    text = stats.render_stats(stats.compute_stats(ROWS, UTC, top_n=3), "📊 <Stats>", weekly=True)
+
+    assert "&lt;Stats&gt;" in text
+    assert '1. <a href="tg://user?id=3">Іван</a> — 8 повід., 300 симв.' in text
+    assert '<a href="https://t.me/olena">Олена</a>' in text
+    assert "Пн " in text and "Найактивніша година: 09:00" in text
+
+
+needs_db = pytest.mark.skipif(not os.getenv("DATABASE_URL"), reason="DATABASE_URL not set")
+
+
+@needs_db
+def test_activity_is_aggregated_at_ingest():
+    from src.tools import db
+    db.init_db()
+    chat_id = -999_000_005
+    try:
+        db.add_message(chat_id, 1, 7, "u", "U", "hello", None, HOUR_09 + 10, tokens=2)
+        db.add_message(chat_id, 2, 7, "u", "U", "hi", 1, HOUR_09 + 20, tokens=1)
+        db.add_message(chat_id, 2, 7, "u", "U", "hi", 1, HOUR_09 + 20, tokens=1)  # duplicate update
+        db.add_message(chat_id, 3, None, None, None, "anon", None, HOUR_10 + 5, tokens=1)
+        db.add_message(chat_id, 4, db.config.BOT_USER_ID, "PanBot", "PanBot", "reply", 3, HOUR_10 + 6, tokens=1)
+
+        rows = sorted(db.get_chat_activity(chat_id, HOUR_09, HOUR_10 + 3600), key=lambda r: r["hour_utc"])
+        assert [(r["hour_utc"], r["user_id"], r["messages"], r["chars"], r["tokens"], r["replies"]) for r in rows] == [
+            (HOUR_09, 7, 2, 7, 3, 1),
+            (HOUR_10, 0, 1, 4, 1, 0),
+        ]
+    finally:
+        with db.db() as conn:
+            conn.execute("DELETE FROM messages WHERE chat_id=%s", (chat_id,))
+            conn.execute("DELETE FROM chat_activity WHERE chat_id=%s", (chat_id,))
@@ -0,0 +1,102 @@
+import pytest
+
+from src.tools.structured import (
+    PanBotReply,
+    PetDetection,
+    StreamItemParser,
+    StructuredOutputError,
+    Topic,
+    TopicsReply,
+    decode,
+    gemini_generation_config,
+    load_json,
+    openai_response_format,
+)
+
+
+def test_decode_plain_topics():
+    raw = '{"topics": [{"short_title": "Кава", "first_message_id": 10, "initiator_user_id": 5, "summary": "Пили каву"}]}'
+    reply = decode(raw, TopicsReply)
+    assert len(reply.topics) == 1
+    topic = reply.topics[0]
+    assert topic.short_title == "Кава"
+    assert topic.first_message_id == 10
+    assert topic.initiator_user_id == 5
+
+
+def test_decode_repairs_fences_chatter_and_trailing_commas():
+    raw = 'Ось результат:\n```json\n{"response": "привіт, {друже}",}\n```'
+    assert decode(raw, PanBotReply).response == "привіт, {друже}"
+
+
+def test_decode_repairs_truncated_output():
+    raw = '{"topics": [{"short_title": "A", "first_message_id": 1}, {"short_title": "B", "summ'
+    reply = decode(raw, TopicsReply)
+    assert [t.short_title for t in reply.topics] == ["A", "B"]
+
+
+def test_decode_coerces_ids_and_drops_broken_topics():
+    raw = '{"topics": [{"short_title": "A", "first_message_id": "42"}, {"summary": "no title"}, "junk"]}'
+    reply = decode(raw, TopicsReply)
+    assert len(reply.topics) == 1
+    assert reply.topics[0].first_message_id == 42
+
+
+def test_decode_invalid_optional_field_falls_back_to_default():
+    reply = decode('{"topics": [{"short_title": "A", "first_message_id": "abc"}]}', TopicsReply)
+    assert reply.topics[0].first_message_id is None
+
+
+def test_pet_detection_normalises_species_and_confidence():
+    det = decode('{"species": "CAT", "confidence": 1.7, "caption": " Кіт. "}', PetDetection)
+    assert det.species == "cat"
+    assert det.confidence == 0.0
+    assert det.caption == "Кіт."
+
+    det = decode('{"species": "hamster", "confidence": 0.9, "caption": "x"}', PetDetection)
+    assert det.species == "none"
+
+
+@pytest.mark.parametrize("raw", ["", "no json here", "[1, 2]", '{"topics": ['])
+def test_decode_rejects_unusable_output(raw):
+    with pytest.raises(StructuredOutputError):
+        decode(raw, PanBotReply)
+
+
+def test_load_json_is_value_error():
+    with pytest.raises(ValueError):
+        load_json("nothing")
+
+
+def test_openai_schema_is_strict():
+    fmt = openai_response_format(TopicsReply)
+    schema = fmt["json_schema"]["schema"]
+    topic = schema["properties"]["topics"]["items"]
+    assert fmt["type"] == "json_schema"
+    assert schema["additionalProperties"] is False
+    assert topic["required"] == ["short_title", "first_message_id", "initiator_user_id", "summary"]
+    assert topic["properties"]["first_message_id"]["type"] == ["integer", "null"]
+
+
+def test_gemini_schema_uses_openapi_subset():
+    schema = gemini_generation_config(PetDetection)["response_schema"]
+    assert "additionalProperties" not in schema
+    assert schema["properties"]["species"] == {
+        "type": "string", "enum": ["cat", "dog", "none"], "format": "enum",
+    }
+
+
+def test_stream_parser_yields_topics_as_they_complete():
+    raw = (
+        '{"topics": [{"short_title": "A {x}", "first_message_id": 1, "summary": "s"},'
+        ' {"short_title": "B", "first_message_id": 2, "summary": "t"}]}'
+    )
+    parser = StreamItemParser(Topic)
+    seen = []
+    for i in range(0, len(raw), 7):
+        seen.append([t.short_title for t in parser.feed(raw[i:i + 7])])
+
+    completed = [titles for titles in seen if titles]
+    assert completed == [["A {x}"], ["B"]]
+    assert [t.first_message_id for t in parser.items] == [1, 2]
+    assert len(parser.finish(TopicsReply).topics) == 2
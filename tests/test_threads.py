@@ -0,0 +1,96 @@
+import os
+from datetime import datetime, timezone
+
+import pytest
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "test-token")
+os.environ.setdefault("GEMINI_API_KEY", "test-gemini-key")
+os.environ.setdefault("OPENAI_API_KEY", "test-openai-key")
+
+from src.tools.threads import ThreadResolver  # noqa: E402
+
+
+class FakeStore:
+    def __init__(self, positions=None):
+        self.positions = dict(positions or {})
+        self.lookups = []
+        self.timestamps = []
+
+    def __call__(self, chat_id, message_id, ts_utc=None):
+        self.lookups.append((chat_id, message_id))
+        self.timestamps.append(ts_utc)
+        return self.positions.get((chat_id, message_id))
+
+
+def test_replies_inherit_the_root_of_their_parent():
+    store = FakeStore()
+    threads = ThreadResolver(store, max_entries=100)
+
+    assert threads.resolve(1, 10, None) == (10, 0)
+    assert threads.resolve(1, 11, 10) == (10, 1)
+    assert threads.resolve(1, 12, 11) == (10, 2)
+    assert threads.resolve(1, 13, 10) == (10, 1)
+    # The parents were all served from memory
+    assert store.lookups == []
+
+
+def test_cache_miss_falls_back_to_the_store():
+    store = FakeStore({(1, 5): (3, 2)})
+    threads = ThreadResolver(store, max_entries=100)
+
+    assert threads.resolve(1, 20, 5, reply_to_ts_utc=500) == (3, 3)
+    assert threads.resolve(1, 21, 5) == (3, 3)
+    assert store.lookups == [(1, 5)]
+    # The parent's timestamp is handed to the store so it can read a single partition
+    assert store.timestamps == [500]
+
+
+def test_reply_to_an_unknown_message_roots_the_thread_there():
+    threads = ThreadResolver(FakeStore(), max_entries=100)
+
+    assert threads.resolve(1, 30, 7) == (7, 1)
+    assert threads.resolve(1, 31, 30) == (7, 2)
+    # Chats do not share message ids
+    assert threads.resolve(2, 32, 30) == (30, 1)
+
+
+def test_cache_is_bounded_lru():
+    store = FakeStore({(1, 1): (1, 0)})
+    threads = ThreadResolver(store, max_entries=2)
+
+    threads.resolve(1, 1, None)
+    threads.resolve(1, 2, None)
+    threads.position(1, 1)  # recently used
+    threads.resolve(1, 3, None)
+
+    assert len(threads) == 2
+    assert threads.position(1, 1) == (1, 0)
+    assert store.lookups == []
+    assert threads.position(1, 2) is None
+    assert store.lookups == [(1, 2)]
+
+
+needs_db = pytest.mark.skipif(not os.getenv("DATABASE_URL"), reason="DATABASE_URL not set")
+
+
+@needs_db
+def test_reply_chain_is_read_from_the_thread(monkeypatch):
+    from src.tools import db
+    db.init_db()
+    chat_id = -999_000_004
+    now = int(datetime.now(timezone.utc).timestamp())
+    try:
+        db.add_message(chat_id, 1, 1, "a", "A", "root", None, now)
+        db.add_message(chat_id, 2, 2, "b", "B", "side", 1, now + 1)
+        db.add_message(chat_id, 3, 3, "c", "C", "reply", 1, now + 2)
+        monkeypatch.setattr(db, "threads", ThreadResolver(db.get_thread_position, 10))  # force the DB fallback
+        db.add_message(chat_id, 4, 1, "a", "A", "deep", 3, now + 3, reply_to_ts_utc=now + 2)
+
+        assert db.get_thread_position(chat_id, 4) == (1, 2)
+        assert db.get_thread_position(chat_id, 4, now + 3) == (1, 2)
+        assert db.get_thread_position(chat_id, 4, now + 4) is None
+        assert [r["message_id"] for r in db.get_reply_chain(chat_id, 4)] == [4, 3, 1]
+        assert [r["message_id"] for r in db.get_reply_chain(chat_id, 4, max_depth=2)] == [4, 3]
+    finally:
+        with db.db() as conn:
+            conn.execute("DELETE FROM messages WHERE chat_id=%s", (chat_id,))
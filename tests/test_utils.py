@@ -7,19 +7,20 @@ from types import SimpleNamespace
 from zoneinfo import ZoneInfo
 import pytest
 
-import src.utils as utils
-
 # Ensure project root is on sys.path so `import src...` works
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 if str(PROJECT_ROOT) not in sys.path:
     sys.path.insert(0, str(PROJECT_ROOT))
 
 
-# Ensure required env vars before importing src.config/src.utils
+# Ensure required env vars before importing src.tools.config/src.tools.utils
 os.environ.setdefault("TELEGRAM_BOT_TOKEN", "test-token")
 os.environ.setdefault("GEMINI_API_KEY", "test-gemini-key")
+os.environ.setdefault("OPENAI_API_KEY", "test-openai-key")
 os.environ.setdefault("TZ", "Europe/Kyiv")
 
+import src.tools.utils as utils  # noqa: E402
+
 
 def test_utc_ts():
     dt_utc = datetime(2024, 1, 1, 0, 0, tzinfo=ZoneInfo("UTC"))
@@ -46,6 +47,15 @@ def test_local_midnight_bounds_cross_tz_day_boundary():
     assert end_local == datetime(2024, 1, 16, 0, 0, tzinfo=kyiv)
 
 
+def test_local_midnight_bounds_in_chat_timezone():
+    tokyo = ZoneInfo("Asia/Tokyo")
+    # 2024-01-14 16:30 UTC is already 2024-01-15 01:30 in Tokyo
+    utc_dt = datetime(2024, 1, 14, 16, 30, tzinfo=ZoneInfo("UTC"))
+    start_local, end_local = utils.local_midnight_bounds(utc_dt, tokyo)
+    assert start_local == datetime(2024, 1, 15, 0, 0, tzinfo=tokyo)
+    assert end_local == datetime(2024, 1, 16, 0, 0, tzinfo=tokyo)
+
+
 def test_message_link_with_username():
     chat = SimpleNamespace(id=-1001234567890, username="mychannel")
     url = utils.message_link(chat, 42)
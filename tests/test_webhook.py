@@ -0,0 +1,73 @@
+import asyncio
+import json
+import os
+import socket
+from pathlib import Path
+
+import pytest
+import pytest_asyncio
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "test-token")
+os.environ.setdefault("GEMINI_API_KEY", "test-gemini-key")
+os.environ.setdefault("OPENAI_API_KEY", "test-openai-key")
+
+pytest.importorskip("tornado")
+
+from telegram import Bot  # noqa: E402
+from tornado.httpclient import AsyncHTTPClient  # noqa: E402
+
+from src.tools import metrics  # noqa: E402
+from src.tools.webhook import SECRET_HEADER, make_app  # noqa: E402
+
+UPDATE = (Path(__file__).parent / "fixtures" / "update_text_message.json").read_bytes()
+
+
+@pytest_asyncio.fixture
+async def server():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    queue: asyncio.Queue = asyncio.Queue()
+    http_server = make_app(Bot("123:test"), queue, secret="s3cret").listen(port, address="127.0.0.1")
+    yield f"http://127.0.0.1:{port}", queue
+    http_server.stop()
+
+
+async def fetch(url, **kwargs):
+    return await AsyncHTTPClient().fetch(url, raise_error=False, **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_recorded_update_is_acknowledged_and_queued(server):
+    base, queue = server
+    resp = await fetch(f"{base}/telegram", method="POST", body=UPDATE, headers={SECRET_HEADER: "s3cret"})
+    assert resp.code == 200
+    update = queue.get_nowait()
+    assert update.update_id == json.loads(UPDATE)["update_id"]
+    assert update.effective_chat.id == -1001234567890
+    assert update.message.text == "Ботяндра, що думаєш?"
+
+
+@pytest.mark.asyncio
+async def test_wrong_secret_is_rejected(server):
+    base, queue = server
+    resp = await fetch(f"{base}/telegram", method="POST", body=UPDATE, headers={SECRET_HEADER: "nope"})
+    assert resp.code == 403
+    resp = await fetch(f"{base}/telegram", method="POST", body=UPDATE)
+    assert resp.code == 403
+    resp = await fetch(f"{base}/telegram", method="POST", body=b"{not json", headers={SECRET_HEADER: "s3cret"})
+    assert resp.code == 400
+    assert queue.empty()
+
+
+def test_empty_secret_is_refused():
+    with pytest.raises(ValueError):
+        make_app(Bot("123:test"), asyncio.Queue(), secret="")
+
+
+@pytest.mark.asyncio
+async def test_health_and_metrics(server):
+    base, _ = server
+    metrics.incr("webhook_updates")
+    assert (await fetch(f"{base}/healthz")).body == b"ok"
+    assert b"webhook_updates" in (await fetch(f"{base}/metrics")).body